@@ -1,39 +1,246 @@
 """Danmaku (comment) API endpoints"""
-from fastapi import APIRouter, HTTPException, Query
-from typing import Optional, List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, List
+import json
 
-from app.services.proxy_service import DanDanAPIProxy
-from app.services.danmaku_service import DanmakuConverter
+from app.config import settings
+from app.services.proxy_service import dandan_proxy
+from app.services.artifact_store import DanmakuArtifact, artifact_store
+from app.services.danmaku_filter import DanmakuFilter
+from app.services.danmaku_index import danmaku_index
+from app.services.danmaku_service import BINARY_MEDIA_TYPE, BilibiliXMLParser, DanmakuConverter
+from app.services.live_danmaku_log import live_danmaku_log, merge_timelines
+from app.services.prefetch_service import danmaku_prefetcher
 from app.schemas.danmaku import (
     DanmakuResponse,
+    DanmakuWindowResponse,
     ConvertRequest,
+    PrefetchRequest,
     XMLParseRequest
 )
 
 router = APIRouter()
-proxy = DanDanAPIProxy()
+proxy = dandan_proxy
+
+# Read size for streamed XML bodies
+XML_CHUNK_SIZE = 256 * 1024
+
+# Comments converted and serialized per chunk of a streamed response
+STREAM_BATCH_SIZE = 1000
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def danmaku_filter_params(
+    block_top: bool = Query(False, description="Drop top comments"),
+    block_bottom: bool = Query(False, description="Drop bottom comments"),
+    block_scroll: bool = Query(False, description="Drop scrolling comments"),
+    smart: bool = Query(False, description="Deduplicate and cap density with the server defaults"),
+    dedup_window: Optional[float] = Query(None, ge=0, description="Collapse repeated texts within this many seconds"),
+    max_per_second: Optional[int] = Query(None, ge=0, description="Maximum comments per second of playback")
+) -> DanmakuFilter:
+    """Server-side filter built from query parameters"""
+    if dedup_window is None:
+        dedup_window = settings.danmaku_smart_dedup_window if smart else 0
+    if max_per_second is None:
+        max_per_second = settings.danmaku_smart_max_per_second if smart else 0
+    
+    return DanmakuFilter(
+        block_top=block_top,
+        block_bottom=block_bottom,
+        block_scroll=block_scroll,
+        dedup_window=dedup_window,
+        max_per_second=max_per_second
+    )
+
+
+def _stream_media_type(request: Request, stream: bool) -> Optional[str]:
+    """Media type of a streamed response, or None for a regular one"""
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return NDJSON_MEDIA_TYPE
+    if stream:
+        return "application/json"
+    return None
+
+
+def _stream_danmaku(
+    comments: List[Dict[str, Any]],
+    count: int,
+    format: str,
+    media_type: str
+) -> StreamingResponse:
+    """
+    Serialize comments incrementally
+    
+    Comments are converted and encoded in batches, so the first bytes go
+    out right away and only one converted batch is held at a time. JSON
+    streams keep the DanmakuResponse shape; NDJSON streams carry one
+    comment per line with the count in the X-Danmaku-Count header.
+    """
+    if format != "raw" and format not in DanmakuConverter.supported_formats():
+        raise HTTPException(status_code=400, detail=f"Invalid format: Unsupported format: {format}")
+    
+    ndjson = media_type == NDJSON_MEDIA_TYPE
+    
+    def body() -> Iterator[bytes]:
+        if not ndjson:
+            yield f'{{"success":true,"count":{int(count)},"comments":['.encode()
+        
+        first = True
+        for start in range(0, len(comments), STREAM_BATCH_SIZE):
+            batch = comments[start:start + STREAM_BATCH_SIZE]
+            if format != "raw":
+                batch = DanmakuConverter.convert_batch(batch, format)
+            if not batch:
+                continue
+            
+            encoded = [json.dumps(comment, ensure_ascii=False) for comment in batch]
+            if ndjson:
+                yield ("\n".join(encoded) + "\n").encode()
+            else:
+                yield (("" if first else ",") + ",".join(encoded)).encode()
+            first = False
+        
+        if not ndjson:
+            yield b"]}"
+    
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"X-Danmaku-Count": str(count)}
+    )
+
+
+def _body_media_type(format: str) -> str:
+    """Media type of a non-streamed danmaku body"""
+    return BINARY_MEDIA_TYPE if format == "binary" else "application/json"
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match names the artifact's ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or f'"{etag}"' in tags or f'W/"{etag}"' in tags
+
+
+async def _artifact_response(
+    request: Request,
+    artifact: DanmakuArtifact,
+    media_type: str,
+    body: Optional[bytes] = None
+) -> Response:
+    """
+    Serve a stored artifact
+    
+    Answers 304 when the client already has it, otherwise sends the stored
+    bytes in the best encoding the client accepts. Identity requests get
+    the uncompressed body (body, when the caller still has it).
+    """
+    headers = {
+        "ETag": f'"{artifact.etag}"',
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "no-cache"
+    }
+    
+    if _etag_matches(request, artifact.etag):
+        return Response(status_code=304, headers=headers)
+    
+    encoding = artifact.negotiate(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        content = await artifact_store.read(artifact, encoding)
+    else:
+        content = body if body is not None else await artifact_store.read(artifact, None)
+    
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+async def _stored_response(request: Request, key: str, revision: int, media_type: str) -> Optional[Response]:
+    """
+    Serve the stored artifact of a key, None if there is none
+    
+    When the artifact was replaced (e.g. by another worker) since its
+    metadata was cached, its current metadata is looked up once more.
+    """
+    for _ in range(2):
+        artifact = await artifact_store.get(key, revision)
+        if artifact is None:
+            return None
+        try:
+            return await _artifact_response(request, artifact, media_type)
+        except FileNotFoundError:
+            artifact_store.forget(key)
+    return None
 
 
 @router.get("/{episode_id}")
 async def get_danmaku(
+    request: Request,
     episode_id: int,
-    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl"),
+    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl, binary"),
     with_related: bool = Query(True, description="Include related comments"),
-    ch_convert: Optional[int] = Query(None, description="Chinese conversion: 0=none, 1=simplified, 2=traditional")
+    ch_convert: Optional[int] = Query(None, description="Chinese conversion: 0=none, 1=simplified, 2=traditional"),
+    stream: bool = Query(False, description="Stream the response (or send Accept: application/x-ndjson)"),
+    danmaku_filter: DanmakuFilter = Depends(danmaku_filter_params)
 ):
     """
     Get danmaku for an episode
     
+    Blocked modes, near-duplicate texts and over-dense seconds can be
+    dropped on the server (see danmaku_filter_params), which returns the
+    remaining comments sorted by time.
+    
+    Non-streamed responses are kept pre-compressed on disk per episode,
+    format and filter, and served with an ETag (304 on If-None-Match).
+    format=binary returns the packed columnar encoding described in
+    danmaku_service (decoded by decodeBinaryDanmaku in app.js).
+    
+    Live danmaku sent for the episode over the WebSocket is merged in by
+    time with the upstream comments.
+    
     Args:
         episode_id: Episode ID from match result
         format: Output format
         with_related: Include related comments
         ch_convert: Chinese conversion option
+        stream: Serialize comments incrementally
+        danmaku_filter: Server-side filter
         
     Returns:
         Danmaku data
     """
+    # The binary format is a single packed body, never streamed
+    media_type = None if format == "binary" else _stream_media_type(request, stream)
+    
     try:
+        live = await live_danmaku_log.timeline(episode_id)
+        # As of now: while upstream is fetched, appends only go to the tail
+        # and a compaction replaces the timeline's lists
+        live_sources = live.sources()
+        live_generation = live.generation
+        artifact_key = None
+        # Artifacts hold the upstream and compacted live comments, so they
+        # only change with the log's generation; live comments still in the
+        # tail are served by building the response
+        if (
+            media_type is None
+            and settings.danmaku_artifacts_enabled
+            and settings.comment_cache_enabled
+            and not live.tail_times
+        ):
+            artifact_key = artifact_store.episode_key(
+                episode_id, format, with_related, ch_convert, vars(danmaku_filter)
+            )
+            live_sources = live_sources[:1]
+        
+        if artifact_key is not None:
+            stored = await _stored_response(request, artifact_key, live_generation, _body_media_type(format))
+            if stored is not None:
+                return stored
+        
         result = await proxy.get_comments(
             episode_id=episode_id,
             with_related=with_related,
@@ -47,6 +254,111 @@ async def get_danmaku(
         comments = result.get("comments", [])
         count = result.get("count", 0)
         
+        # Merge live danmaku and filter over the time-sorted index
+        if danmaku_filter.active or len(live):
+            timeline = danmaku_index.get((episode_id, with_related, ch_convert), result)
+            times, comments = merge_timelines((timeline.times, timeline.comments), *live_sources)
+            if danmaku_filter.active:
+                comments = danmaku_filter.apply(comments, times)
+            count = len(comments)
+        
+        # Stream the response if requested
+        if media_type:
+            return _stream_danmaku(comments, count, format, media_type)
+        
+        if artifact_key is None and format != "binary":
+            # Convert format if requested
+            if format != "raw" and comments:
+                try:
+                    comments = DanmakuConverter.convert_batch(comments, format)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid format: {str(e)}")
+            
+            return DanmakuResponse(
+                success=True,
+                count=count,
+                comments=comments
+            )
+        
+        try:
+            body = DanmakuConverter.encode_response(comments, count, format)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid format: {str(e)}")
+        
+        body_type = _body_media_type(format)
+        if artifact_key is None:
+            return Response(content=body, media_type=body_type)
+        
+        try:
+            artifact = await artifact_store.put(artifact_key, body, live_generation)
+        except OSError as e:
+            print(f"Failed to store danmaku artifact: {e}")
+            return Response(content=body, media_type=body_type)
+        try:
+            return await _artifact_response(request, artifact, body_type, body)
+        except FileNotFoundError:
+            # Already replaced by another worker
+            return Response(content=body, media_type=body_type)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get danmaku: {str(e)}")
+
+
+@router.get("/{episode_id}/window", response_model=DanmakuWindowResponse)
+async def get_danmaku_window(
+    episode_id: int,
+    start: float = Query(0, ge=0, description="Window start in seconds (inclusive)"),
+    end: float = Query(..., gt=0, description="Window end in seconds (exclusive)"),
+    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl"),
+    with_related: bool = Query(True, description="Include related comments"),
+    ch_convert: Optional[int] = Query(None, description="Chinese conversion: 0=none, 1=simplified, 2=traditional"),
+    danmaku_filter: DanmakuFilter = Depends(danmaku_filter_params)
+):
+    """
+    Get the danmaku of an episode within a time window
+    
+    The episode's comments are indexed by time once, each window is then a
+    bisect over the index, so players can fetch danmaku progressively
+    alongside playback.
+    
+    Args:
+        episode_id: Episode ID from match result
+        start: Window start in seconds
+        end: Window end in seconds
+        format: Output format
+        with_related: Include related comments
+        ch_convert: Chinese conversion option
+        danmaku_filter: Server-side filter
+        
+    Returns:
+        Danmaku data for the window
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be greater than start")
+    
+    try:
+        result = await proxy.get_comments(
+            episode_id=episode_id,
+            with_related=with_related,
+            ch_convert=ch_convert
+        )
+        
+        if not result.get("success", False):
+            error_msg = result.get("errorMessage", "Failed to get comments")
+            raise HTTPException(status_code=400, detail=error_msg)
+        
+        timeline = danmaku_index.get((episode_id, with_related, ch_convert), result)
+        live = await live_danmaku_log.timeline(episode_id)
+        lo, hi = timeline.span(start, end)
+        times, comments = merge_timelines(
+            (timeline.times[lo:hi], timeline.comments[lo:hi]),
+            *live.window(start, end)
+        )
+        comments = danmaku_filter.apply(comments, times)
+        count = len(comments)
+        
         # Convert format if requested
         if format != "raw" and comments:
             try:
@@ -54,10 +366,13 @@ async def get_danmaku(
             except ValueError as e:
                 raise HTTPException(status_code=400, detail=f"Invalid format: {str(e)}")
         
-        return DanmakuResponse(
+        return DanmakuWindowResponse(
             success=True,
             count=count,
-            comments=comments
+            comments=comments,
+            start=start,
+            end=end,
+            total=len(timeline) + len(live)
         )
         
     except HTTPException:
@@ -66,10 +381,59 @@ async def get_danmaku(
         raise HTTPException(status_code=500, detail=f"Failed to get danmaku: {str(e)}")
 
 
+@router.post("/prefetch")
+async def prefetch_danmaku(request: PrefetchRequest):
+    """
+    Prefetch danmaku for the episodes after the one now playing
+    
+    The next settings.danmaku_prefetch_depth playlist entries are matched
+    and their danmaku cached in the background, so it is ready when the
+    playlist advances.
+    
+    Args:
+        request: Playlist order and the index now playing
+    
+    Returns:
+        Number of entries scheduled
+    """
+    if request.format not in ("raw", "binary") and request.format not in DanmakuConverter.supported_formats():
+        raise HTTPException(status_code=400, detail=f"Invalid format: Unsupported format: {request.format}")
+    
+    start = request.current_index + 1
+    upcoming = request.playlist[start:start + settings.danmaku_prefetch_depth]
+    scheduled = danmaku_prefetcher.schedule(
+        [item.model_dump() for item in upcoming],
+        request.format
+    )
+    
+    return {
+        "success": True,
+        "scheduled": scheduled
+    }
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Get episode comment cache statistics
+    
+    Returns:
+        Hit/miss counters and cache usage
+    """
+    return {
+        "success": True,
+        "enabled": settings.comment_cache_enabled,
+        "ttl": settings.comment_cache_ttl,
+        **proxy.comment_cache.stats()
+    }
+
+
 @router.post("/external")
 async def get_external_danmaku(
+    request: Request,
     url: str,
-    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl")
+    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl"),
+    stream: bool = Query(False, description="Stream the response (or send Accept: application/x-ndjson)")
 ):
     """
     Get danmaku from external sources (Bilibili, AcFun, etc.)
@@ -77,6 +441,7 @@ async def get_external_danmaku(
     Args:
         url: URL of the external video
         format: Output format
+        stream: Serialize comments incrementally
         
     Returns:
         Danmaku data
@@ -94,6 +459,11 @@ async def get_external_danmaku(
         comments = result.get("comments", [])
         count = result.get("count", 0)
         
+        # Stream the response if requested
+        media_type = _stream_media_type(request, stream)
+        if media_type:
+            return _stream_danmaku(comments, count, format, media_type)
+        
         # Convert format if requested
         if format != "raw" and comments:
             try:
@@ -116,14 +486,18 @@ async def get_external_danmaku(
 @router.post("/parse/xml")
 async def parse_xml_danmaku(
     request: XMLParseRequest,
-    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl")
+    http_request: Request,
+    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl"),
+    stream: bool = Query(False, description="Stream the response (or send Accept: application/x-ndjson)")
 ):
     """
     Parse XML danmaku (Bilibili format)
     
     Args:
         request: XML content to parse
+        http_request: Incoming HTTP request
         format: Output format
+        stream: Serialize comments incrementally
         
     Returns:
         Parsed danmaku data
@@ -132,6 +506,11 @@ async def parse_xml_danmaku(
         comments = DanmakuConverter.parse_bilibili_xml(request.xml_content)
         count = len(comments)
         
+        # Stream the response if requested
+        media_type = _stream_media_type(http_request, stream)
+        if media_type:
+            return _stream_danmaku(comments, count, format, media_type)
+        
         # Convert format if requested
         if format != "raw" and comments:
             try:
@@ -145,6 +524,84 @@ async def parse_xml_danmaku(
             comments=comments
         )
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse XML: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+async def _xml_body_chunks(request: Request) -> AsyncIterator[bytes]:
+    """Yield an XML document from a raw body or a multipart "file" field"""
+    content_type = request.headers.get("content-type", "")
+    
+    if content_type.startswith("multipart/form-data"):
+        # Multipart files are spooled to disk by the form parser
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="XML file is required")
+        try:
+            while True:
+                chunk = await upload.read(XML_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            await form.close()
+    else:
+        async for chunk in request.stream():
+            yield chunk
+
+
+@router.post("/parse/xml/stream")
+async def parse_xml_danmaku_stream(
+    request: Request,
+    format: str = Query("raw", description="Output format: raw, nplayer, artplayer, ccl")
+):
+    """
+    Parse XML danmaku (Bilibili format) sent as a streamed body
+    
+    The XML is either the raw request body or the "file" field of a
+    multipart upload. It is parsed incrementally, so the document is never
+    held in memory as a whole.
+    
+    Args:
+        request: Request carrying the XML document
+        format: Output format
+        
+    Returns:
+        Parsed danmaku data
+    """
+    parser = BilibiliXMLParser(use_lxml=True)
+    comments = []
+    count = 0
+    
+    def collect(batch):
+        nonlocal count
+        count += len(batch)
+        # Convert as we go so raw and converted lists are never both held
+        if format != "raw" and batch:
+            try:
+                batch = DanmakuConverter.convert_batch(batch, format)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid format: {str(e)}")
+        comments.extend(batch)
+    
+    try:
+        async for chunk in _xml_body_chunks(request):
+            collect(parser.feed(chunk))
+        collect(parser.close())
+        
+        return DanmakuResponse(
+            success=True,
+            count=count,
+            comments=comments
+        )
+        
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Failed to parse XML: {str(e)}")
     except Exception as e:
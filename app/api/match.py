@@ -1,12 +1,45 @@
 """Match API endpoints"""
 from fastapi import APIRouter, HTTPException
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import AsyncIterator, Dict
 
-from app.services.proxy_service import DanDanAPIProxy
-from app.schemas.match import MatchRequest, MatchResponse
+from app.config import settings
+from app.services.proxy_service import dandan_proxy
+from app.schemas.match import BatchMatchItem, BatchMatchRequest, MatchInfo, MatchRequest, MatchResponse
 
 router = APIRouter()
-proxy = DanDanAPIProxy()
+proxy = dandan_proxy
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _match_info(match: Dict) -> MatchInfo:
+    """MatchInfo for an upstream (camelCase) match entry"""
+    return MatchInfo(
+        episode_id=match.get("episodeId"),
+        anime_id=match.get("animeId"),
+        anime_title=match.get("animeTitle") or "",
+        episode_title=match.get("episodeTitle") or "",
+        type=match.get("type") or "",
+        type_description=match.get("typeDescription") or "",
+        shift=match.get("shift") or 0
+    )
+
+
+def _match_response(result: Dict) -> MatchResponse:
+    """
+    MatchResponse for an upstream match result
+    
+    Raises:
+        ValidationError: The upstream result has no usable episode or anime ID
+    """
+    return MatchResponse(
+        success=result.get("success", False),
+        is_matched=result.get("isMatched", False),
+        matches=[_match_info(match) for match in result.get("matches") or []],
+        error_message=result.get("errorMessage")
+    )
 
 
 @router.post("/", response_model=MatchResponse)
@@ -29,17 +62,62 @@ async def match_video(request: MatchRequest):
             match_mode=request.match_mode
         )
         
-        return MatchResponse(
-            success=result.get("success", False),
-            is_matched=result.get("isMatched", False),
-            matches=result.get("matches", []),
-            error_message=result.get("errorMessage")
-        )
+        return _match_response(result)
         
+    except ValidationError as e:
+        raise HTTPException(status_code=502, detail=f"Invalid upstream match result: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Match failed: {str(e)}")
 
 
+@router.post("/batch")
+async def match_videos(request: BatchMatchRequest):
+    """
+    Match several videos at once
+    
+    Files are resolved concurrently (cache, then the upstream batch match,
+    then one by one) and each result is streamed back as a line of NDJSON
+    as soon as it is known, in completion order.
+    
+    Args:
+        request: Match requests for each file
+    
+    Returns:
+        NDJSON stream of BatchMatchItem, one per file
+    """
+    if not request.requests:
+        raise HTTPException(status_code=400, detail="At least one file is required")
+    if len(request.requests) > settings.match_batch_max_files:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files, at most {settings.match_batch_max_files} per batch"
+        )
+    
+    files = [item.model_dump() for item in request.requests]
+    
+    async def body() -> AsyncIterator[bytes]:
+        async for index, result in proxy.match_videos(files, settings.match_batch_concurrency):
+            try:
+                response = _match_response(result)
+            except ValidationError as e:
+                # Report it as a failed lookup, not as "no match found"
+                print(f"Invalid upstream match result for {files[index]['file_name']}: {e}")
+                response = MatchResponse(
+                    success=False,
+                    is_matched=False,
+                    matches=[],
+                    error_message=f"Invalid upstream match result: {str(e)}"
+                )
+            item = BatchMatchItem(
+                index=index,
+                file_hash=files[index]["file_hash"],
+                **response.model_dump()
+            )
+            yield (item.model_dump_json() + "\n").encode()
+    
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+
 @router.get("/search")
 async def search_anime(keyword: str):
     """
@@ -1,17 +1,26 @@
 """Settings API endpoints"""
 from fastapi import APIRouter, HTTPException
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import json
 import os
 from pathlib import Path
 
 from app.config import settings as app_settings
+from app.services.state_backend import shared_state
 
 router = APIRouter()
 
 # Settings file path
 SETTINGS_FILE = Path("user_settings.json")
 
+# Shared state namespace, key and channel of the user settings
+SETTINGS_NAMESPACE = "settings"
+SETTINGS_KEY = "user"
+SETTINGS_CHANNEL = "settings"
+
+# Settings file keys applied at startup; the others only apply when saved
+STARTUP_SETTINGS = {"network": ("enableCache", "cacheExpiry")}
+
 
 @router.get("/")
 async def get_settings():
@@ -21,12 +30,13 @@ async def get_settings():
     Returns:
         User settings object
     """
-    if SETTINGS_FILE.exists():
-        try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading settings: {e}")
+    shared = await shared_state.get(SETTINGS_NAMESPACE, SETTINGS_KEY)
+    if shared is not None:
+        return shared
+    
+    saved = _load_settings_file()
+    if saved is not None:
+        return saved
     
     # Return default settings
     return get_default_settings()
@@ -47,8 +57,11 @@ async def save_settings(settings: Dict[str, Any]):
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(settings, f, ensure_ascii=False, indent=2)
         
-        # Apply some settings immediately
+        # Apply some settings immediately, in every worker
         apply_settings(settings)
+        await shared_state.set(SETTINGS_NAMESPACE, SETTINGS_KEY, settings)
+        if shared_state.distributed:
+            await shared_state.publish(SETTINGS_CHANNEL, settings)
         
         return {"success": True, "message": "Settings saved successfully"}
     except Exception as e:
@@ -66,11 +79,23 @@ async def reset_settings():
     try:
         if SETTINGS_FILE.exists():
             os.remove(SETTINGS_FILE)
+        await shared_state.delete(SETTINGS_NAMESPACE, SETTINGS_KEY)
         return {"success": True, "settings": get_default_settings()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to reset settings: {str(e)}")
 
 
+def _load_settings_file() -> Optional[Dict[str, Any]]:
+    """Settings saved in SETTINGS_FILE, None if there are none"""
+    if SETTINGS_FILE.exists():
+        try:
+            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading settings: {e}")
+    return None
+
+
 def get_default_settings() -> Dict[str, Any]:
     """Get default settings"""
     return {
@@ -132,3 +157,44 @@ def apply_settings(settings: Dict[str, Any]):
         if "useProxy" in settings["network"]:
             if not settings["network"]["useProxy"]:
                 app_settings.dandan_proxy_url = None
+        if "enableCache" in settings["network"]:
+            app_settings.comment_cache_enabled = bool(settings["network"]["enableCache"])
+        if "cacheExpiry" in settings["network"]:
+            app_settings.comment_cache_ttl = int(settings["network"]["cacheExpiry"])
+
+
+async def _apply_published_settings(settings: Dict[str, Any]):
+    apply_settings(settings)
+
+
+def _startup_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """The STARTUP_SETTINGS part of saved settings"""
+    selected = {}
+    for section, keys in STARTUP_SETTINGS.items():
+        values = settings.get(section)
+        if isinstance(values, dict):
+            selected[section] = {key: values[key] for key in keys if key in values}
+    return selected
+
+
+async def load_shared_settings():
+    """
+    Apply the saved settings at startup and follow later changes
+    
+    Settings saved by any worker (shared state) are applied in full. When
+    there are none, only the STARTUP_SETTINGS of the settings file are
+    applied, so it can't override the server configuration (upload limit,
+    upstream URLs) from the environment.
+    """
+    shared = await shared_state.get(SETTINGS_NAMESPACE, SETTINGS_KEY)
+    if shared is None:
+        saved = _load_settings_file()
+        if isinstance(saved, dict):
+            shared = _startup_settings(saved)
+    if shared is not None:
+        try:
+            apply_settings(shared)
+        except (TypeError, ValueError) as e:
+            print(f"Error applying saved settings: {e}")
+    if shared_state.distributed:
+        shared_state.listen(SETTINGS_CHANNEL, _apply_published_settings)
\ No newline at end of file
@@ -1,90 +1,101 @@
 """Video API endpoints"""
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Header, Response
+from fastapi import APIRouter, HTTPException, Header, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from typing import Optional
 import os
-import re
-import uuid
 import aiofiles
 from pathlib import Path
 
+from app.api.websocket import manager
 from app.config import settings
-from app.services.md5_service import MD5Service
+from app.core.exceptions import InvalidUploadException, UploadTooLargeException
+from app.services.md5_service import MD5Service, ProgressCallback
+from app.services.stream_service import RangeFileResponse, parse_range, range_headers
+from app.services.upload_service import StreamingUploadReceiver
+from app.services.video_registry import video_registry
 from app.schemas.video import VideoInfo, VideoUploadResponse
 
 router = APIRouter()
 
-# Store for video MD5 results (in production, use Redis or database)
-video_md5_store = {}
+
+def _md5_progress_reporter(client_id: Optional[str], video_id: Optional[str] = None) -> Optional[ProgressCallback]:
+    """Push MD5 progress to the WebSocket of the client that asked, if any"""
+    if not client_id:
+        return None
+    
+    async def report(hashed: int, total: int):
+        try:
+            await manager.send_personal_message(
+                {
+                    "type": "md5_progress",
+                    "video_id": video_id,
+                    "progress": round(hashed * 100 / total, 1) if total else 100.0,
+                    "done": hashed >= total
+                },
+                client_id
+            )
+        except Exception as e:
+            print(f"Failed to send MD5 progress: {e}")
+    
+    return report
 
 
 @router.post("/upload", response_model=VideoUploadResponse)
 async def upload_video(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
+    request: Request,
+    client_id: Optional[str] = Query(None, description="WebSocket client to push MD5 progress to")
 ):
     """
     Upload a video file
     
+    The multipart body is streamed to disk in bounded chunks, so memory use
+    does not grow with the file size and oversized uploads are rejected as
+    soon as they cross the limit. The DanDanPlay MD5 is hashed inline from
+    the same stream and is returned with the upload response; its progress
+    is pushed as "md5_progress" messages over /ws/{client_id}.
+    
     Args:
-        file: Video file to upload
+        request: Multipart request with the video in the "file" field
+        client_id: WebSocket client ID of the uploader
         
     Returns:
         Video information and upload status
     """
-    # Check file size
-    if file.size and file.size > settings.max_upload_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Maximum size is {settings.max_upload_size / (1024**3):.2f} GB"
-        )
-    
-    # Check file type
-    if not file.content_type or not file.content_type.startswith('video/'):
-        # Also allow some common video extensions
-        allowed_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm']
-        file_ext = Path(file.filename).suffix.lower() if file.filename else ''
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Please upload a video file."
-            )
-    
-    # Generate unique file ID
-    file_id = str(uuid.uuid4())
-    file_ext = Path(file.filename).suffix if file.filename else '.mp4'
-    file_path = os.path.join(settings.upload_dir, f"{file_id}{file_ext}")
+    receiver = StreamingUploadReceiver(
+        upload_dir=settings.upload_dir,
+        max_size=settings.max_upload_size,
+        chunk_size=settings.upload_chunk_size,
+        on_md5_progress=_md5_progress_reporter(client_id)
+    )
     
     # Save file
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        upload = await receiver.receive(request.headers, request.stream())
+    except UploadTooLargeException as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUploadException as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
     
-    # Get file size
-    file_size = os.path.getsize(file_path)
+    file_id = upload.id
+    file_path = upload.path
+    file_size = upload.size
+    
+    # MD5 was computed while streaming, no need to re-read the file
+    record = video_registry.add(file_id, file_path, md5=upload.md5)
+    await video_registry.share(record)
     
     # Prepare response
     video_info = VideoInfo(
         id=file_id,
-        name=file.filename or "unknown.mp4",
+        name=upload.name,
         size=file_size,
         path=file_path,
-        url=f"/api/video/stream/{file_id}"
+        url=f"/api/video/stream/{file_id}",
+        md5=upload.md5
     )
     
-    # Calculate MD5 in background
-    async def calculate_and_store_md5():
-        try:
-            md5_hash = await MD5Service.calculate_file_md5(file_path)
-            video_md5_store[file_id] = md5_hash
-        except Exception as e:
-            print(f"Failed to calculate MD5: {e}")
-    
-    background_tasks.add_task(calculate_and_store_md5)
-    
     return VideoUploadResponse(
         success=True,
         message="Video uploaded successfully",
@@ -93,32 +104,42 @@ async def upload_video(
 
 
 @router.get("/md5/{video_id}")
-async def get_video_md5(video_id: str):
+async def get_video_md5(
+    video_id: str,
+    client_id: Optional[str] = Query(None, description="WebSocket client to push MD5 progress to")
+):
     """
     Get MD5 hash of a video
     
+    A missing MD5 is calculated before responding, with its progress pushed
+    as "md5_progress" messages over /ws/{client_id}, so there is no need
+    to poll.
+    
     Args:
         video_id: Video ID
+        client_id: WebSocket client ID of the caller
         
     Returns:
         MD5 hash if available
     """
-    md5_hash = video_md5_store.get(video_id)
+    record = await video_registry.lookup(video_id)
     
-    if md5_hash:
-        return {"md5": md5_hash, "ready": True}
-    else:
+    if record and record.md5:
+        return {"md5": record.md5, "ready": True}
+    elif record:
         # Try to calculate if file exists
-        video_files = list(Path(settings.upload_dir).glob(f"{video_id}.*"))
-        if video_files:
-            try:
-                md5_hash = await MD5Service.calculate_file_md5(str(video_files[0]))
-                video_md5_store[video_id] = md5_hash
-                return {"md5": md5_hash, "ready": True}
-            except Exception as e:
-                return {"md5": None, "ready": False, "error": str(e)}
-        
-        return {"md5": None, "ready": False}
+        try:
+            md5_hash = await MD5Service.calculate_file_md5(
+                record.path,
+                on_progress=_md5_progress_reporter(client_id, video_id)
+            )
+            record.md5 = md5_hash
+            await video_registry.share(video_registry.set_md5(video_id, md5_hash) or record)
+            return {"md5": md5_hash, "ready": True}
+        except Exception as e:
+            return {"md5": None, "ready": False, "error": str(e)}
+    
+    return {"md5": None, "ready": False}
 
 
 @router.get("/stream/{video_id}")
@@ -129,6 +150,11 @@ async def stream_video(
     """
     Stream video with range support
     
+    The transfer path is chosen by settings.video_stream_mode: "stream"
+    reads through aiofiles, "pread" reads large chunks with os.pread (or
+    hands the file to servers that support a zero-copy send) and "accel"
+    delegates the whole response to nginx, which sends it with sendfile.
+    
     Args:
         video_id: Video ID
         range: Range header for partial content
@@ -137,23 +163,37 @@ async def stream_video(
         Video stream
     """
     # Find video file
-    video_files = list(Path(settings.upload_dir).glob(f"{video_id}.*"))
-    if not video_files:
+    record = await video_registry.lookup(video_id)
+    if not record:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    video_path = str(video_files[0])
-    video_size = os.path.getsize(video_path)
+    video_path = record.path
+    video_size = record.size
+    content_type = record.content_type
+    
+    if settings.video_stream_mode == "accel":
+        # Let nginx serve the file (and the range) with sendfile
+        return Response(
+            headers={
+                'X-Accel-Redirect': f"{settings.video_accel_prefix}{Path(video_path).name}",
+                'Content-Type': content_type,
+            }
+        )
     
     # Parse range header
-    start = 0
-    end = video_size - 1
-    
-    if range:
-        match = re.search(r'bytes=(\d+)-(\d*)', range)
-        if match:
-            start = int(match.group(1))
-            if match.group(2):
-                end = int(match.group(2))
+    start, end = parse_range(range, video_size)
+    headers = range_headers(start, end, video_size, content_type)
+    status_code = 206 if range else 200
+    
+    # "sendfile" is the former name of "pread"
+    if settings.video_stream_mode in ("pread", "sendfile"):
+        return RangeFileResponse(
+            video_path,
+            start,
+            end,
+            status_code=status_code,
+            headers=headers
+        )
     
     # Create streaming response
     async def iterfile():
@@ -170,29 +210,9 @@ async def stream_video(
                 current += len(data)
                 yield data
     
-    # Determine content type
-    file_ext = Path(video_path).suffix.lower()
-    content_types = {
-        '.mp4': 'video/mp4',
-        '.webm': 'video/webm',
-        '.mkv': 'video/x-matroska',
-        '.avi': 'video/x-msvideo',
-        '.mov': 'video/quicktime',
-        '.wmv': 'video/x-ms-wmv',
-        '.flv': 'video/x-flv'
-    }
-    content_type = content_types.get(file_ext, 'video/mp4')
-    
-    headers = {
-        'Content-Range': f'bytes {start}-{end}/{video_size}',
-        'Accept-Ranges': 'bytes',
-        'Content-Length': str(end - start + 1),
-        'Content-Type': content_type,
-    }
-    
     return StreamingResponse(
         iterfile(),
-        status_code=206 if range else 200,
+        status_code=status_code,
         headers=headers
     )
 
@@ -208,17 +228,18 @@ async def delete_video(video_id: str):
     Returns:
         Deletion status
     """
-    video_files = list(Path(settings.upload_dir).glob(f"{video_id}.*"))
+    record = await video_registry.lookup(video_id)
     
-    if not video_files:
+    if not record:
         raise HTTPException(status_code=404, detail="Video not found")
     
     try:
-        for file_path in video_files:
-            file_path.unlink()
+        if os.path.exists(record.path):
+            os.remove(record.path)
         
-        # Remove from MD5 store
-        video_md5_store.pop(video_id, None)
+        # Remove from registry
+        video_registry.remove(video_id)
+        await video_registry.unshare(video_id)
         
         return {"success": True, "message": "Video deleted successfully"}
     except Exception as e:
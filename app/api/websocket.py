@@ -1,58 +1,259 @@
 """WebSocket endpoints"""
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Set
+import asyncio
 import json
+import time
+
+from app.config import settings
+from app.services.live_danmaku import LiveDanmakuBatcher
+from app.services.live_danmaku_log import live_danmaku_log, live_episode_id
+from app.services.room_sync import RoomSync
+from app.services.state_backend import NODE_ID, shared_state
 
 router = APIRouter()
 
+# Shared state channel and namespace for clients connected to other workers
+WS_CHANNEL = "ws"
+WS_PRESENCE = "ws_clients"
+
+# Room of clients that did not join one
+DEFAULT_ROOM = "lobby"
+
+
+def serialize(message: dict) -> str:
+    """Encode a message the way WebSocket.send_json does"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class ClientConnection:
+    """
+    One WebSocket and its bounded send queue
+    
+    A writer task drains the queue, so a slow socket only delays its own
+    messages. When the queue is full the oldest pending message is dropped.
+    """
+    
+    def __init__(self, websocket: WebSocket, client_id: str):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.room = DEFAULT_ROOM
+        self.dropped = 0
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(settings.ws_send_queue_size, 1))
+        self._writer = asyncio.ensure_future(self._write())
+    
+    def enqueue(self, text: str):
+        """Queue a serialized message without waiting for the socket"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(text)
+    
+    async def _write(self):
+        while True:
+            text = await self.queue.get()
+            try:
+                await self.websocket.send_text(text)
+            except Exception:
+                # Socket closed, the receive loop disconnects the client
+                return
+    
+    async def close(self):
+        """Stop the writer task"""
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+
 
 class ConnectionManager:
-    """WebSocket connection manager"""
+    """
+    WebSocket connection manager
+    
+    Clients are grouped in rooms (e.g. "episode:<id>" for everyone watching
+    an episode, or "session:<id>" for a watch party); danmaku and sync
+    messages only reach the sender's room. A message is serialized once and
+    the same text is queued for every recipient, whose writer tasks send it
+    concurrently.
+    
+    Sockets live in the worker that accepted them. Which worker holds each
+    client is kept in the shared state, and messages for clients of other
+    workers (and broadcasts) travel over its pub/sub channel.
+    """
     
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.rooms: Dict[str, Set[str]] = {}
+    
+    def start(self):
+        """Deliver messages published by other workers"""
+        if shared_state.distributed:
+            shared_state.listen(WS_CHANNEL, self._on_message)
     
-    async def connect(self, websocket: WebSocket, client_id: str):
+    async def close(self):
+        """Stop every writer task"""
+        connections = list(self.active_connections.values())
+        self.active_connections.clear()
+        self.rooms.clear()
+        await asyncio.gather(*(connection.close() for connection in connections))
+    
+    async def connect(self, websocket: WebSocket, client_id: str, room: Optional[str] = None):
         """Accept and store a new WebSocket connection"""
         await websocket.accept()
-        self.active_connections[client_id] = websocket
-    
-    def disconnect(self, client_id: str):
-        """Remove a WebSocket connection"""
         if client_id in self.active_connections:
-            del self.active_connections[client_id]
+            await self.disconnect(client_id)
+        self.active_connections[client_id] = ClientConnection(websocket, client_id)
+        self.join(client_id, room or DEFAULT_ROOM)
+        await shared_state.set(WS_PRESENCE, client_id, NODE_ID)
+    
+    async def disconnect(self, client_id: str) -> Optional[str]:
+        """
+        Remove a WebSocket connection
+        
+        Returns:
+            Room the client was in, None if it was not connected here
+        """
+        room = self.leave(client_id)
+        connection = self.active_connections.pop(client_id, None)
+        if connection is not None:
+            await connection.close()
+        if await shared_state.get(WS_PRESENCE, client_id) == NODE_ID:
+            await shared_state.delete(WS_PRESENCE, client_id)
+        return room
+    
+    def join(self, client_id: str, room: str):
+        """Move a connected client to a room"""
+        connection = self.active_connections.get(client_id)
+        if connection is None:
+            return
+        self.leave(client_id)
+        connection.room = room
+        self.rooms.setdefault(room, set()).add(client_id)
+    
+    def leave(self, client_id: str) -> Optional[str]:
+        """Take a client out of its room, returning that room"""
+        connection = self.active_connections.get(client_id)
+        if connection is None:
+            return None
+        members = self.rooms.get(connection.room)
+        if members is not None:
+            members.discard(client_id)
+            if not members:
+                del self.rooms[connection.room]
+        return connection.room
+    
+    def room_of(self, client_id: str) -> Optional[str]:
+        """Room a local client is in"""
+        connection = self.active_connections.get(client_id)
+        return connection.room if connection is not None else None
     
     async def send_personal_message(self, message: dict, client_id: str):
         """Send a message to a specific client"""
         if client_id in self.active_connections:
-            websocket = self.active_connections[client_id]
-            await websocket.send_json(message)
+            self.active_connections[client_id].enqueue(serialize(message))
+        elif shared_state.distributed and await shared_state.get(WS_PRESENCE, client_id):
+            await shared_state.publish(WS_CHANNEL, {"target": client_id, "data": serialize(message)})
     
-    async def broadcast(self, message: dict):
-        """Broadcast a message to all connected clients"""
-        for client_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_json(message)
-            except:
-                # Client might be disconnected
-                pass
+    async def broadcast(self, message: dict, room: Optional[str] = None):
+        """
+        Send a message to every client of a room
+        
+        Args:
+            message: Message to send
+            room: Room to send to, None for every connected client
+        """
+        data = serialize(message)
+        if shared_state.distributed:
+            # Every worker, this one included, delivers to its own clients
+            await shared_state.publish(WS_CHANNEL, {"room": room, "data": data})
+        else:
+            self._fan_out(data, room)
+    
+    def _fan_out(self, data: str, room: Optional[str]):
+        if room is None:
+            recipients = list(self.active_connections)
+        else:
+            recipients = list(self.rooms.get(room, ()))
+        for client_id in recipients:
+            connection = self.active_connections.get(client_id)
+            if connection is not None:
+                connection.enqueue(data)
+    
+    async def _on_message(self, envelope: Dict[str, Any]):
+        target = envelope.get("target")
+        data = envelope.get("data")
+        if target is None:
+            self._fan_out(data, envelope.get("room"))
+        elif target in self.active_connections:
+            self.active_connections[target].enqueue(data)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Connection, room and send queue counters"""
+        connections = self.active_connections.values()
+        return {
+            "clients": len(self.active_connections),
+            "rooms": len(self.rooms),
+            "queued": sum(connection.queue.qsize() for connection in connections),
+            "dropped": sum(connection.dropped for connection in connections)
+        }
 
 
 # Create a global connection manager
 manager = ConnectionManager()
 
 
+async def _send_danmaku_batch(room: str, comments: List[Dict[str, Any]]):
+    await manager.broadcast({"type": "danmaku_batch", "comments": comments}, room)
+    
+    # Keep comments sent in an episode room, so later viewers get them too
+    episode_id = live_episode_id(room)
+    if episode_id is not None:
+        try:
+            await live_danmaku_log.append(episode_id, comments)
+        except OSError as e:
+            print(f"Failed to store live danmaku for episode {episode_id}: {e}")
+
+
+# Live danmaku is sent to each room once per tick
+danmaku_batcher = LiveDanmakuBatcher(_send_danmaku_batch)
+
+
+async def _send_sync_heartbeat(room: str, message: Dict[str, Any]):
+    await manager.broadcast(message, room)
+
+
+# Playback clocks of watch-party rooms
+room_sync = RoomSync(_send_sync_heartbeat)
+
+
+async def _send_room_clock(client_id: str):
+    """Bring a client that entered a room up to the room's playback state"""
+    clock = await room_sync.clock(manager.room_of(client_id))
+    if clock is not None:
+        await manager.send_personal_message(RoomSync.message(clock), client_id)
+
+
+def _release_room(room: Optional[str]):
+    if room is not None and room not in manager.rooms:
+        room_sync.release(room)
+
+
 @router.websocket("/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
+async def websocket_endpoint(websocket: WebSocket, client_id: str, room: Optional[str] = None):
     """
     WebSocket endpoint for real-time communication
     
     Supports:
-    - MD5 calculation progress
-    - Real-time danmaku
-    - Video sync
+    - MD5 calculation progress, pushed by the video upload and MD5 endpoints
+    - Real-time danmaku, delivered as one "danmaku_batch" per room per tick
+    - Video sync against a server room clock:
+      send {"type": "ping", "client_time": t, "rtt": last RTT} to get a pong
+      with server_time (clock offset and RTT), report playback with
+      {"type": "sync", "time", "playing", "rate"}; changes beyond the drift
+      threshold are broadcast as "sync", playing rooms get "sync_heartbeat"
+      and {"type": "sync_state"} returns the current clock
+    - Rooms: connect with ?room=<name> or send {"type": "join", "room": <name>}
     """
-    await manager.connect(websocket, client_id)
+    await manager.connect(websocket, client_id, room)
+    await _send_room_clock(client_id)
     
     try:
         while True:
@@ -61,42 +262,64 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             
             try:
                 message = json.loads(data)
+                if not isinstance(message, dict):
+                    await manager.send_personal_message(
+                        {"type": "error", "message": "Invalid message: expected a JSON object"},
+                        client_id
+                    )
+                    continue
                 msg_type = message.get("type")
                 
                 if msg_type == "ping":
-                    # Respond to ping
+                    # Respond to ping with the server clock
+                    if message.get("rtt") is not None:
+                        room_sync.record_rtt(client_id, message["rtt"])
                     await manager.send_personal_message(
-                        {"type": "pong"},
+                        {
+                            "type": "pong",
+                            "client_time": message.get("client_time"),
+                            "server_time": time.time()
+                        },
                         client_id
                     )
                 
-                elif msg_type == "md5_progress":
-                    # Broadcast MD5 calculation progress
+                elif msg_type == "join":
+                    # Switch to another room
+                    room = str(message.get("room") or DEFAULT_ROOM)
+                    previous = manager.room_of(client_id)
+                    manager.join(client_id, room)
+                    _release_room(previous)
                     await manager.send_personal_message(
-                        {
-                            "type": "md5_progress",
-                            "progress": message.get("progress", 0),
-                            "video_id": message.get("video_id")
-                        },
+                        {"type": "joined", "room": room},
                         client_id
                     )
+                    await _send_room_clock(client_id)
                 
                 elif msg_type == "danmaku":
-                    # Broadcast danmaku to all clients
-                    await manager.broadcast({
-                        "type": "danmaku",
-                        "content": message.get("content"),
-                        "sender": client_id
-                    })
+                    # Queue danmaku for the next batch of the sender's room
+                    reason = danmaku_batcher.submit(manager.room_of(client_id), client_id, message)
+                    if reason is not None:
+                        await manager.send_personal_message(
+                            {"type": "danmaku_rejected", "reason": reason},
+                            client_id
+                        )
                 
                 elif msg_type == "sync":
-                    # Video sync message
-                    await manager.broadcast({
-                        "type": "sync",
-                        "time": message.get("time"),
-                        "playing": message.get("playing"),
-                        "sender": client_id
-                    })
+                    # Video sync message, broadcast only if it moves the room clock
+                    room = manager.room_of(client_id)
+                    update = await room_sync.report(
+                        room,
+                        client_id,
+                        message.get("time"),
+                        message.get("playing"),
+                        message.get("rate", 1.0)
+                    )
+                    if update is not None:
+                        await manager.broadcast(update, room)
+                
+                elif msg_type == "sync_state":
+                    # Current room clock on request
+                    await _send_room_clock(client_id)
                 
                 else:
                     # Echo unknown messages back
@@ -112,9 +335,21 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 )
                 
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
-        # Notify others about disconnection
-        await manager.broadcast({
-            "type": "user_disconnected",
-            "client_id": client_id
-        })
\ No newline at end of file
+        pass
+    finally:
+        # Runs on errors too, so no closed socket stays registered
+        connection = manager.active_connections.get(client_id)
+        if connection is not None and connection.websocket is websocket:
+            room = await manager.disconnect(client_id)
+            danmaku_batcher.forget(client_id)
+            room_sync.forget(client_id)
+            _release_room(room)
+            # Notify the rest of the room about disconnection
+            if room is not None:
+                try:
+                    await manager.broadcast({
+                        "type": "user_disconnected",
+                        "client_id": client_id
+                    }, room)
+                except Exception as e:
+                    print(f"Error announcing disconnect of {client_id}: {e}")
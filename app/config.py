@@ -24,6 +24,12 @@ class Settings(BaseSettings):
     # Upload
     max_upload_size: int = Field(default=5368709120, env="MAX_UPLOAD_SIZE")  # 5GB
     upload_dir: str = Field(default="uploads", env="UPLOAD_DIR")
+    upload_chunk_size: int = Field(default=1048576, env="UPLOAD_CHUNK_SIZE")  # 1MB
+    
+    # Video streaming: stream (aiofiles), pread (large os.pread chunks, zero-copy on servers
+    # with http.response.zerocopysend), accel (nginx X-Accel-Redirect, the zero-copy path)
+    video_stream_mode: str = Field(default="stream", env="VIDEO_STREAM_MODE")
+    video_accel_prefix: str = Field(default="/protected-uploads/", env="VIDEO_ACCEL_PREFIX")
     
     # DanDanPlay API
     dandan_api_base_url: str = Field(
@@ -35,6 +41,80 @@ class Settings(BaseSettings):
         env="DANDAN_PROXY_URL"
     )
     
+    # Upstream resilience: adaptive timeouts, retries, circuit breaker, failover
+    upstream_timeout_min: float = Field(default=2.0, env="UPSTREAM_TIMEOUT_MIN")  # seconds
+    upstream_timeout_max: float = Field(default=30.0, env="UPSTREAM_TIMEOUT_MAX")  # seconds
+    upstream_timeout_factor: float = Field(default=3.0, env="UPSTREAM_TIMEOUT_FACTOR")  # x p95 latency
+    upstream_retries: int = Field(default=2, env="UPSTREAM_RETRIES")
+    upstream_backoff_base: float = Field(default=0.2, env="UPSTREAM_BACKOFF_BASE")  # seconds
+    upstream_backoff_max: float = Field(default=2.0, env="UPSTREAM_BACKOFF_MAX")  # seconds
+    breaker_error_threshold: float = Field(default=0.5, env="BREAKER_ERROR_THRESHOLD")
+    breaker_min_requests: int = Field(default=10, env="BREAKER_MIN_REQUESTS")
+    breaker_window: float = Field(default=30.0, env="BREAKER_WINDOW")  # seconds
+    breaker_cooldown: float = Field(default=30.0, env="BREAKER_COOLDOWN")  # seconds
+    
+    # Upstream call governor (0 disables a limit)
+    upstream_rate_limit: float = Field(default=10.0, env="UPSTREAM_RATE_LIMIT")  # requests per second
+    upstream_rate_burst: int = Field(default=20, env="UPSTREAM_RATE_BURST")
+    upstream_max_in_flight: int = Field(default=16, env="UPSTREAM_MAX_IN_FLIGHT")
+    
+    # Upstream HTTP client pool
+    http_max_connections: int = Field(default=100, env="HTTP_MAX_CONNECTIONS")
+    http_max_keepalive_connections: int = Field(default=20, env="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    http_keepalive_expiry: float = Field(default=30.0, env="HTTP_KEEPALIVE_EXPIRY")  # seconds
+    http2_enabled: bool = Field(default=False, env="HTTP2_ENABLED")
+    
+    # Episode comment cache (network.enableCache / network.cacheExpiry in user settings)
+    comment_cache_enabled: bool = Field(default=True, env="COMMENT_CACHE_ENABLED")
+    comment_cache_ttl: int = Field(default=86400, env="COMMENT_CACHE_TTL")  # seconds
+    comment_cache_max_bytes: int = Field(default=268435456, env="COMMENT_CACHE_MAX_BYTES")  # 256MB
+    comment_cache_stale_ttl: int = Field(default=604800, env="COMMENT_CACHE_STALE_TTL")  # served when upstream is down
+    danmaku_index_max_comments: int = Field(default=5000000, env="DANMAKU_INDEX_MAX_COMMENTS")
+    
+    # Pre-compressed danmaku payloads on disk (expire with comment_cache_ttl)
+    danmaku_artifacts_enabled: bool = Field(default=True, env="DANMAKU_ARTIFACTS_ENABLED")
+    danmaku_artifact_dir: str = Field(default="data/danmaku", env="DANMAKU_ARTIFACT_DIR")
+    danmaku_artifact_gc_interval: float = Field(default=3600.0, env="DANMAKU_ARTIFACT_GC_INTERVAL")  # seconds, 0 disables the sweep
+    
+    # Background prefetch of upcoming playlist episodes
+    danmaku_prefetch_enabled: bool = Field(default=True, env="DANMAKU_PREFETCH_ENABLED")
+    danmaku_prefetch_depth: int = Field(default=2, env="DANMAKU_PREFETCH_DEPTH")  # episodes ahead
+    danmaku_prefetch_concurrency: int = Field(default=2, env="DANMAKU_PREFETCH_CONCURRENCY")
+    
+    # Server-side danmaku filtering defaults for smart blocking (danmaku.smartBlock)
+    danmaku_smart_dedup_window: float = Field(default=5.0, env="DANMAKU_SMART_DEDUP_WINDOW")  # seconds
+    danmaku_smart_max_per_second: int = Field(default=20, env="DANMAKU_SMART_MAX_PER_SECOND")
+    
+    # Match result cache (Redis when redis_url is reachable, SQLite otherwise)
+    match_cache_enabled: bool = Field(default=True, env="MATCH_CACHE_ENABLED")
+    match_cache_ttl: int = Field(default=604800, env="MATCH_CACHE_TTL")  # 7 days
+    match_cache_negative_ttl: int = Field(default=3600, env="MATCH_CACHE_NEGATIVE_TTL")  # 1 hour
+    match_cache_path: str = Field(default="data/match_cache.db", env="MATCH_CACHE_PATH")
+    
+    # Batch matching (POST /api/match/batch)
+    match_batch_concurrency: int = Field(default=8, env="MATCH_BATCH_CONCURRENCY")
+    match_batch_max_files: int = Field(default=200, env="MATCH_BATCH_MAX_FILES")
+    
+    # WebSocket fan-out
+    ws_send_queue_size: int = Field(default=256, env="WS_SEND_QUEUE_SIZE")  # messages per client
+    
+    # Live danmaku ingestion (rate 0 disables the per-sender limit)
+    live_danmaku_tick: float = Field(default=0.1, env="LIVE_DANMAKU_TICK")  # seconds between batches
+    live_danmaku_max_batch: int = Field(default=500, env="LIVE_DANMAKU_MAX_BATCH")  # comments per room per tick
+    live_danmaku_max_length: int = Field(default=100, env="LIVE_DANMAKU_MAX_LENGTH")  # characters
+    live_danmaku_rate: float = Field(default=2.0, env="LIVE_DANMAKU_RATE")  # comments per second per sender
+    live_danmaku_burst: int = Field(default=5, env="LIVE_DANMAKU_BURST")
+    live_danmaku_dedup_window: float = Field(default=10.0, env="LIVE_DANMAKU_DEDUP_WINDOW")  # seconds
+    
+    # Watch-party playback sync
+    sync_drift_threshold: float = Field(default=0.5, env="SYNC_DRIFT_THRESHOLD")  # seconds
+    sync_heartbeat_interval: float = Field(default=5.0, env="SYNC_HEARTBEAT_INTERVAL")  # seconds
+    
+    # Persisted live danmaku, merged into GET /api/danmaku/{episode_id}
+    live_danmaku_log_enabled: bool = Field(default=True, env="LIVE_DANMAKU_LOG_ENABLED")
+    live_danmaku_log_dir: str = Field(default="data/live", env="LIVE_DANMAKU_LOG_DIR")
+    live_danmaku_compact_records: int = Field(default=1000, env="LIVE_DANMAKU_COMPACT_RECORDS")  # tail size
+    
     # Redis (optional)
     redis_url: Optional[str] = Field(default=None, env="REDIS_URL")
     
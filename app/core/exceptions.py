@@ -25,6 +25,21 @@ class APIException(DanDanPlayException):
     pass
 
 
+class UpstreamUnavailableException(APIException):
+    """Every upstream API is refusing calls (circuit breakers open)"""
+    pass
+
+
+class InvalidUploadException(DanDanPlayException):
+    """Invalid upload request exception"""
+    pass
+
+
+class UploadTooLargeException(DanDanPlayException):
+    """Upload exceeds the configured size limit"""
+    pass
+
+
 def setup_exception_handlers(app: FastAPI):
     """Setup custom exception handlers"""
     
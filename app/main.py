@@ -1,4 +1,5 @@
 """Main FastAPI application"""
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,12 +9,45 @@ import os
 from app.config import settings
 from app.api import video, danmaku, match, websocket, settings as settings_api
 from app.core.exceptions import setup_exception_handlers
+from app.services.artifact_store import artifact_store
+from app.services.live_danmaku_log import live_danmaku_log
+from app.services.prefetch_service import danmaku_prefetcher
+from app.services.proxy_service import dandan_proxy
+from app.services.state_backend import shared_state
+from app.services.video_registry import video_registry
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    # State shared with other workers (Redis), or process memory
+    await shared_state.open()
+    # Index uploaded videos once instead of globbing per request
+    video_registry.load()
+    await video_registry.sync_shared()
+    await settings_api.load_shared_settings()
+    websocket.manager.start()
+    # One pooled upstream client per process
+    await dandan_proxy.open()
+    # Remove expired danmaku artifacts
+    artifact_store.start()
+    yield
+    await artifact_store.close()
+    await video_registry.flush()
+    await danmaku_prefetcher.close()
+    await websocket.danmaku_batcher.close()
+    await websocket.room_sync.close()
+    await websocket.manager.close()
+    await dandan_proxy.close()
+    await shared_state.close()
+
 
 # Create FastAPI app
 app = FastAPI(
     title=settings.app_name,
     version=settings.app_version,
-    debug=settings.debug
+    debug=settings.debug,
+    lifespan=lifespan
 )
 
 # Setup CORS
@@ -69,6 +103,22 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Upstream API call, cache, prefetch and WebSocket metrics"""
+    return {
+        **dandan_proxy.stats(),
+        "prefetch": danmaku_prefetcher.stats(),
+        "shared_state": shared_state.stats(),
+        "websocket": websocket.manager.stats(),
+        "live_danmaku": {
+            **websocket.danmaku_batcher.stats(),
+            "log": live_danmaku_log.stats()
+        },
+        "sync": websocket.room_sync.stats()
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
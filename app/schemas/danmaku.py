@@ -1,6 +1,6 @@
 """Danmaku data schemas"""
 from pydantic import BaseModel
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional
 
 
 class DanmakuResponse(BaseModel):
@@ -10,6 +10,13 @@ class DanmakuResponse(BaseModel):
     comments: List[Dict[str, Any]]
 
 
+class DanmakuWindowResponse(DanmakuResponse):
+    """Danmaku for a time window of an episode"""
+    start: float
+    end: float
+    total: int
+
+
 class ConvertRequest(BaseModel):
     """Danmaku format conversion request"""
     comments: List[Dict[str, Any]]
@@ -18,4 +25,19 @@ class ConvertRequest(BaseModel):
 
 class XMLParseRequest(BaseModel):
     """XML danmaku parse request"""
-    xml_content: str
\ No newline at end of file
+    xml_content: str
+
+
+class PrefetchItem(BaseModel):
+    """Playlist entry to prefetch, by episode or by file"""
+    episode_id: Optional[int] = None
+    file_name: Optional[str] = None
+    file_hash: Optional[str] = None
+    file_size: Optional[int] = None
+
+
+class PrefetchRequest(BaseModel):
+    """Playlist order and the entry now playing"""
+    playlist: List[PrefetchItem]
+    current_index: int
+    format: str = "binary"
\ No newline at end of file
@@ -28,4 +28,15 @@ class MatchResponse(BaseModel):
     success: bool
     is_matched: bool
     matches: List[MatchInfo]
-    error_message: Optional[str] = None
\ No newline at end of file
+    error_message: Optional[str] = None
+
+
+class BatchMatchRequest(BaseModel):
+    """Match request for several videos"""
+    requests: List[MatchRequest]
+
+
+class BatchMatchItem(MatchResponse):
+    """Match result for one video of a batch"""
+    index: int
+    file_hash: str
\ No newline at end of file
@@ -0,0 +1,316 @@
+"""Compressed on-disk store for converted danmaku payloads"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services.cache_service import TTLCache
+
+# Optional codecs, used when installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Unreferenced versions and metadata files older than this (seconds) were
+# left by an interrupted or superseded write
+TMP_MAX_AGE = 3600
+
+
+def _compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """Available content codings, in server preference order"""
+    codecs = {}
+    if zstandard is not None:
+        codecs["zstd"] = lambda data: zstandard.ZstdCompressor(level=10).compress(data)
+    if brotli is not None:
+        codecs["br"] = lambda data: brotli.compress(data, quality=9)
+    codecs["gzip"] = lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    return codecs
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> List[str]:
+    """Content codings a client accepts (q > 0) from its Accept-Encoding header"""
+    accepted = []
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.append(coding)
+    return accepted
+
+
+@dataclass
+class DanmakuArtifact:
+    """A stored payload and the encodings it is available in"""
+    key: str
+    etag: str
+    created: float
+    encodings: List[str] = field(default_factory=list)
+    revision: int = 0
+    # Subdirectory holding the bodies
+    version: str = ""
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """Best stored encoding the client accepts, None for identity"""
+        accepted = accepted_encodings(accept_encoding)
+        wildcard = "*" in accepted
+        for encoding in self.encodings:
+            if encoding in accepted or wildcard:
+                return encoding
+        return None
+
+
+class ArtifactStore:
+    """
+    Converted danmaku payloads stored pre-compressed on disk
+
+    Each (episode, format, filters) combination is serialized once and kept
+    in every available encoding with an ETag derived from its content, so
+    repeat requests are served from the stored bytes without conversion or
+    compression. A key holds a single revision (the generation of the live
+    danmaku log merged in): storing a newer one replaces it. Artifacts
+    expire with the comment cache TTL, expired ones are removed when
+    requested and by a sweep every danmaku_artifact_gc_interval seconds.
+
+    Layout: <root>/<shard>/<key>/meta.json names the version subdirectory
+    with the encoded bodies. A write fills a new version, then atomically
+    replaces meta.json and removes the previous version, so a reader sees
+    either revision complete; one that still holds the previous metadata
+    gets FileNotFoundError from read and should treat it as a miss.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        # Metadata of recently used artifacts, avoids a disk read per request
+        self._meta = TTLCache(10000)
+        self._collector: Optional[asyncio.Task] = None
+        self.collected = 0
+
+    @staticmethod
+    def make_key(**parts: Any) -> str:
+        """Stable key for the parameters that determine a payload"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def episode_key(
+        cls,
+        episode_id: int,
+        format: str,
+        with_related: bool,
+        ch_convert: Optional[int],
+        filter_params: Dict[str, Any]
+    ) -> str:
+        """Key of an episode's danmaku payload (GET /api/danmaku/{episode_id})"""
+        return cls.make_key(
+            episode_id=episode_id,
+            format=format,
+            with_related=with_related,
+            ch_convert=ch_convert,
+            filter=filter_params
+        )
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _fresh(self, artifact: DanmakuArtifact) -> bool:
+        return time.time() - artifact.created < settings.comment_cache_ttl
+
+    def _load(self, key: str) -> Optional[DanmakuArtifact]:
+        try:
+            with open(os.path.join(self._dir(key), "meta.json"), "r", encoding="utf-8") as f:
+                return DanmakuArtifact(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _store(self, key: str, body: bytes, revision: int) -> DanmakuArtifact:
+        artifact = DanmakuArtifact(
+            key=key,
+            etag=hashlib.sha1(body).hexdigest(),
+            created=time.time(),
+            revision=revision,
+            version=f"{os.getpid()}.{time.monotonic_ns()}"
+        )
+        directory = self._dir(key)
+        version_dir = os.path.join(directory, artifact.version)
+        meta_tmp = os.path.join(directory, f"meta.{artifact.version}.tmp")
+        previous = self._load(key)
+        os.makedirs(version_dir)
+        try:
+            for encoding, compress in _compressors().items():
+                with open(os.path.join(version_dir, f"body.{encoding}"), "wb") as f:
+                    f.write(compress(body))
+                artifact.encodings.append(encoding)
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump(artifact.__dict__, f)
+            os.replace(meta_tmp, os.path.join(directory, "meta.json"))
+        except BaseException:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            if os.path.exists(meta_tmp):
+                os.remove(meta_tmp)
+            raise
+
+        if previous is not None and previous.version:
+            shutil.rmtree(os.path.join(directory, previous.version), ignore_errors=True)
+        return artifact
+
+    def _read(self, key: str, version: str, encoding: str) -> bytes:
+        with open(os.path.join(self._dir(key), version, f"body.{encoding}"), "rb") as f:
+            return f.read()
+
+    def _remove(self, key: str):
+        shutil.rmtree(self._dir(key), ignore_errors=True)
+
+    async def get(self, key: str, revision: int = 0) -> Optional[DanmakuArtifact]:
+        """Fresh artifact of a key at a revision, or None"""
+        artifact = self._meta.get(key)
+        if artifact is None:
+            artifact = await run_in_threadpool(self._load, key)
+            if artifact is None:
+                return None
+            self._meta.set(key, artifact, size=1, ttl=settings.comment_cache_ttl)
+
+        if not self._fresh(artifact):
+            self._meta.delete(key)
+            await run_in_threadpool(self._remove, key)
+            return None
+        if artifact.revision != revision:
+            # Superseded, replaced by the caller's put
+            return None
+        return artifact
+
+    def forget(self, key: str):
+        """Drop cached metadata, e.g. after a read found the artifact replaced"""
+        self._meta.delete(key)
+
+    async def put(self, key: str, body: bytes, revision: int = 0) -> DanmakuArtifact:
+        """Compress and store a payload, replacing the key's previous revision"""
+        artifact = await run_in_threadpool(self._store, key, body, revision)
+        self._meta.set(key, artifact, size=1, ttl=settings.comment_cache_ttl)
+        return artifact
+
+    async def read(self, artifact: DanmakuArtifact, encoding: Optional[str]) -> bytes:
+        """
+        Stored bytes in an encoding, or the decoded payload for None
+
+        Raises:
+            FileNotFoundError: The artifact was replaced or removed since
+                its metadata was read
+        """
+        if encoding is not None:
+            return await run_in_threadpool(self._read, artifact.key, artifact.version, encoding)
+        data = await run_in_threadpool(self._read, artifact.key, artifact.version, "gzip")
+        return await run_in_threadpool(gzip.decompress, data)
+
+    def _collect(self) -> int:
+        """Remove expired artifacts and files left by interrupted or superseded writes"""
+        removed = 0
+        now = time.time()
+
+        def abandoned(path: str) -> bool:
+            try:
+                return now - os.path.getmtime(path) > TMP_MAX_AGE
+            except OSError:
+                return False
+
+        try:
+            shards = os.listdir(self.root)
+        except OSError:
+            return 0
+        for shard in shards:
+            shard_dir = os.path.join(self.root, shard)
+            try:
+                keys = os.listdir(shard_dir)
+            except OSError:
+                continue
+            for key in keys:
+                directory = os.path.join(shard_dir, key)
+                artifact = self._load(key)
+                if artifact is None:
+                    # No metadata yet while the first version is written
+                    if abandoned(directory):
+                        shutil.rmtree(directory, ignore_errors=True)
+                        removed += 1
+                    continue
+                if not self._fresh(artifact):
+                    shutil.rmtree(directory, ignore_errors=True)
+                    removed += 1
+                    continue
+                try:
+                    names = os.listdir(directory)
+                except OSError:
+                    continue
+                for name in names:
+                    if name in ("meta.json", artifact.version):
+                        continue
+                    path = os.path.join(directory, name)
+                    if not abandoned(path):
+                        continue
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            continue
+                    removed += 1
+        return removed
+
+    async def collect_garbage(self) -> int:
+        """
+        Sweep the store for expired artifacts
+
+        Returns:
+            Number of artifacts and leftover files removed
+        """
+        removed = await run_in_threadpool(self._collect)
+        self.collected += removed
+        return removed
+
+    def start(self):
+        """Start the periodic sweep"""
+        if settings.danmaku_artifacts_enabled and settings.danmaku_artifact_gc_interval > 0:
+            if self._collector is None or self._collector.done():
+                self._collector = asyncio.ensure_future(self._collect_loop())
+
+    async def _collect_loop(self):
+        while True:
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                print(f"Error collecting danmaku artifacts: {e}")
+            await asyncio.sleep(settings.danmaku_artifact_gc_interval)
+
+    async def close(self):
+        """Stop the periodic sweep"""
+        if self._collector is not None:
+            self._collector.cancel()
+            await asyncio.gather(self._collector, return_exceptions=True)
+            self._collector = None
+
+
+# Global artifact store
+artifact_store = ArtifactStore(settings.danmaku_artifact_dir)
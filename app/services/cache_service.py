@@ -0,0 +1,107 @@
+"""In-memory caching service"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry expiry, bounded by the total size of its values
+
+    Callers pass the size of each value when storing it, so the bound can
+    follow something meaningful (e.g. upstream payload bytes) without the
+    cache having to measure Python objects. Expired entries are kept for
+    stale_ttl more seconds for get_stale (e.g. when the source is down).
+    """
+
+    def __init__(self, max_bytes: int, stale_ttl: float = 0):
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a live value and mark it as recently used"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, _, value = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            if expires_at + self.stale_ttl <= now:
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """Return a value even if expired, as long as it is within stale_ttl"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, _, value = entry
+        if expires_at + self.stale_ttl <= time.monotonic():
+            return None
+
+        self.stale_hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, size: int, ttl: float):
+        """Store a value for ttl seconds, evicting least recently used entries"""
+        if key in self._entries:
+            self._remove(key)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Drop a single entry"""
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        """Drop all entries"""
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current usage"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits
+        }
@@ -0,0 +1,217 @@
+"""Concurrency helpers for upstream calls"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+# Governor priority classes, lower is served first
+PRIORITY_INTERACTIVE = 0  # match and comment fetches a user is waiting on
+PRIORITY_NORMAL = 1       # search, anime details, external comments
+PRIORITY_BACKGROUND = 2   # prefetch
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_BACKGROUND: "background"
+}
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight call
+
+    The first caller for a key starts the work as a task, later callers
+    await the same task. The task is shielded, so a cancelled caller (e.g.
+    a disconnected client) does not cancel the call for everyone else.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn once for all concurrent callers with the same key"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.calls += 1
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Call counters"""
+        total = self.calls + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / total if total else 0.0
+        }
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding up to burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> bool:
+        """Take a token if one is available (always, when rate is 0)"""
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """Seconds until the next token is available"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Withhold tokens for a while (e.g. after the upstream answered 429)"""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class UpstreamGovernor:
+    """
+    Rate limit and in-flight cap for upstream calls, served by priority
+
+    A call starts once a token is available and fewer than max_in_flight
+    calls are running. Waiting calls are served lowest priority class first
+    and in arrival order within a class, so interactive requests overtake
+    queued background work. Queue times are recorded per class.
+    """
+
+    def __init__(self, rate: float, burst: float, max_in_flight: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._granted: Dict[int, int] = {}
+        self._wait_total: Dict[int, float] = {}
+        self._waits: Dict[int, Deque[float]] = {}
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL) -> AsyncIterator[None]:
+        """Hold one upstream call slot for the duration of the block"""
+        started = time.monotonic()
+        await self._acquire(priority)
+        self._record_wait(priority, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def pause(self, seconds: float):
+        """Stop starting calls for a while"""
+        self.bucket.pause(seconds)
+
+    def _has_capacity(self) -> bool:
+        return self.max_in_flight <= 0 or self.in_flight < self.max_in_flight
+
+    async def _acquire(self, priority: int):
+        if not self._waiters and self._has_capacity() and self.bucket.take():
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the caller went away, hand the slot on
+                self._release()
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters:
+            _, _, future = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._has_capacity():
+                return
+            if not self.bucket.take():
+                self._schedule(self.bucket.delay())
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _schedule(self, delay: float):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _record_wait(self, priority: int, seconds: float):
+        self._granted[priority] = self._granted.get(priority, 0) + 1
+        self._wait_total[priority] = self._wait_total.get(priority, 0.0) + seconds
+        self._waits.setdefault(priority, deque(maxlen=500)).append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load and queue-time metrics per priority class"""
+        queued: Dict[int, int] = {}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[priority] = queued.get(priority, 0) + 1
+
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            granted = self._granted.get(priority, 0)
+            waits = sorted(self._waits.get(priority, ()))
+            classes[name] = {
+                "queued": queued.get(priority, 0),
+                "granted": granted,
+                "wait_avg": self._wait_total.get(priority, 0.0) / granted if granted else 0.0,
+                "wait_p95": waits[min(int(0.95 * len(waits)), len(waits) - 1)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0
+            }
+
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rate": self.bucket.rate,
+            "classes": classes
+        }
@@ -0,0 +1,130 @@
+"""Server-side danmaku filtering"""
+import re
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+# DanDanPlay modes: 4 = bottom, 5 = top, anything else scrolls
+BOTTOM_MODE = "4"
+TOP_MODE = "5"
+
+# Whitespace and punctuation ignored when comparing texts
+_IGNORED_CHARS = re.compile(r"[\s\W_]+", re.UNICODE)
+# Runs of one repeated character ("哈哈哈哈", "2333333")
+_REPEATED_CHARS = re.compile(r"(.)\1+", re.UNICODE | re.DOTALL)
+
+
+def normalize_text(text: str) -> str:
+    """Key under which near-duplicate comment texts collapse"""
+    key = _IGNORED_CHARS.sub("", text).lower()
+    key = _REPEATED_CHARS.sub(r"\1", key)
+    return key or text
+
+
+class DanmakuFilter:
+    """
+    Density control and deduplication over a time-sorted comment stream
+
+    Stages, applied in one linear pass:
+    - drop blocked modes (top, bottom, scroll)
+    - collapse texts that repeat a kept comment within dedup_window seconds
+    - keep at most max_per_second comments in each second of playback
+    """
+
+    def __init__(
+        self,
+        block_top: bool = False,
+        block_bottom: bool = False,
+        block_scroll: bool = False,
+        dedup_window: float = 0,
+        max_per_second: int = 0
+    ):
+        self.block_top = block_top
+        self.block_bottom = block_bottom
+        self.block_scroll = block_scroll
+        self.dedup_window = dedup_window
+        self.max_per_second = max_per_second
+
+    @property
+    def active(self) -> bool:
+        """Whether any stage would drop comments"""
+        return (
+            self.block_top
+            or self.block_bottom
+            or self.block_scroll
+            or self.dedup_window > 0
+            or self.max_per_second > 0
+        )
+
+    def _blocked(self, mode: str) -> bool:
+        if mode == TOP_MODE:
+            return self.block_top
+        if mode == BOTTOM_MODE:
+            return self.block_bottom
+        return self.block_scroll
+
+    def apply(
+        self,
+        comments: Sequence[Dict[str, Any]],
+        times: Optional[Sequence[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Filter DanDanPlay comments sorted by time
+
+        Args:
+            comments: Comments in DanDanPlay format, sorted by time
+            times: Parsed times of the comments (optional, parsed from "p" otherwise)
+
+        Returns:
+            Comments that pass every stage, in the same order
+        """
+        if not self.active:
+            return list(comments)
+
+        check_modes = self.block_top or self.block_bottom or self.block_scroll
+        window = self.dedup_window
+        cap = self.max_per_second
+
+        last_seen: Dict[str, float] = {}
+        recent = deque()
+        second = None
+        second_count = 0
+        kept = []
+
+        for i, comment in enumerate(comments):
+            try:
+                p = comment["p"].split(",", 2)
+                time = times[i] if times is not None else float(p[0])
+                mode = p[1] if len(p) > 1 else ""
+            except (KeyError, AttributeError, ValueError):
+                continue
+
+            if check_modes and self._blocked(mode):
+                continue
+
+            if window > 0:
+                # Forget texts last kept more than a window ago
+                while recent and time - recent[0][0] >= window:
+                    old_time, old_key = recent.popleft()
+                    if last_seen.get(old_key) == old_time:
+                        del last_seen[old_key]
+
+                key = normalize_text(comment.get("m", ""))
+                if key in last_seen:
+                    continue
+
+            if cap > 0:
+                current = int(time)
+                if current != second:
+                    second = current
+                    second_count = 0
+                if second_count >= cap:
+                    continue
+                second_count += 1
+
+            if window > 0:
+                last_seen[key] = time
+                recent.append((time, key))
+
+            kept.append(comment)
+
+        return kept
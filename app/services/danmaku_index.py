@@ -0,0 +1,79 @@
+"""Time-sorted danmaku index for windowed fetches"""
+from bisect import bisect_left
+from typing import Any, Dict, Hashable, List, Tuple
+
+from app.config import settings
+from app.services.cache_service import TTLCache
+
+
+class DanmakuTimeline:
+    """Comments of one episode sorted by their time in seconds"""
+
+    __slots__ = ("source", "times", "comments")
+
+    def __init__(self, source: Dict[str, Any]):
+        # The upstream result this timeline was built from
+        self.source = source
+
+        times = []
+        valid = []
+        for comment in source.get("comments", []):
+            try:
+                time = float(comment["p"].split(",", 1)[0])
+            except (KeyError, AttributeError, ValueError):
+                # No usable time, can't be placed on the timeline
+                continue
+            times.append(time)
+            valid.append(comment)
+
+        order = sorted(range(len(times)), key=times.__getitem__)
+        self.times: List[float] = [times[i] for i in order]
+        self.comments: List[Dict[str, Any]] = [valid[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def span(self, start: float, end: float) -> Tuple[int, int]:
+        """Index range of the comments with start <= time < end"""
+        lo = bisect_left(self.times, start)
+        hi = bisect_left(self.times, end, lo)
+        return lo, hi
+
+    def window(self, start: float, end: float) -> List[Dict[str, Any]]:
+        """Comments with start <= time < end"""
+        lo, hi = self.span(start, end)
+        return self.comments[lo:hi]
+
+
+class DanmakuIndex:
+    """
+    Cache of per-episode timelines
+
+    A timeline is rebuilt only when the upstream result it was built from
+    changes (e.g. the comment cache refreshed the episode). The cache is
+    bounded by the total number of indexed comments.
+    """
+
+    def __init__(self):
+        self._timelines = TTLCache(settings.danmaku_index_max_comments)
+
+    def get(self, key: Hashable, result: Dict[str, Any]) -> DanmakuTimeline:
+        """Timeline for an upstream comment result, building it if needed"""
+        timeline = self._timelines.get(key)
+        if timeline is None or timeline.source is not result:
+            timeline = DanmakuTimeline(result)
+            self._timelines.set(
+                key,
+                timeline,
+                size=max(len(timeline), 1),
+                ttl=settings.comment_cache_ttl
+            )
+        return timeline
+
+    def stats(self) -> Dict[str, Any]:
+        """Index cache statistics"""
+        return self._timelines.stats()
+
+
+# Global timeline index
+danmaku_index = DanmakuIndex()
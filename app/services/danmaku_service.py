@@ -1,8 +1,259 @@
 """Danmaku (comment) processing service"""
+import json
+import math
+import struct
+import sys
+from array import array
+from itertools import accumulate, repeat
 from typing import List, Dict, Any
 import xml.etree.ElementTree as ET
 from xml.parsers.expat import ExpatError
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml is optional
+    lxml_etree = None
+
+# Mode mappings shared by the per-comment and batch converters
+NPLAYER_MODES = {
+    "1": "scroll",  # Rolling
+    "4": "bottom",  # Bottom
+    "5": "top"      # Top
+}
+
+ARTPLAYER_MODES = {
+    "1": 0,  # Rolling
+    "4": 1,  # Bottom (static)
+    "5": 1   # Top (static)
+}
+
+# Binary wire format (format=binary), all integers little-endian:
+#   header   magic "DDMK", uint8 version, uint8 flags, uint16 reserved,
+#            uint32 count, uint32 text blob size                (16 bytes)
+#   times    float32[count]  seconds
+#   modes    uint8[count]    DanDanPlay mode (1 scroll, 4 bottom, 5 top)
+#   colors   uint24[count]   0xRRGGBB
+#   offsets  uint32[count + 1] into the text blob
+#   texts    UTF-8 text blob
+# modes and colors take 4 bytes per comment together, so the 4-byte columns
+# (times, offsets) start 4-byte aligned and clients can map them as typed
+# arrays; modes and colors are byte arrays (colors at 16 + 5 * count).
+BINARY_MAGIC = b"DDMK"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sBBHII")
+BINARY_MEDIA_TYPE = "application/x-danmaku-binary"
+
+
+class DanmakuColumns:
+    """
+    DanDanPlay comments parsed once into parallel columns
+
+    Comments that none of the converters could handle (missing fields,
+    short or non-numeric "p") are dropped while parsing. The mode is kept
+    as the raw string so each output format can interpret it as the
+    per-comment converters do.
+    """
+    
+    __slots__ = ("times", "modes", "colors", "texts")
+    
+    def __init__(self):
+        self.times: List[float] = []
+        self.modes: List[str] = []
+        self.colors: List[int] = []
+        self.texts: List[str] = []
+    
+    def __len__(self) -> int:
+        return len(self.times)
+    
+    @classmethod
+    def from_comments(cls, comments: List[Dict[str, Any]]) -> "DanmakuColumns":
+        """
+        Parse all "p" strings in a single pass
+        
+        Args:
+            comments: List of comments in DanDanPlay format
+            
+        Returns:
+            Column arrays of time, mode, color and text
+        """
+        try:
+            return cls._from_uniform(comments)
+        except (KeyError, TypeError, ValueError):
+            # Malformed or irregular input, parse comment by comment
+            pass
+        
+        columns = cls()
+        times = columns.times
+        modes = columns.modes
+        colors = columns.colors
+        texts = columns.texts
+        
+        for comment in comments:
+            try:
+                params = comment["p"].split(",")
+                time = float(params[0])
+                mode = params[1]
+                color = int(params[2])
+                text = comment["m"]
+            except (KeyError, IndexError, ValueError):
+                # Skip invalid comments
+                continue
+            times.append(time)
+            modes.append(mode)
+            colors.append(color)
+            texts.append(text)
+        
+        return columns
+    
+    @classmethod
+    def _from_uniform(cls, comments: List[Dict[str, Any]]) -> "DanmakuColumns":
+        """
+        Fast path for well-formed payloads
+        
+        When every "p" has the same number of fields (DanDanPlay sends
+        "time,mode,color,uid"), all of them are split at once and each column
+        is parsed with a C-level map. Any irregularity raises so the caller
+        can fall back to the per-comment loop.
+        """
+        columns = cls()
+        if not comments:
+            return columns
+        
+        ps = [comment["p"] for comment in comments]
+        texts = [comment["m"] for comment in comments]
+        
+        comma_counts = set(map(str.count, ps, repeat(",", len(ps))))
+        if len(comma_counts) != 1:
+            raise ValueError("Irregular comment parameters")
+        stride = comma_counts.pop() + 1
+        if stride < 3:
+            raise ValueError("Too few comment parameters")
+        
+        fields = ",".join(ps).split(",")
+        color_fields = fields[2::stride]
+        # Comments use a handful of distinct colors, parse each only once
+        color_values = {field: int(field) for field in set(color_fields)}
+        
+        columns.times = list(map(float, fields[0::stride]))
+        columns.modes = fields[1::stride]
+        columns.colors = list(map(color_values.__getitem__, color_fields))
+        columns.texts = texts
+        return columns
+    
+    def mapped_modes(self, mode_map: Dict[str, Any], default: Any) -> List[Any]:
+        """Modes translated through a mapping, looking up each distinct mode once"""
+        lookup = {mode: mode_map.get(mode, default) for mode in set(self.modes)}
+        return list(map(lookup.__getitem__, self.modes))
+    
+    def hex_colors(self) -> List[str]:
+        """Colors as "#rrggbb" strings, formatting each distinct color once"""
+        palette = {color: f"#{color:06x}" for color in set(self.colors)}
+        return list(map(palette.__getitem__, self.colors))
+
+
+class BilibiliXMLParser:
+    """
+    Incremental parser for Bilibili XML danmaku
+
+    Data is fed in chunks and comments are returned as soon as their <d>
+    element is complete. Finished elements are detached from the root, so
+    memory use does not grow with the size of the document.
+    """
+    
+    def __init__(self, use_lxml: bool = False):
+        if use_lxml and lxml_etree is not None:
+            self._parser = lxml_etree.XMLPullParser(
+                events=("start", "end"),
+                resolve_entities=False,
+                no_network=True,
+                huge_tree=True
+            )
+            self._errors = (lxml_etree.XMLSyntaxError, ET.ParseError, ExpatError)
+        else:
+            self._parser = ET.XMLPullParser(events=("start", "end"))
+            self._errors = (ET.ParseError, ExpatError)
+        
+        self._root = None
+        self._depth = 0
+        self._index = 0
+    
+    def feed(self, data) -> List[Dict[str, Any]]:
+        """
+        Feed the next chunk of the document
+        
+        Args:
+            data: XML text or bytes
+            
+        Returns:
+            Comments completed by this chunk, in DanDanPlay format
+        """
+        try:
+            self._parser.feed(data)
+            return self._drain()
+        except self._errors as e:
+            raise ValueError(f"Failed to parse XML: {e}")
+    
+    def close(self) -> List[Dict[str, Any]]:
+        """Finish the document and return any remaining comments"""
+        try:
+            self._parser.close()
+            comments = self._drain()
+        except self._errors as e:
+            raise ValueError(f"Failed to parse XML: {e}")
+        if self._root is None:
+            raise ValueError("Failed to parse XML: no element found")
+        return comments
+    
+    def _drain(self) -> List[Dict[str, Any]]:
+        comments = []
+        
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                self._depth += 1
+                continue
+            
+            self._depth -= 1
+            if self._depth != 1:
+                continue
+            
+            # Direct child of the root element
+            if elem.tag == 'd':
+                comment = self._convert(elem, self._index)
+                self._index += 1
+                if comment:
+                    comments.append(comment)
+            
+            elem.clear()
+            self._root.remove(elem)
+        
+        return comments
+    
+    @staticmethod
+    def _convert(d_elem, idx: int) -> Dict[str, Any]:
+        p_attr = d_elem.get('p', '')
+        text = d_elem.text or ''
+        
+        if not p_attr or not text:
+            return None
+        
+        # Bilibili format: time,mode,size,color,timestamp,pool,userid,dmid
+        p_parts = p_attr.split(',')
+        if len(p_parts) < 4:
+            return None
+        
+        # Convert to DanDanPlay format: time,mode,color
+        time = p_parts[0]
+        mode = p_parts[1]
+        color = p_parts[3]
+        
+        return {
+            "cid": idx,
+            "p": f"{time},{mode},{color}",
+            "m": text.strip()
+        }
+
 
 class DanmakuConverter:
     """Service for converting danmaku between different formats"""
@@ -29,18 +280,11 @@ class DanmakuConverter:
             mode = params[1]
             color = int(params[2])
             
-            # Mode mapping
-            mode_map = {
-                "1": "scroll",  # Rolling
-                "4": "bottom",  # Bottom
-                "5": "top"      # Top
-            }
-            
             return {
                 "color": f"#{color:06x}",
                 "text": raw_comment["m"],
                 "time": time,
-                "type": mode_map.get(mode, "scroll")
+                "type": NPLAYER_MODES.get(mode, "scroll")
             }
         except (KeyError, IndexError, ValueError) as e:
             raise ValueError(f"Invalid comment format: {e}")
@@ -62,18 +306,12 @@ class DanmakuConverter:
             mode = params[1]
             color = int(params[2])
             
-            # Mode mapping (ArtPlayer uses 0 for scroll, 1 for static)
-            mode_map = {
-                "1": 0,  # Rolling
-                "4": 1,  # Bottom (static)
-                "5": 1   # Top (static)
-            }
-            
+            # ArtPlayer uses 0 for scroll, 1 for static
             return {
                 "text": raw_comment["m"],
                 "time": time,
                 "color": f"#{color:06x}",
-                "mode": mode_map.get(mode, 0)
+                "mode": ARTPLAYER_MODES.get(mode, 0)
             }
         except (KeyError, IndexError, ValueError) as e:
             raise ValueError(f"Invalid comment format: {e}")
@@ -116,35 +354,157 @@ class DanmakuConverter:
         Returns:
             List of comments in DanDanPlay format
         """
-        try:
-            root = ET.fromstring(xml_content)
-            comments = []
-            
-            for idx, d_elem in enumerate(root.findall('d')):
-                p_attr = d_elem.get('p', '')
-                text = d_elem.text or ''
-                
-                if not p_attr or not text:
-                    continue
-                
-                # Bilibili format: time,mode,size,color,timestamp,pool,userid,dmid
-                p_parts = p_attr.split(',')
-                if len(p_parts) >= 4:
-                    # Convert to DanDanPlay format: time,mode,color
-                    time = p_parts[0]
-                    mode = p_parts[1]
-                    color = p_parts[3]
-                    
-                    comments.append({
-                        "cid": idx,
-                        "p": f"{time},{mode},{color}",
-                        "m": text.strip()
-                    })
-            
-            return comments
-            
-        except (ET.ParseError, ExpatError) as e:
-            raise ValueError(f"Failed to parse XML: {e}")
+        parser = BilibiliXMLParser()
+        comments = parser.feed(xml_content)
+        comments.extend(parser.close())
+        return comments
+    
+    @staticmethod
+    def columns_to_nplayer(columns: DanmakuColumns) -> List[Dict[str, Any]]:
+        """Emit NPlayer comments from parsed columns"""
+        return [
+            {"color": color, "text": text, "time": time, "type": mode}
+            for time, mode, color, text in zip(
+                columns.times,
+                columns.mapped_modes(NPLAYER_MODES, "scroll"),
+                columns.hex_colors(),
+                columns.texts
+            )
+        ]
+    
+    @staticmethod
+    def columns_to_artplayer(columns: DanmakuColumns) -> List[Dict[str, Any]]:
+        """Emit ArtPlayer comments from parsed columns"""
+        return [
+            {"text": text, "time": time, "color": color, "mode": mode}
+            for time, mode, color, text in zip(
+                columns.times,
+                columns.mapped_modes(ARTPLAYER_MODES, 0),
+                columns.hex_colors(),
+                columns.texts
+            )
+        ]
+    
+    @staticmethod
+    def columns_to_ccl(columns: DanmakuColumns) -> List[Dict[str, Any]]:
+        """Emit CCL comments from parsed columns"""
+        if all(map(math.isfinite, columns.times)):
+            try:
+                modes = {mode: int(mode) for mode in set(columns.modes)}
+            except ValueError:
+                pass
+            else:
+                return [
+                    {"text": text, "stime": int(time * 1000), "color": color, "mode": mode, "size": 25}
+                    for time, mode, color, text in zip(
+                        columns.times,
+                        map(modes.__getitem__, columns.modes),
+                        columns.colors,
+                        columns.texts
+                    )
+                ]
+        
+        # Some comments have a non-numeric mode or time, skip them one by one
+        converted = []
+        append = converted.append
+        for time, mode, color, text in zip(
+            columns.times, columns.modes, columns.colors, columns.texts
+        ):
+            try:
+                # CCL needs a numeric mode and finite time in milliseconds
+                append({
+                    "text": text,
+                    "stime": int(time * 1000),
+                    "color": color,
+                    "mode": int(mode),
+                    "size": 25
+                })
+            except ValueError:
+                continue
+        return converted
+    
+    @staticmethod
+    def columns_to_binary(columns: DanmakuColumns) -> bytes:
+        """Pack parsed columns into the binary wire format"""
+        count = len(columns)
+        
+        times = array("f", columns.times)
+        colors = array("I", [color & 0xFFFFFF for color in columns.colors])
+        # Non-numeric or out-of-range modes scroll, as in the other formats
+        mode_values = {}
+        for mode in set(columns.modes):
+            try:
+                value = int(mode)
+            except ValueError:
+                value = 1
+            mode_values[mode] = value if 0 <= value <= 0xFF else 1
+        modes = bytes(map(mode_values.__getitem__, columns.modes))
+        
+        texts = [text.encode("utf-8", "replace") for text in columns.texts]
+        offsets = array("I", accumulate(map(len, texts), initial=0))
+        blob = b"".join(texts)
+        
+        if sys.byteorder == "big":
+            times.byteswap()
+            colors.byteswap()
+            offsets.byteswap()
+        
+        # Keep the low three bytes of each little-endian uint32
+        color_words = colors.tobytes()
+        packed_colors = bytearray(3 * count)
+        packed_colors[0::3] = color_words[0::4]
+        packed_colors[1::3] = color_words[1::4]
+        packed_colors[2::3] = color_words[2::4]
+        
+        return b"".join((
+            BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, 0, count, len(blob)),
+            times.tobytes(),
+            modes,
+            bytes(packed_colors),
+            offsets.tobytes(),
+            blob
+        ))
+    
+    @staticmethod
+    def to_binary(comments: List[Dict[str, Any]]) -> bytes:
+        """
+        Encode comments in the binary wire format
+        
+        Args:
+            comments: List of comments in DanDanPlay format
+        
+        Returns:
+            Packed comments (see BINARY_HEADER for the layout)
+        """
+        return DanmakuConverter.columns_to_binary(DanmakuColumns.from_comments(comments))
+    
+    @staticmethod
+    def encode_response(comments: List[Dict[str, Any]], count: int, format: str = "raw") -> bytes:
+        """
+        Serialize a full danmaku response body
+        
+        Args:
+            comments: List of comments in DanDanPlay format
+            count: Comment count reported in JSON bodies
+            format: Output format (raw, binary or a convert_batch format)
+        
+        Returns:
+            The binary encoding, or DanmakuResponse JSON for other formats
+        """
+        if format == "binary":
+            return DanmakuConverter.to_binary(comments)
+        if format != "raw" and comments:
+            comments = DanmakuConverter.convert_batch(comments, format)
+        return json.dumps(
+            {"success": True, "count": count, "comments": comments},
+            ensure_ascii=False,
+            separators=(",", ":")
+        ).encode("utf-8")
+    
+    @staticmethod
+    def supported_formats() -> List[str]:
+        """Target formats accepted by convert_batch"""
+        return ["nplayer", "artplayer", "ccl"]
     
     @staticmethod
     def convert_batch(
@@ -154,6 +514,10 @@ class DanmakuConverter:
         """
         Convert a batch of comments to target format
         
+        All comments are parsed into columns in one pass and the target format
+        is emitted from the columns. The output matches converting each comment
+        with the per-comment converters and skipping invalid ones.
+        
         Args:
             comments: List of comments in DanDanPlay format
             target_format: Target format (nplayer, artplayer, ccl)
@@ -161,22 +525,14 @@ class DanmakuConverter:
         Returns:
             List of converted comments
         """
-        converters = {
-            "nplayer": DanmakuConverter.dandan_to_nplayer,
-            "artplayer": DanmakuConverter.dandan_to_artplayer,
-            "ccl": DanmakuConverter.dandan_to_ccl
+        emitters = {
+            "nplayer": DanmakuConverter.columns_to_nplayer,
+            "artplayer": DanmakuConverter.columns_to_artplayer,
+            "ccl": DanmakuConverter.columns_to_ccl
         }
         
-        converter = converters.get(target_format)
-        if not converter:
+        emitter = emitters.get(target_format)
+        if not emitter:
             raise ValueError(f"Unsupported format: {target_format}")
         
-        converted = []
-        for comment in comments:
-            try:
-                converted.append(converter(comment))
-            except ValueError:
-                # Skip invalid comments
-                continue
-        
-        return converted
\ No newline at end of file
+        return emitter(DanmakuColumns.from_comments(comments))
\ No newline at end of file
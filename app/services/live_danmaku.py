@@ -0,0 +1,154 @@
+"""Live danmaku ingestion: per-sender limits and per-room tick batching"""
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+from app.services.concurrency import TokenBucket
+
+# Reasons a live comment is not accepted
+REJECT_INVALID = "invalid"
+REJECT_RATE_LIMITED = "rate_limited"
+REJECT_DUPLICATE = "duplicate"
+REJECT_OVERFLOW = "overflow"
+
+BatchHandler = Callable[[str, List[Dict[str, Any]]], Awaitable[None]]
+
+
+class LiveDanmakuBatcher:
+    """
+    Buffer live comments per room and flush them once per tick
+
+    Instead of one frame per comment per recipient, every room receives at
+    most one batch every live_danmaku_tick seconds. Each sender is limited
+    by a token bucket (live_danmaku_rate/live_danmaku_burst) and repeating
+    the same text within live_danmaku_dedup_window seconds is dropped. A
+    room holds at most live_danmaku_max_batch comments per tick. The flush
+    loop only runs while comments are pending.
+    """
+
+    def __init__(self, on_batch: BatchHandler):
+        self.on_batch = on_batch
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._recent: Dict[str, Dict[str, float]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.rejected: Dict[str, int] = {
+            REJECT_INVALID: 0,
+            REJECT_RATE_LIMITED: 0,
+            REJECT_DUPLICATE: 0,
+            REJECT_OVERFLOW: 0
+        }
+        self.batches = 0
+
+    def submit(self, room: str, sender: str, message: Dict[str, Any]) -> Optional[str]:
+        """
+        Queue a live comment for the room's next batch
+
+        Args:
+            room: Room the comment is sent to
+            sender: Client ID of the sender
+            message: Client message with content and optional time/mode/color
+
+        Returns:
+            None if accepted, otherwise the reason it was rejected
+        """
+        comment = self._comment(sender, message)
+        reason = self._check(room, sender, comment)
+        if reason is not None:
+            self.rejected[reason] += 1
+            return reason
+
+        self._pending.setdefault(room, []).append(comment)
+        self.accepted += 1
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+        return None
+
+    def _comment(self, sender: str, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        content = message.get("content")
+        if not isinstance(content, str):
+            return None
+        content = content.strip()
+        if not content or len(content) > settings.live_danmaku_max_length:
+            return None
+
+        comment: Dict[str, Any] = {"content": content, "sender": sender}
+        try:
+            if message.get("time") is not None:
+                comment["time"] = float(message["time"])
+                # json.loads accepts NaN/Infinity, which can't be sent back as JSON
+                if not math.isfinite(comment["time"]):
+                    return None
+            if message.get("mode") is not None:
+                comment["mode"] = int(message["mode"])
+            if message.get("color") is not None:
+                comment["color"] = int(message["color"]) & 0xFFFFFF
+        except (TypeError, ValueError, OverflowError):
+            # int() of Infinity or 1e400 overflows
+            return None
+        return comment
+
+    def _check(self, room: str, sender: str, comment: Optional[Dict[str, Any]]) -> Optional[str]:
+        if comment is None:
+            return REJECT_INVALID
+        if len(self._pending.get(room, ())) >= settings.live_danmaku_max_batch:
+            return REJECT_OVERFLOW
+
+        now = time.monotonic()
+        recent = self._recent.setdefault(sender, {})
+        horizon = now - settings.live_danmaku_dedup_window
+        for content in [c for c, seen in recent.items() if seen < horizon]:
+            del recent[content]
+        if comment["content"] in recent:
+            return REJECT_DUPLICATE
+
+        if settings.live_danmaku_rate > 0:
+            bucket = self._buckets.get(sender)
+            if bucket is None:
+                bucket = TokenBucket(settings.live_danmaku_rate, settings.live_danmaku_burst)
+                self._buckets[sender] = bucket
+            if not bucket.take():
+                return REJECT_RATE_LIMITED
+
+        recent[comment["content"]] = now
+        return None
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(settings.live_danmaku_tick)
+            await self.flush()
+
+    async def flush(self):
+        """Send every pending batch now"""
+        pending, self._pending = self._pending, {}
+        for room, comments in pending.items():
+            self.batches += 1
+            try:
+                await self.on_batch(room, comments)
+            except Exception as e:
+                print(f"Error sending danmaku batch to {room}: {e}")
+
+    def forget(self, sender: str):
+        """Drop the rate limit and dedup state of a disconnected sender"""
+        self._buckets.pop(sender, None)
+        self._recent.pop(sender, None)
+
+    async def close(self):
+        """Stop the flush loop, dropping pending comments"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Ingestion counters"""
+        return {
+            "accepted": self.accepted,
+            "rejected": dict(self.rejected),
+            "batches": self.batches,
+            "pending": sum(len(comments) for comments in self._pending.values())
+        }
@@ -0,0 +1,451 @@
+"""Persisted live danmaku, merged with upstream comments by time"""
+import asyncio
+import heapq
+import math
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services.cache_service import TTLCache
+
+# Cross-process lock of an episode's log (POSIX); without it, run one worker
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# On-disk layout, per episode directory:
+#   segment       header (magic "DDLV", uint8 version, uint32 generation,
+#                 uint32 count) then records sorted by time
+#   tail.<gen>    records appended since that generation's compaction
+# Record: float64 time, uint32 sequence number, uint32 color, uint8 mode,
+#         uint8 sender size, uint16 text size, sender and text in UTF-8.
+# Live comments are served with cid = -sequence, so they never collide
+# with the (positive) upstream comment IDs.
+# Compaction merges the segment and its tail into the next generation's
+# segment; tails of older generations are leftovers and are removed.
+# Appends and compactions hold an flock on the episode's "lock" file, so
+# several workers can share the directory.
+LOG_MAGIC = b"DDLV"
+LOG_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sBII")
+RECORD = struct.Struct("<dIIBBH")
+
+VALID_MODES = (1, 4, 5)
+
+# Sorted (times, comments) columns
+TimeColumns = Tuple[List[float], List[Dict[str, Any]]]
+
+
+def merge_timelines(*sources: TimeColumns) -> TimeColumns:
+    """
+    k-way merge of time-sorted comment columns
+
+    Args:
+        sources: (times, comments) pairs, each sorted by time
+
+    Returns:
+        Merged (times, comments), sorted by time
+    """
+    sources = [source for source in sources if source[0]]
+    if len(sources) == 1:
+        return sources[0]
+    pairs = list(heapq.merge(*(zip(*source) for source in sources), key=itemgetter(0)))
+    return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+
+def _file_id(stat: os.stat_result) -> Tuple[int, int, int]:
+    """Changes whenever a file is replaced or written to"""
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _to_comment(time: float, seq: int, color: int, mode: int, sender: str, text: str) -> Dict[str, Any]:
+    """Live record in DanDanPlay comment format"""
+    return {"cid": -seq, "p": f"{time:.2f},{mode},{color},{sender}", "m": text}
+
+
+def _pack(time: float, seq: int, color: int, mode: int, sender: str, text: str) -> bytes:
+    sender_bytes = sender.encode("utf-8")[:255]
+    text_bytes = text.encode("utf-8")[:65535]
+    return RECORD.pack(time, seq, color, mode, len(sender_bytes), len(text_bytes)) + sender_bytes + text_bytes
+
+
+def _unpack(data: bytes, offset: int = 0) -> Tuple[List[Tuple], int]:
+    """
+    Records from offset on
+
+    Returns:
+        The complete records, and the offset just past the last of them
+        (a truncated last record is left out)
+    """
+    records = []
+    end = len(data)
+    while offset + RECORD.size <= end:
+        time, seq, color, mode, sender_size, text_size = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        if start + sender_size + text_size > end:
+            break
+        offset = start + sender_size + text_size
+        if not math.isfinite(time):
+            # Never served, it can't be encoded as JSON
+            continue
+        sender = data[start:start + sender_size].decode("utf-8", "replace")
+        text = data[start + sender_size:offset].decode("utf-8", "replace")
+        records.append((time, seq, color, mode, sender, text))
+    return records, offset
+
+
+class LiveTimeline:
+    """
+    Live comments of one episode as two time-sorted runs
+
+    The compacted segment and the tail appended since are each kept sorted
+    (tail entries are inserted by bisection), so serving them only needs a
+    merge with the upstream timeline, never a sort.
+    """
+
+    __slots__ = ("generation", "segment_id", "tail_size", "times", "comments", "tail_times", "tail_comments")
+
+    def __init__(self):
+        self.generation = 0
+        # On-disk state this timeline reflects: the segment file it was
+        # read from and how many bytes of the tail it holds
+        self.segment_id: Optional[Tuple[int, int, int]] = None
+        self.tail_size = 0
+        self.times: List[float] = []
+        self.comments: List[Dict[str, Any]] = []
+        self.tail_times: List[float] = []
+        self.tail_comments: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.times) + len(self.tail_times)
+
+    def add(self, time: float, comment: Dict[str, Any]):
+        """Insert a comment into the tail"""
+        index = bisect_right(self.tail_times, time)
+        self.tail_times.insert(index, time)
+        self.tail_comments.insert(index, comment)
+
+    def sources(self) -> List[TimeColumns]:
+        """Sorted runs to merge"""
+        return [(self.times, self.comments), (self.tail_times, self.tail_comments)]
+
+    def window(self, start: float, end: float) -> List[TimeColumns]:
+        """Sorted runs restricted to start <= time < end"""
+        runs = []
+        for times, comments in self.sources():
+            lo = bisect_left(times, start)
+            hi = bisect_left(times, end, lo)
+            runs.append((times[lo:hi], comments[lo:hi]))
+        return runs
+
+
+class LiveDanmakuLog:
+    """
+    Append-only per-episode log of danmaku sent over the WebSocket
+
+    Batches are appended to the episode's tail file and tail entry list.
+    Once the tail holds live_danmaku_compact_records comments it is merged
+    into a new sorted segment. Timelines are cached in memory, bounded by
+    danmaku_index_max_comments, and reloaded from disk when evicted.
+
+    Other workers may write to the same log: before a timeline is served
+    or appended to, records they added to the tail are read in, and it is
+    reloaded when they compacted it. Appends and compactions take the
+    episode's file lock, so sequence numbers (cids) are assigned in one
+    order and compaction never drops another worker's records.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._timelines = TTLCache(settings.danmaku_index_max_comments)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self.appended = 0
+        self.compactions = 0
+        self.reloads = 0
+
+    def _dir(self, episode_id: int) -> str:
+        return os.path.join(self.root, str(episode_id))
+
+    def _tail_path(self, episode_id: int, generation: int) -> str:
+        return os.path.join(self._dir(episode_id), f"tail.{generation}")
+
+    def _lock(self, episode_id: int) -> asyncio.Lock:
+        lock = self._locks.get(episode_id)
+        if lock is None:
+            lock = self._locks[episode_id] = asyncio.Lock()
+        return lock
+
+    def _lock_file(self, episode_id: int):
+        """Take the episode's cross-process lock (blocks), released by closing the file"""
+        directory = self._dir(episode_id)
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, "lock"), "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except BaseException:
+                lock_file.close()
+                raise
+        return lock_file
+
+    def _cache(self, episode_id: int, timeline: LiveTimeline):
+        self._timelines.set(
+            episode_id,
+            timeline,
+            size=max(len(timeline), 1),
+            ttl=settings.comment_cache_ttl
+        )
+
+    async def timeline(self, episode_id: int) -> LiveTimeline:
+        """Live comments of an episode (empty when the log is disabled)"""
+        if not settings.live_danmaku_log_enabled:
+            return LiveTimeline()
+        async with self._lock(episode_id):
+            return await self._refresh(episode_id)
+
+    async def _refresh(self, episode_id: int) -> LiveTimeline:
+        """The cached timeline, brought up to date with the files"""
+        timeline = self._timelines.get(episode_id)
+        if timeline is None:
+            timeline = await run_in_threadpool(self._load, episode_id)
+        else:
+            reloaded, records, tail_size = await run_in_threadpool(self._changes, episode_id, timeline)
+            if reloaded is not None:
+                timeline = reloaded
+                self.reloads += 1
+            elif tail_size == timeline.tail_size:
+                return timeline
+            else:
+                for record in records:
+                    timeline.add(record[0], _to_comment(*record))
+                timeline.tail_size = tail_size
+        self._cache(episode_id, timeline)
+        return timeline
+
+    def _load(self, episode_id: int) -> LiveTimeline:
+        timeline = LiveTimeline()
+        directory = self._dir(episode_id)
+        if not os.path.isdir(directory):
+            return timeline
+
+        try:
+            with open(os.path.join(directory, "segment"), "rb") as f:
+                timeline.segment_id = _file_id(os.fstat(f.fileno()))
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        header = data[:SEGMENT_HEADER.size]
+        if len(header) == SEGMENT_HEADER.size:
+            magic, version, generation, _ = SEGMENT_HEADER.unpack(header)
+            if magic == LOG_MAGIC and version == LOG_VERSION:
+                timeline.generation = generation
+                records, _ = _unpack(data, SEGMENT_HEADER.size)
+                for record in records:
+                    timeline.times.append(record[0])
+                    timeline.comments.append(_to_comment(*record))
+
+        for name in os.listdir(directory):
+            if not name.startswith("tail."):
+                continue
+            try:
+                generation = int(name[len("tail."):])
+            except ValueError:
+                continue
+            if generation < timeline.generation:
+                # Already part of the segment, compaction stopped before removing it
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+        try:
+            with open(self._tail_path(episode_id, timeline.generation), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        # A partial last record is skipped here and truncated by the next append
+        records, timeline.tail_size = _unpack(data)
+        for record in records:
+            timeline.add(record[0], _to_comment(*record))
+        return timeline
+
+    def _changes(self, episode_id: int, timeline: LiveTimeline) -> Tuple[Optional[LiveTimeline], List[Tuple], int]:
+        """
+        What other workers wrote since the timeline was read
+
+        Returns:
+            The reloaded timeline if the segment was replaced (else None),
+            otherwise the records appended to the tail and the tail size
+            including them
+        """
+        directory = self._dir(episode_id)
+        try:
+            segment_id = _file_id(os.stat(os.path.join(directory, "segment")))
+        except FileNotFoundError:
+            segment_id = None
+        if segment_id != timeline.segment_id:
+            return self._load(episode_id), [], 0
+
+        try:
+            with open(self._tail_path(episode_id, timeline.generation), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= timeline.tail_size:
+                    if size < timeline.tail_size:
+                        return self._load(episode_id), [], 0
+                    return None, [], timeline.tail_size
+                f.seek(timeline.tail_size)
+                data = f.read()
+        except FileNotFoundError:
+            if timeline.tail_size:
+                return self._load(episode_id), [], 0
+            return None, [], 0
+        records, complete = _unpack(data)
+        return None, records, timeline.tail_size + complete
+
+    def _write_tail(self, episode_id: int, generation: int, offset: int, records: List[Tuple]) -> int:
+        """
+        Append records to the tail, which holds offset bytes of complete records
+
+        Returns:
+            The tail size after the append
+        """
+        data = b"".join(_pack(*record) for record in records)
+        path = self._tail_path(episode_id, generation)
+        with open(path, "ab") as f:
+            if f.tell() > offset:
+                # Interrupted write, drop it so the append starts on a record boundary
+                print(f"Truncating {f.tell() - offset} bytes of a partial record in {path}")
+                f.truncate(offset)
+            try:
+                f.write(data)
+                f.flush()
+            except OSError:
+                # Don't leave a partial record for the next append to follow
+                f.truncate(offset)
+                raise
+        return offset + len(data)
+
+    async def append(self, episode_id: int, comments: List[Dict[str, Any]]) -> int:
+        """
+        Persist live comments of an episode
+
+        Args:
+            episode_id: Episode the comments were sent for
+            comments: Live comments (content, sender, time, optional mode/color)
+
+        Returns:
+            Number of comments stored (comments without a valid time are skipped)
+        """
+        if not settings.live_danmaku_log_enabled:
+            return 0
+        entries = []
+        for comment in comments:
+            try:
+                time = float(comment["time"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if math.isfinite(time):
+                entries.append((max(time, 0.0), comment))
+        if not entries:
+            return 0
+
+        async with self._lock(episode_id):
+            lock_file = await run_in_threadpool(self._lock_file, episode_id)
+            try:
+                # Include what other workers appended, for the sequence numbers
+                timeline = await self._refresh(episode_id)
+                records = []
+                for time, comment in entries:
+                    mode = comment.get("mode", 1)
+                    records.append((
+                        time,
+                        len(timeline) + len(records) + 1,
+                        comment.get("color", 0xFFFFFF) & 0xFFFFFF,
+                        mode if mode in VALID_MODES else 1,
+                        str(comment.get("sender", "")),
+                        comment["content"]
+                    ))
+                timeline.tail_size = await run_in_threadpool(
+                    self._write_tail, episode_id, timeline.generation, timeline.tail_size, records
+                )
+                for record in records:
+                    timeline.add(record[0], _to_comment(*record))
+                self.appended += len(records)
+
+                if len(timeline.tail_times) >= settings.live_danmaku_compact_records:
+                    await self._compact(episode_id, timeline)
+                self._cache(episode_id, timeline)
+            finally:
+                await run_in_threadpool(lock_file.close)
+        return len(records)
+
+    async def _compact(self, episode_id: int, timeline: LiveTimeline):
+        times, comments = merge_timelines(*timeline.sources())
+        generation = timeline.generation + 1
+        segment_id = await run_in_threadpool(self._write_segment, episode_id, generation, times, comments)
+        timeline.generation = generation
+        timeline.segment_id = segment_id
+        timeline.tail_size = 0
+        timeline.times = times
+        timeline.comments = comments
+        timeline.tail_times = []
+        timeline.tail_comments = []
+        self.compactions += 1
+
+    def _write_segment(
+        self,
+        episode_id: int,
+        generation: int,
+        times: List[float],
+        comments: List[Dict[str, Any]]
+    ) -> Tuple[int, int, int]:
+        directory = self._dir(episode_id)
+        chunks = [SEGMENT_HEADER.pack(LOG_MAGIC, LOG_VERSION, generation, len(times))]
+        for time, comment in zip(times, comments):
+            _, mode, color, sender = comment["p"].split(",", 3)
+            chunks.append(_pack(time, -comment["cid"], int(color), int(mode), sender, comment["m"]))
+
+        tmp_path = os.path.join(directory, "segment.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(chunks))
+        segment_path = os.path.join(directory, "segment")
+        os.replace(tmp_path, segment_path)
+        previous = self._tail_path(episode_id, generation - 1)
+        if os.path.exists(previous):
+            os.remove(previous)
+        return _file_id(os.stat(segment_path))
+
+    def stats(self) -> Dict[str, Any]:
+        """Log counters and timeline cache statistics"""
+        return {
+            "appended": self.appended,
+            "compactions": self.compactions,
+            "reloads": self.reloads,
+            "timelines": self._timelines.stats()
+        }
+
+
+def live_episode_id(room: Optional[str]) -> Optional[int]:
+    """
+    Episode whose log receives the live comments of a room
+
+    Only "episode:<id>" rooms are persisted. Comments are never attributed
+    by a client-supplied episode ID, so a sender can only add to the log of
+    the episode room it is actually in.
+    """
+    if room and room.startswith("episode:"):
+        try:
+            return int(room[len("episode:"):])
+        except ValueError:
+            return None
+    return None
+
+
+# Global live danmaku log
+live_danmaku_log = LiveDanmakuLog(settings.live_danmaku_log_dir)
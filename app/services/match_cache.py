@@ -0,0 +1,170 @@
+"""Persistent match result cache"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+
+
+class SQLiteMatchStore:
+    """Match results stored in a local SQLite database"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS match_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        # Drop whatever expired while the server was down
+        conn.execute("DELETE FROM match_cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        self._conn = conn
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM match_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO match_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+            self._conn.commit()
+
+    async def open(self):
+        await run_in_threadpool(self._open)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await run_in_threadpool(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: int):
+        await run_in_threadpool(self._set, key, value, ttl)
+
+    async def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RedisMatchStore:
+    """Match results stored in Redis, shared by every worker"""
+
+    prefix = "dandan:match:"
+
+    def __init__(self, url: str):
+        self.url = url
+        self._redis = None
+
+    async def open(self):
+        import redis.asyncio as redis
+
+        client = redis.from_url(self.url)
+        try:
+            await client.ping()
+        except Exception:
+            await client.close()
+            raise
+        self._redis = client
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._redis.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: int):
+        await self._redis.set(self.prefix + key, value, ex=ttl)
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+
+class MatchCache:
+    """
+    Cache of upstream /match results keyed by file hash, size and name
+
+    Results live in Redis when settings.redis_url is reachable and in a
+    local SQLite file otherwise, so they survive restarts either way.
+    Unmatched files are cached too, for a shorter TTL.
+    """
+
+    def __init__(self):
+        self._store = None
+
+    async def open(self):
+        """Connect to Redis if configured, falling back to SQLite"""
+        if self._store is not None:
+            return
+
+        if settings.redis_url:
+            store = RedisMatchStore(settings.redis_url)
+            try:
+                await store.open()
+                self._store = store
+                return
+            except Exception as e:
+                print(f"Match cache: Redis unavailable ({e}), using SQLite")
+
+        store = SQLiteMatchStore(settings.match_cache_path)
+        await store.open()
+        self._store = store
+
+    async def close(self):
+        if self._store is not None:
+            await self._store.close()
+            self._store = None
+
+    @staticmethod
+    def make_key(
+        file_hash: str,
+        file_size: int,
+        file_name: str,
+        match_mode: Optional[str] = None
+    ) -> str:
+        return json.dumps([file_hash, file_size, file_name, match_mode or ""], ensure_ascii=False)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Cached match result, or None"""
+        if not settings.match_cache_enabled:
+            return None
+        try:
+            await self.open()
+            value = await self._store.get(key)
+        except Exception as e:
+            print(f"Match cache read failed: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, result: Dict):
+        """Store a successful match result, negative results for a shorter time"""
+        if not settings.match_cache_enabled or not result.get("success", False):
+            return
+        ttl = (
+            settings.match_cache_ttl
+            if result.get("isMatched", False)
+            else settings.match_cache_negative_ttl
+        )
+        try:
+            await self.open()
+            await self._store.set(key, json.dumps(result, ensure_ascii=False), ttl)
+        except Exception as e:
+            print(f"Match cache write failed: {e}")
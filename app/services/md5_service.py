@@ -2,38 +2,111 @@
 import hashlib
 import aiofiles
 from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+# DanDanPlay identifies files by the MD5 of their first 16MB
+DANDAN_HASH_SIZE = 16 * 1024 * 1024
+
+# Bytes hashed between progress events, and read per step from files
+MD5_PROGRESS_STEP = 1024 * 1024
+
+# Progress callback: (bytes hashed, bytes to hash)
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class HeadMD5:
+    """
+    Incremental MD5 over the leading bytes of a stream
+    
+    When on_progress is given, feed() and finish() report progress every
+    MD5_PROGRESS_STEP bytes and once more when hashing is complete.
+    """
+    
+    def __init__(self, limit: int = DANDAN_HASH_SIZE, on_progress: Optional[ProgressCallback] = None):
+        self.limit = limit
+        self.consumed = 0
+        self.on_progress = on_progress
+        self._reported = 0
+        self._finished = False
+        self._hash = hashlib.md5()
+    
+    @property
+    def done(self) -> bool:
+        """Whether the hashed prefix is complete"""
+        return self.consumed >= self.limit
+    
+    def update(self, data: bytes):
+        """Feed the next bytes of the stream, ignoring anything past the limit"""
+        if self.done:
+            return
+        take = min(len(data), self.limit - self.consumed)
+        self._hash.update(memoryview(data)[:take])
+        self.consumed += take
+    
+    async def feed(self, data: bytes):
+        """Feed the next bytes and report progress if a step was crossed"""
+        if self.done:
+            return
+        self.update(data)
+        if self.done:
+            await self.finish()
+        elif self.on_progress is not None and self.consumed - self._reported >= MD5_PROGRESS_STEP:
+            self._reported = self.consumed
+            await self.on_progress(self.consumed, self.limit)
+    
+    async def finish(self):
+        """Report completion (the stream may end before the limit)"""
+        if self._finished:
+            return
+        self._finished = True
+        if self.on_progress is not None:
+            await self.on_progress(self.consumed, self.consumed)
+    
+    def hexdigest(self) -> str:
+        """MD5 of the bytes consumed so far"""
+        return self._hash.hexdigest()
 
 
 class MD5Service:
     """Service for calculating MD5 hash of video files"""
     
     @staticmethod
-    async def calculate_file_md5(file_path: str, chunk_size: int = 16 * 1024 * 1024) -> str:
+    async def calculate_file_md5(
+        file_path: str,
+        chunk_size: int = DANDAN_HASH_SIZE,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> str:
         """
         Calculate MD5 hash of the first 16MB of a file (DanDanPlay standard)
         
         Args:
             file_path: Path to the file
             chunk_size: Size of chunk to read (default 16MB)
+            on_progress: Called with (bytes hashed, bytes to hash) as hashing advances
             
         Returns:
             MD5 hash as hex string
         """
-        md5_hash = hashlib.md5()
         file_path = Path(file_path)
         
         if not file_path.exists():
             raise FileNotFoundError(f"File not found: {file_path}")
         
+        # Read only the first chunk (16MB) as per DanDanPlay specification,
+        # in steps so progress can be reported
+        hasher = HeadMD5(min(chunk_size, file_path.stat().st_size), on_progress)
         async with aiofiles.open(file_path, 'rb') as f:
-            # Read only the first chunk (16MB) as per DanDanPlay specification
-            chunk = await f.read(chunk_size)
-            md5_hash.update(chunk)
+            while not hasher.done:
+                data = await f.read(min(MD5_PROGRESS_STEP, hasher.limit - hasher.consumed))
+                if not data:
+                    break
+                await hasher.feed(data)
+        await hasher.finish()
         
-        return md5_hash.hexdigest()
+        return hasher.hexdigest()
     
     @staticmethod
-    def calculate_md5_sync(file_path: str, chunk_size: int = 16 * 1024 * 1024) -> str:
+    def calculate_md5_sync(file_path: str, chunk_size: int = DANDAN_HASH_SIZE) -> str:
         """
         Synchronous version of MD5 calculation
         
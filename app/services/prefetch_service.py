@@ -0,0 +1,160 @@
+"""Background prefetch of upcoming playlist episodes"""
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services.artifact_store import artifact_store
+from app.services.concurrency import PRIORITY_BACKGROUND
+from app.services.danmaku_filter import DanmakuFilter
+from app.services.danmaku_index import danmaku_index
+from app.services.danmaku_service import DanmakuConverter
+from app.services.live_danmaku_log import live_danmaku_log, merge_timelines
+from app.services.proxy_service import DanDanAPIProxy, dandan_proxy
+
+
+class DanmakuPrefetcher:
+    """
+    Warm the caches for the episodes that play next
+
+    For each upcoming playlist entry the file is matched (filling the match
+    cache), its comments are fetched (filling the comment cache) and the
+    default danmaku payload is stored as an artifact, so the player gets its
+    danmaku straight from cache when the playlist advances. At most
+    settings.danmaku_prefetch_concurrency entries are prefetched at a time.
+    """
+
+    def __init__(self, proxy: DanDanAPIProxy):
+        self.proxy = proxy
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._queued: Set[Tuple] = set()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(settings.danmaku_prefetch_concurrency, 1))
+        return self._semaphore
+
+    def schedule(self, items: List[Dict[str, Any]], format: str = "binary") -> int:
+        """
+        Start prefetching playlist entries in the background
+
+        Args:
+            items: Upcoming entries (episode_id, or file_hash/file_name/file_size)
+            format: Output format of the artifact to warm
+
+        Returns:
+            Number of entries scheduled (entries already queued are skipped)
+        """
+        if not settings.danmaku_prefetch_enabled:
+            return 0
+
+        scheduled = 0
+        for item in items:
+            if item.get("episode_id") is not None:
+                key = ("episode", item["episode_id"], format)
+            elif item.get("file_hash") and item.get("file_name") and item.get("file_size") is not None:
+                key = ("file", item["file_hash"], item["file_size"], item["file_name"], format)
+            else:
+                continue
+            if key in self._queued:
+                continue
+
+            self._queued.add(key)
+            task = asyncio.ensure_future(self._prefetch(item, format))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+            scheduled += 1
+
+        self.scheduled += scheduled
+        return scheduled
+
+    def _done(self, key: Tuple, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._queued.discard(key)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.failed += 1
+            print(f"Danmaku prefetch failed: {task.exception()}")
+        else:
+            self.completed += 1
+
+    async def _prefetch(self, item: Dict[str, Any], format: str):
+        async with self.semaphore:
+            episode_id = item.get("episode_id")
+            if episode_id is None:
+                result = await self.proxy.match_video(
+                    file_hash=item["file_hash"],
+                    file_name=item["file_name"],
+                    file_size=item["file_size"],
+                    priority=PRIORITY_BACKGROUND
+                )
+                matches = result.get("matches") or []
+                if not result.get("isMatched", False) or not matches:
+                    return
+                episode_id = matches[0]["episodeId"]
+
+            await self.warm_episode(episode_id, format)
+
+    async def warm_episode(self, episode_id: int, format: str = "binary"):
+        """Fetch an episode's comments and store its default danmaku artifact"""
+        # Same defaults as GET /api/danmaku/{episode_id}
+        with_related = True
+        ch_convert = None
+        result = await self.proxy.get_comments(
+            episode_id=episode_id,
+            with_related=with_related,
+            ch_convert=ch_convert,
+            priority=PRIORITY_BACKGROUND
+        )
+        if not result.get("success", False):
+            return
+        if not (settings.danmaku_artifacts_enabled and settings.comment_cache_enabled):
+            return
+
+        live = await live_danmaku_log.timeline(episode_id)
+        if live.tail_times:
+            # Not stored until the live tail is compacted, see get_danmaku
+            return
+        segment = (live.times, live.comments)
+        generation = live.generation
+        key = artifact_store.episode_key(
+            episode_id, format, with_related, ch_convert, vars(DanmakuFilter())
+        )
+        if await artifact_store.get(key, generation) is not None:
+            return
+
+        comments = result.get("comments", [])
+        count = result.get("count", 0)
+        if segment[0]:
+            timeline = danmaku_index.get((episode_id, with_related, ch_convert), result)
+            _, comments = merge_timelines((timeline.times, timeline.comments), segment)
+            count = len(comments)
+        body = await run_in_threadpool(DanmakuConverter.encode_response, comments, count, format)
+        await artifact_store.put(key, body, generation)
+
+    async def close(self):
+        """Cancel prefetches still running"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Prefetch counters"""
+        return {
+            "in_flight": len(self._tasks),
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+# Global prefetcher instance
+danmaku_prefetcher = DanmakuPrefetcher(dandan_proxy)
@@ -1,15 +1,242 @@
 """DanDanPlay API proxy service"""
+import asyncio
 import httpx
-from typing import Dict, List, Optional
+import json as jsonlib
+import time
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterable, List, Optional, Tuple
 from app.config import settings
+from app.core.exceptions import UpstreamUnavailableException
+from app.services.cache_service import TTLCache
+from app.services.concurrency import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    SingleFlight,
+    UpstreamGovernor
+)
+from app.services.match_cache import MatchCache
+from app.services.resilience import (
+    CircuitBreaker,
+    LatencyTracker,
+    backoff_delay,
+    endpoint_name,
+    is_retryable_status,
+    is_upstream_failure
+)
+
+# Upstream /match/batch accepts at most this many files per call
+UPSTREAM_BATCH_MATCH_LIMIT = 32
+
+
+def flight_key(
+    method: str,
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    json: Optional[Dict[str, Any]] = None
+) -> Tuple:
+    """Key identifying identical upstream calls"""
+    return (
+        method,
+        path,
+        jsonlib.dumps(params, sort_keys=True) if params else None,
+        jsonlib.dumps(json, sort_keys=True) if json else None
+    )
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP client used for all upstream API calls"""
+    http2 = settings.http2_enabled
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+    
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.upstream_timeout_max, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry
+        ),
+        http2=http2
+    )
+
+
+def retry_after(response: httpx.Response) -> float:
+    """Seconds to hold off after a 429, from Retry-After (1s if absent)"""
+    try:
+        return max(float(response.headers.get("retry-after", 1)), 0.0)
+    except ValueError:
+        return 1.0
+
+
+async def _as_completed(aws: Iterable[Awaitable[Any]]) -> AsyncIterator[Any]:
+    """Yield the results of awaitables as they finish, cancelling the rest if abandoned"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 class DanDanAPIProxy:
     """Proxy service for DanDanPlay API"""
     
-    def __init__(self):
-        self.base_url = settings.dandan_proxy_url or settings.dandan_api_base_url
-        self.timeout = httpx.Timeout(30.0, connect=10.0)
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        self._client = client
+        self.comment_cache = TTLCache(
+            settings.comment_cache_max_bytes,
+            stale_ttl=settings.comment_cache_stale_ttl
+        )
+        self.match_cache = MatchCache()
+        self.flights = SingleFlight()
+        self.latency = LatencyTracker()
+        self.governor = UpstreamGovernor(
+            rate=settings.upstream_rate_limit,
+            burst=settings.upstream_rate_burst,
+            max_in_flight=settings.upstream_max_in_flight
+        )
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # Cleared when the upstream turns out not to have /match/batch
+        self.batch_match_supported = True
+    
+    @property
+    def base_urls(self) -> List[str]:
+        """Upstream API base URLs in failover order, following runtime settings changes"""
+        urls = []
+        for url in (settings.dandan_proxy_url, settings.dandan_api_base_url):
+            if url and url not in urls:
+                urls.append(url)
+        return urls
+    
+    def breaker(self, base_url: str) -> CircuitBreaker:
+        """Circuit breaker of an upstream"""
+        breaker = self.breakers.get(base_url)
+        if breaker is None:
+            breaker = self.breakers[base_url] = CircuitBreaker(base_url)
+        return breaker
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client, created on first use if not opened at startup"""
+        if self._client is None or self._client.is_closed:
+            self._client = create_http_client()
+        return self._client
+    
+    async def open(self):
+        """Create the pooled HTTP client and connect the match cache"""
+        if self._client is None or self._client.is_closed:
+            self._client = create_http_client()
+        await self.match_cache.open()
+    
+    async def close(self):
+        """Close the pooled HTTP client and the match cache"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        await self.match_cache.close()
+    
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITY_NORMAL
+    ) -> httpx.Response:
+        """
+        Send a request to the upstream API
+        
+        Each attempt goes to the first upstream whose circuit breaker lets
+        it through, starting from the next upstream on every retry, with a
+        timeout adapted to the endpoint's recent latency. Transport errors,
+        5xx and 429 are retried after a jittered backoff; other errors are
+        raised right away. Every attempt waits for a governor slot of the
+        given priority; a 429 pauses the governor for its Retry-After.
+        
+        Raises:
+            UpstreamUnavailableException: Every upstream's breaker is open
+            httpx.HTTPError: The last error once retries are exhausted
+        """
+        endpoint = endpoint_name(method, path)
+        base_urls = self.base_urls
+        last_error: Optional[Exception] = None
+        
+        for attempt in range(settings.upstream_retries + 1):
+            shift = attempt % len(base_urls)
+            order = base_urls[shift:] + base_urls[:shift]
+            base_url = next((url for url in order if self.breaker(url).allow()), None)
+            if base_url is None:
+                break
+            breaker = self.breaker(base_url)
+            
+            timeout = self.latency.timeout(endpoint)
+            try:
+                async with self.governor.slot(priority):
+                    started = time.monotonic()
+                    response = await self.client.request(
+                        method,
+                        f"{base_url}{path}",
+                        params=params,
+                        json=json,
+                        timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0))
+                    )
+            except httpx.TransportError as e:
+                self.latency.record(endpoint, time.monotonic() - started, ok=False)
+                breaker.record(False)
+                last_error = e
+            else:
+                ok = not is_retryable_status(response.status_code)
+                self.latency.record(endpoint, time.monotonic() - started, ok=ok)
+                if response.status_code == 429:
+                    self.governor.pause(retry_after(response))
+                breaker.record(ok)
+                try:
+                    response.raise_for_status()
+                    return response
+                except httpx.HTTPStatusError as e:
+                    if ok:
+                        raise
+                    last_error = e
+            
+            if attempt < settings.upstream_retries:
+                await asyncio.sleep(backoff_delay(attempt))
+        
+        if last_error is None:
+            raise UpstreamUnavailableException("All upstream APIs are unavailable (circuit open)")
+        raise last_error
+    
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITY_NORMAL
+    ) -> Dict:
+        """
+        Send a request to the upstream API and return the decoded JSON
+        
+        Concurrent identical requests share one upstream call.
+        """
+        async def call() -> Dict:
+            response = await self._send(method, path, params=params, json=json, priority=priority)
+            return response.json()
+        
+        return await self.flights.do(flight_key(method, path, params, json), call)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Upstream call and cache statistics"""
+        return {
+            "comment_cache": self.comment_cache.stats(),
+            "singleflight": self.flights.stats(),
+            "latency": self.latency.stats(),
+            "governor": self.governor.stats(),
+            "upstreams": {url: breaker.stats() for url, breaker in self.breakers.items()}
+        }
     
     async def match_video(
         self,
@@ -17,7 +244,8 @@ class DanDanAPIProxy:
         file_name: str,
         file_size: int,
         video_duration: Optional[int] = None,
-        match_mode: Optional[str] = None
+        match_mode: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE
     ) -> Dict:
         """
         Match video with DanDanPlay database
@@ -28,10 +256,30 @@ class DanDanAPIProxy:
             file_size: Size of the video file in bytes
             video_duration: Duration of video in seconds (optional)
             match_mode: Match mode (optional)
+            priority: Governor priority class of the upstream call
             
         Returns:
-            Match result from API
+            Match result from API (or the match cache)
         """
+        cache_key = MatchCache.make_key(file_hash, file_size, file_name, match_mode)
+        cached = await self.match_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        payload = self._match_payload(file_hash, file_name, file_size, video_duration, match_mode)
+        result = await self._request("POST", "/match", json=payload, priority=priority)
+        await self.match_cache.set(cache_key, result)
+        return result
+    
+    @staticmethod
+    def _match_payload(
+        file_hash: str,
+        file_name: str,
+        file_size: int,
+        video_duration: Optional[int] = None,
+        match_mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Upstream match request body for one file"""
         payload = {
             "fileName": file_name,
             "fileHash": file_hash,
@@ -42,21 +290,112 @@ class DanDanAPIProxy:
             payload["videoDuration"] = video_duration
         if match_mode:
             payload["matchMode"] = match_mode
+        return payload
+    
+    async def match_videos(
+        self,
+        files: List[Dict[str, Any]],
+        concurrency: int = 8
+    ) -> AsyncIterator[Tuple[int, Dict]]:
+        """
+        Match many videos, yielding results as each one resolves
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.base_url}/match",
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json()
+        Cached results come first. The remaining files go through the
+        upstream /match/batch endpoint (exact matches only), and whatever
+        it leaves unmatched through /match, at most concurrency calls at a
+        time. A file that fails yields an unsuccessful result instead of
+        ending the batch.
+        
+        Args:
+            files: match_video keyword arguments for each file
+            concurrency: Maximum concurrent upstream calls
+        
+        Yields:
+            (index into files, match result) pairs, in completion order
+        """
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        keys = [
+            MatchCache.make_key(f["file_hash"], f["file_size"], f["file_name"], f.get("match_mode"))
+            for f in files
+        ]
+        
+        cached = await asyncio.gather(*(self.match_cache.get(key) for key in keys))
+        pending = []
+        for index, result in enumerate(cached):
+            if result is not None:
+                yield index, result
+            else:
+                pending.append(index)
+        
+        if len(pending) > 1 and self.batch_match_supported:
+            chunks = [
+                pending[start:start + UPSTREAM_BATCH_MATCH_LIMIT]
+                for start in range(0, len(pending), UPSTREAM_BATCH_MATCH_LIMIT)
+            ]
+            matched = set()
+            async for results in _as_completed(
+                self._match_batch_upstream([files[i] for i in chunk], chunk, keys, semaphore)
+                for chunk in chunks
+            ):
+                for index, result in results:
+                    matched.add(index)
+                    yield index, result
+            pending = [index for index in pending if index not in matched]
+        
+        async def match_one(index: int) -> Tuple[int, Dict]:
+            async with semaphore:
+                try:
+                    return index, await self.match_video(**files[index])
+                except Exception as e:
+                    return index, {"success": False, "isMatched": False, "matches": [], "errorMessage": str(e)}
+        
+        async for index, result in _as_completed(match_one(index) for index in pending):
+            yield index, result
+    
+    async def _match_batch_upstream(
+        self,
+        files: List[Dict[str, Any]],
+        indices: List[int],
+        keys: List[str],
+        semaphore: asyncio.Semaphore
+    ) -> List[Tuple[int, Dict]]:
+        """Exact matches for up to UPSTREAM_BATCH_MATCH_LIMIT files, as (index, result) pairs"""
+        payload = {"requests": [self._match_payload(**f) for f in files]}
+        try:
+            async with semaphore:
+                response = await self._request(
+                    "POST", "/match/batch", json=payload, priority=PRIORITY_INTERACTIVE
+                )
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (404, 405):
+                print("Upstream has no /match/batch, matching files one by one")
+                self.batch_match_supported = False
+            return []
+        except Exception as e:
+            print(f"Batch match failed, matching files one by one: {e}")
+            return []
+        
+        by_hash: Dict[str, List[int]] = {}
+        for index, f in zip(indices, files):
+            by_hash.setdefault(f["file_hash"], []).append(index)
+        
+        matched = []
+        for item in response.get("results") or []:
+            if not item.get("success") or not item.get("matchResult"):
+                continue
+            for index in by_hash.pop(item.get("fileHash"), []):
+                result = {"success": True, "isMatched": True, "matches": [item["matchResult"]]}
+                await self.match_cache.set(keys[index], result)
+                matched.append((index, result))
+        return matched
     
     async def get_comments(
         self,
         episode_id: int,
         from_source: Optional[str] = None,
         with_related: bool = True,
-        ch_convert: Optional[int] = None
+        ch_convert: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE
     ) -> Dict:
         """
         Get comments (danmaku) for an episode
@@ -66,10 +405,18 @@ class DanDanAPIProxy:
             from_source: Source filter (optional)
             with_related: Include related comments
             ch_convert: Chinese conversion (0: none, 1: to simplified, 2: to traditional)
+            priority: Governor priority class of the upstream call
             
         Returns:
             Comments data from API
         """
+        use_cache = settings.comment_cache_enabled
+        cache_key = (episode_id, from_source, with_related, ch_convert)
+        if use_cache:
+            cached = self.comment_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
         params = {}
         
         if from_source:
@@ -79,13 +426,31 @@ class DanDanAPIProxy:
         if ch_convert is not None:
             params["chConvert"] = str(ch_convert)
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(
-                f"{self.base_url}/comment/{episode_id}",
-                params=params
-            )
-            response.raise_for_status()
-            return response.json()
+        path = f"/comment/{episode_id}"
+        
+        async def fetch() -> Dict:
+            response = await self._send("GET", path, params=params, priority=priority)
+            result = response.json()
+            
+            # Only successful payloads are cached, sized by their upstream bytes
+            if use_cache and result.get("success", False):
+                self.comment_cache.set(
+                    cache_key,
+                    result,
+                    size=len(response.content),
+                    ttl=settings.comment_cache_ttl
+                )
+            return result
+        
+        try:
+            return await self.flights.do(flight_key("GET", path, params), fetch)
+        except Exception as e:
+            # Serve recently expired comments rather than nothing
+            if use_cache and is_upstream_failure(e):
+                stale = self.comment_cache.get_stale(cache_key)
+                if stale is not None:
+                    return stale
+            raise
     
     async def get_extcomment(self, url: str) -> Dict:
         """
@@ -97,13 +462,7 @@ class DanDanAPIProxy:
         Returns:
             Comments data from API
         """
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(
-                f"{self.base_url}/extcomment",
-                params={"url": url}
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._request("GET", "/extcomment", params={"url": url})
     
     async def search_anime(self, keyword: str) -> Dict:
         """
@@ -115,13 +474,7 @@ class DanDanAPIProxy:
         Returns:
             Search results from API
         """
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(
-                f"{self.base_url}/search/anime",
-                params={"keyword": keyword}
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._request("GET", "/search/anime", params={"keyword": keyword})
     
     async def get_anime_detail(self, anime_id: int) -> Dict:
         """
@@ -133,9 +486,8 @@ class DanDanAPIProxy:
         Returns:
             Anime details from API
         """
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(
-                f"{self.base_url}/anime/{anime_id}"
-            )
-            response.raise_for_status()
-            return response.json()
\ No newline at end of file
+        return await self._request("GET", f"/anime/{anime_id}")
+
+
+# Shared proxy instance, its client is opened and closed in the app lifespan
+dandan_proxy = DanDanAPIProxy()
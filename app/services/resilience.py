@@ -0,0 +1,173 @@
+"""Upstream health tracking: latency, retries and circuit breaking"""
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+import httpx
+
+from app.config import settings
+from app.core.exceptions import UpstreamUnavailableException
+
+# Numeric path segments, so /comment/123 and /comment/456 share statistics
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """Endpoint label for a request path, e.g. "GET /comment/{id}" """
+    return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number attempt + 1"""
+    cap = min(settings.upstream_backoff_max, settings.upstream_backoff_base * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """Statuses that say more about the upstream's health than the request"""
+    return status_code >= 500 or status_code == 429
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Whether an error means the upstream could not answer (not a rejected request)"""
+    if isinstance(exc, (UpstreamUnavailableException, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return is_retryable_status(exc.response.status_code)
+    return False
+
+
+class LatencyTracker:
+    """
+    Recent latencies per endpoint and the timeouts derived from them
+
+    Once an endpoint has enough samples, its timeout follows its observed
+    p95 (times upstream_timeout_factor) between the configured bounds, so
+    one slow upstream is given up on long before the fixed maximum.
+    """
+
+    window = 200
+    min_samples = 20
+
+    def __init__(self):
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        """Record one upstream call"""
+        samples = self._samples.setdefault(endpoint, deque(maxlen=self.window))
+        counts = self._counts.setdefault(endpoint, {"requests": 0, "errors": 0})
+        counts["requests"] += 1
+        if ok:
+            samples.append(seconds)
+        else:
+            counts["errors"] += 1
+
+    def percentile(self, endpoint: str, q: float) -> float:
+        """Latency percentile (0 <= q <= 1) of recent successful calls, 0 if none"""
+        samples = sorted(self._samples.get(endpoint, ()))
+        if not samples:
+            return 0.0
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def timeout(self, endpoint: str) -> float:
+        """Timeout in seconds for the next call to an endpoint"""
+        if len(self._samples.get(endpoint, ())) < self.min_samples:
+            return settings.upstream_timeout_max
+        adaptive = self.percentile(endpoint, 0.95) * settings.upstream_timeout_factor
+        return min(max(adaptive, settings.upstream_timeout_min), settings.upstream_timeout_max)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-endpoint counters, percentiles and current timeout"""
+        return {
+            endpoint: {
+                **counts,
+                "p50": self.percentile(endpoint, 0.5),
+                "p95": self.percentile(endpoint, 0.95),
+                "timeout": self.timeout(endpoint)
+            }
+            for endpoint, counts in self._counts.items()
+        }
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker for one upstream
+
+    The breaker opens when at least breaker_min_requests calls were made in
+    the last breaker_window seconds and the share of failures among them
+    reaches breaker_error_threshold. While open, calls are refused; after
+    breaker_cooldown seconds one trial call is let through (half-open),
+    which closes the breaker on success and reopens it on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+
+    def _trim(self, now: float):
+        horizon = now - settings.breaker_window
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+
+    def error_rate(self) -> float:
+        """Share of failed calls within the window"""
+        self._trim(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return failures / len(self._outcomes)
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= settings.breaker_cooldown:
+            # Let one trial through, the next one waits another cooldown
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+    def record(self, ok: bool):
+        """Record the outcome of a call"""
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            else:
+                self.state = self.OPEN
+                self.opened_at = now
+            return
+
+        self._outcomes.append((now, ok))
+        self._trim(now)
+        if (
+            self.state == self.CLOSED
+            and not ok
+            and len(self._outcomes) >= settings.breaker_min_requests
+            and self.error_rate() >= settings.breaker_error_threshold
+        ):
+            self.state = self.OPEN
+            self.opened_at = now
+            self.trips += 1
+            print(f"Circuit breaker opened for {self.name}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Breaker state and recent error rate"""
+        return {
+            "state": self.state,
+            "error_rate": self.error_rate(),
+            "trips": self.trips
+        }
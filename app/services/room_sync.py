@@ -0,0 +1,192 @@
+"""Watch-party playback sync: server room clocks, RTT and heartbeats"""
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.config import settings
+from app.services.state_backend import NODE_ID, shared_state
+
+# Shared state namespace of the room clocks
+SYNC_NAMESPACE = "sync_rooms"
+
+# Weight of a new RTT sample in the per-client average
+RTT_SMOOTHING = 0.25
+# RTT samples above this are treated as outliers and clamped
+RTT_MAX = 5.0
+
+HeartbeatHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+def clock_position(clock: Dict[str, Any], now: float) -> float:
+    """Playback position of a room clock at server time now"""
+    if not clock["playing"]:
+        return clock["position"]
+    return clock["position"] + (now - clock["updated_at"]) * clock["rate"]
+
+
+class RoomSync:
+    """
+    Server-authoritative playback clock per room
+
+    A room clock is (position, playing, rate) as of a server wall-clock
+    time, so any worker can tell where playback should be now. Sync
+    reports are compensated by half the sender's RTT (clients report the
+    RTT measured from ping/pong) and only change the clock, and get
+    broadcast, when play state or rate changes or the reported position is
+    more than sync_drift_threshold seconds off. While a room plays, the
+    worker that last updated its clock sends a compact heartbeat every
+    sync_heartbeat_interval seconds so clients correct slow drift.
+    """
+
+    def __init__(self, on_heartbeat: HeartbeatHandler):
+        self.on_heartbeat = on_heartbeat
+        self._rtt: Dict[str, float] = {}
+        self._owned: Set[str] = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.updates = 0
+        self.suppressed = 0
+        self.heartbeats = 0
+
+    def record_rtt(self, client_id: str, rtt: Any):
+        """Fold a client-measured round-trip time (seconds) into its average"""
+        try:
+            sample = float(rtt)
+        except (TypeError, ValueError):
+            return
+        if math.isnan(sample):
+            return
+        sample = min(max(sample, 0.0), RTT_MAX)
+        previous = self._rtt.get(client_id)
+        if previous is None:
+            self._rtt[client_id] = sample
+        else:
+            self._rtt[client_id] = previous + RTT_SMOOTHING * (sample - previous)
+
+    def rtt(self, client_id: str) -> float:
+        """Average round-trip time of a client, 0 if unknown"""
+        return self._rtt.get(client_id, 0.0)
+
+    def forget(self, client_id: str):
+        """Drop the RTT of a disconnected client"""
+        self._rtt.pop(client_id, None)
+
+    async def clock(self, room: str) -> Optional[Dict[str, Any]]:
+        """Current clock of a room, None before its first sync"""
+        return await shared_state.get(SYNC_NAMESPACE, room)
+
+    async def report(
+        self,
+        room: str,
+        client_id: str,
+        position: Any,
+        playing: Any,
+        rate: Any = 1.0
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Apply a client's playback report to the room clock
+
+        Args:
+            room: Room of the client
+            client_id: Reporting client
+            position: Client playback position in seconds
+            playing: Whether the client is playing
+            rate: Playback rate
+
+        Returns:
+            Sync message to broadcast, None if the clock did not change
+            or the report is invalid
+        """
+        try:
+            position = float(position)
+            rate = float(rate) if rate is not None else 1.0
+        except (TypeError, ValueError):
+            return None
+        # json.loads accepts NaN/Infinity, which would poison the shared clock
+        if not (math.isfinite(position) and math.isfinite(rate) and rate > 0):
+            return None
+        position = max(position, 0.0)
+        playing = bool(playing)
+        now = time.time()
+        if playing:
+            # Playback moved on while the report was in flight
+            position += self.rtt(client_id) / 2 * rate
+
+        clock = await self.clock(room)
+        if clock is not None and clock["playing"] == playing and clock["rate"] == rate:
+            if abs(position - clock_position(clock, now)) < settings.sync_drift_threshold:
+                self.suppressed += 1
+                return None
+
+        clock = {
+            "version": clock["version"] + 1 if clock is not None else 1,
+            "position": position,
+            "playing": playing,
+            "rate": rate,
+            "updated_at": now,
+            "sender": client_id,
+            "node": NODE_ID
+        }
+        await shared_state.set(SYNC_NAMESPACE, room, clock)
+        self.updates += 1
+
+        self._owned.add(room)
+        if playing and (self._heartbeat is None or self._heartbeat.done()):
+            self._heartbeat = asyncio.ensure_future(self._heartbeat_loop())
+        return self.message(clock, now)
+
+    @staticmethod
+    def message(clock: Dict[str, Any], now: Optional[float] = None) -> Dict[str, Any]:
+        """Full sync message for a clock"""
+        now = time.time() if now is None else now
+        return {
+            "type": "sync",
+            "version": clock["version"],
+            "time": clock_position(clock, now),
+            "playing": clock["playing"],
+            "rate": clock["rate"],
+            "server_time": now,
+            "sender": clock["sender"]
+        }
+
+    async def _heartbeat_loop(self):
+        while self._owned:
+            await asyncio.sleep(settings.sync_heartbeat_interval)
+            for room in list(self._owned):
+                clock = await self.clock(room)
+                if clock is None or clock["node"] != NODE_ID or not clock["playing"]:
+                    # Paused, or another worker updated it last
+                    self._owned.discard(room)
+                    continue
+                now = time.time()
+                self.heartbeats += 1
+                try:
+                    await self.on_heartbeat(room, {
+                        "type": "sync_heartbeat",
+                        "version": clock["version"],
+                        "time": round(clock_position(clock, now), 3),
+                        "server_time": now
+                    })
+                except Exception as e:
+                    print(f"Error sending sync heartbeat to {room}: {e}")
+
+    def release(self, room: str):
+        """Stop sending heartbeats for a room nobody is left in"""
+        self._owned.discard(room)
+
+    async def close(self):
+        """Stop the heartbeat loop"""
+        self._owned.clear()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Sync counters"""
+        return {
+            "rooms": len(self._owned),
+            "updates": self.updates,
+            "suppressed": self.suppressed,
+            "heartbeats": self.heartbeats
+        }
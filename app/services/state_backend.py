@@ -0,0 +1,207 @@
+"""Shared state backend for running several workers or nodes"""
+import asyncio
+import json
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.config import settings
+
+# Identifies this process in shared state (e.g. which node holds a WebSocket)
+NODE_ID = uuid.uuid4().hex
+
+MessageHandler = Callable[[Any], Awaitable[None]]
+
+
+class MemoryStateBackend:
+    """State and pub/sub within this process only"""
+
+    distributed = False
+
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        self._hashes.clear()
+
+    async def hget(self, name: str, key: str) -> Optional[str]:
+        return self._hashes.get(name, {}).get(key)
+
+    async def hset(self, name: str, key: str, value: str):
+        self._hashes.setdefault(name, {})[key] = value
+
+    async def hdel(self, name: str, key: str):
+        self._hashes.get(name, {}).pop(key, None)
+
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        return dict(self._hashes.get(name, {}))
+
+    async def publish(self, channel: str, message: str):
+        for queue in self._subscribers.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def listen(self, channel: str, handler: Callable[[str], Awaitable[None]]):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                await handler(await queue.get())
+        finally:
+            self._subscribers[channel].discard(queue)
+
+
+class RedisStateBackend:
+    """State in Redis hashes and pub/sub channels, shared by every worker and node"""
+
+    distributed = True
+    prefix = "dandan:state:"
+
+    def __init__(self, url: str):
+        self.url = url
+        self._redis = None
+
+    async def open(self):
+        import redis.asyncio as redis
+
+        client = redis.from_url(self.url, decode_responses=True)
+        try:
+            await client.ping()
+        except Exception:
+            await client.close()
+            raise
+        self._redis = client
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    async def hget(self, name: str, key: str) -> Optional[str]:
+        return await self._redis.hget(self.prefix + name, key)
+
+    async def hset(self, name: str, key: str, value: str):
+        await self._redis.hset(self.prefix + name, key, value)
+
+    async def hdel(self, name: str, key: str):
+        await self._redis.hdel(self.prefix + name, key)
+
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        return await self._redis.hgetall(self.prefix + name)
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(self.prefix + channel, message)
+
+    async def listen(self, channel: str, handler: Callable[[str], Awaitable[None]]):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.prefix + channel)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        await handler(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"State subscription to {channel} failed, retrying: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+
+class SharedState:
+    """
+    Key/value state and messages shared between processes
+
+    Uses Redis when settings.redis_url is reachable, so several uvicorn
+    workers or nodes behind nginx see the same video registry entries,
+    WebSocket presence and runtime settings. Falls back to an in-process
+    backend otherwise, which behaves the same for a single worker.
+    Values are stored as JSON.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._listeners: List[asyncio.Task] = []
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = MemoryStateBackend()
+        return self._backend
+
+    @property
+    def distributed(self) -> bool:
+        """Whether other processes share this state"""
+        return self.backend.distributed
+
+    async def open(self):
+        """Connect to Redis if configured, falling back to process memory"""
+        if self._backend is not None:
+            return
+
+        if settings.redis_url:
+            backend = RedisStateBackend(settings.redis_url)
+            try:
+                await backend.open()
+                self._backend = backend
+                return
+            except Exception as e:
+                print(f"Shared state: Redis unavailable ({e}), using process memory")
+
+        self._backend = MemoryStateBackend()
+
+    async def close(self):
+        """Stop listeners and disconnect"""
+        for task in self._listeners:
+            task.cancel()
+        await asyncio.gather(*self._listeners, return_exceptions=True)
+        self._listeners.clear()
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+    async def get(self, name: str, key: str) -> Any:
+        """Value stored under a key of a namespace, or None"""
+        value = await self.backend.hget(name, key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, name: str, key: str, value: Any):
+        """Store a JSON-serializable value"""
+        await self.backend.hset(name, key, json.dumps(value, ensure_ascii=False))
+
+    async def delete(self, name: str, key: str):
+        """Remove a key from a namespace"""
+        await self.backend.hdel(name, key)
+
+    async def get_all(self, name: str) -> Dict[str, Any]:
+        """Every value of a namespace"""
+        values = await self.backend.hgetall(name)
+        return {key: json.loads(value) for key, value in values.items()}
+
+    async def publish(self, channel: str, message: Any):
+        """Send a JSON-serializable message to every listener of a channel"""
+        await self.backend.publish(channel, json.dumps(message, ensure_ascii=False))
+
+    def listen(self, channel: str, handler: MessageHandler):
+        """Call handler with each message of a channel until close()"""
+        async def deliver(raw: str):
+            try:
+                await handler(json.loads(raw))
+            except Exception as e:
+                print(f"Error handling {channel} message: {e}")
+
+        self._listeners.append(asyncio.ensure_future(self.backend.listen(channel, deliver)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend in use"""
+        return {
+            "backend": "redis" if self.distributed else "memory",
+            "node_id": NODE_ID
+        }
+
+
+# Global shared state
+shared_state = SharedState()
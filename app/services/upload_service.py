@@ -0,0 +1,211 @@
+"""Streaming video upload service"""
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+import aiofiles
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app.core.exceptions import InvalidUploadException, UploadTooLargeException
+from app.services.md5_service import HeadMD5, ProgressCallback
+
+# Video extensions accepted when the client sends no video/* content type
+ALLOWED_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm']
+
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+@dataclass
+class UploadedVideo:
+    """A video file received from an upload stream"""
+    id: str
+    name: str
+    path: str
+    size: int
+    content_type: Optional[str] = None
+    md5: Optional[str] = None
+
+
+class StreamingUploadReceiver:
+    """
+    Receive a multipart/form-data upload and stream its file part to disk
+
+    The request body is parsed incrementally and written in bounded chunks,
+    so memory use per upload stays constant regardless of the file size.
+    The size limit is enforced while streaming and the partial file is
+    removed as soon as it is exceeded. The DanDanPlay MD5 of the first 16MB
+    is computed from the same bytes, so it is ready when the upload ends;
+    on_md5_progress is called as it advances.
+    """
+
+    def __init__(
+        self,
+        upload_dir: str,
+        max_size: int,
+        chunk_size: int = 1024 * 1024,
+        field_name: str = "file",
+        on_md5_progress: Optional[ProgressCallback] = None
+    ):
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.field_name = field_name
+        self.on_md5_progress = on_md5_progress
+
+        self._events: List[Tuple[str, object]] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._part_headers: Dict[bytes, bytes] = {}
+
+    # Parser callbacks (synchronous, queue events for the async writer)
+
+    def _on_part_begin(self):
+        self._part_headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._part_headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        self._events.append(("headers", self._part_headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        self._events.append(("end", None))
+
+    def _check_size(self, size: int):
+        if size > self.max_size:
+            raise UploadTooLargeException(
+                f"File too large. Maximum size is {self.max_size / (1024**3):.2f} GB"
+            )
+
+    @staticmethod
+    def _validate_file(filename: str, content_type: Optional[str]):
+        """Reject parts that do not look like a video file"""
+        if content_type and content_type.startswith('video/'):
+            return
+        file_ext = Path(filename).suffix.lower() if filename else ''
+        if file_ext not in ALLOWED_EXTENSIONS:
+            raise InvalidUploadException("Invalid file type. Please upload a video file.")
+
+    async def receive(
+        self,
+        headers: Mapping[str, str],
+        stream: AsyncIterator[bytes]
+    ) -> UploadedVideo:
+        """
+        Stream the upload body to a new file in the upload directory
+
+        Args:
+            headers: Request headers
+            stream: Async iterator over the raw request body
+
+        Returns:
+            Information about the stored video file
+        """
+        content_type, params = parse_options_header(headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise InvalidUploadException("Expected a multipart/form-data upload")
+
+        # Fail fast on declared body sizes that cannot possibly fit
+        content_length = headers.get("content-length")
+        if content_length and content_length.isdigit():
+            self._check_size(max(int(content_length) - MULTIPART_OVERHEAD, 0))
+
+        parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+        upload: Optional[UploadedVideo] = None
+        out = None
+        in_file_part = False
+        finished = False
+        buffer = bytearray()
+        hasher = HeadMD5(on_progress=self.on_md5_progress)
+
+        try:
+            async for chunk in stream:
+                parser.write(chunk)
+                events, self._events = self._events, []
+
+                for kind, payload in events:
+                    if kind == "headers":
+                        _, disposition = parse_options_header(
+                            payload.get(b"content-disposition", b"")
+                        )
+                        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                        in_file_part = (
+                            name == self.field_name
+                            and b"filename" in disposition
+                            and upload is None
+                        )
+                        if not in_file_part:
+                            continue
+
+                        filename = disposition[b"filename"].decode("utf-8", "replace")
+                        part_type = payload.get(b"content-type", b"").decode("latin-1") or None
+                        self._validate_file(filename, part_type)
+
+                        file_id = str(uuid.uuid4())
+                        file_ext = Path(filename).suffix if filename else '.mp4'
+                        upload = UploadedVideo(
+                            id=file_id,
+                            name=filename or "unknown.mp4",
+                            path=os.path.join(self.upload_dir, f"{file_id}{file_ext}"),
+                            size=0,
+                            content_type=part_type
+                        )
+                        out = await aiofiles.open(upload.path, 'wb')
+
+                    elif kind == "data" and in_file_part:
+                        upload.size += len(payload)
+                        self._check_size(upload.size)
+                        await hasher.feed(payload)
+                        buffer += payload
+                        if len(buffer) >= self.chunk_size:
+                            await out.write(buffer)
+                            buffer.clear()
+
+                    elif kind == "end" and in_file_part:
+                        if buffer:
+                            await out.write(buffer)
+                            buffer.clear()
+                        in_file_part = False
+                        finished = True
+
+            parser.finalize()
+
+            if upload is None or not finished:
+                raise InvalidUploadException("No video file found in upload")
+
+            await out.close()
+            out = None
+            await hasher.finish()
+            upload.md5 = hasher.hexdigest()
+            return upload
+
+        except BaseException:
+            if out is not None:
+                await out.close()
+            if upload is not None and os.path.exists(upload.path):
+                os.remove(upload.path)
+            raise
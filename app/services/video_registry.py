@@ -0,0 +1,222 @@
+"""Uploaded video registry"""
+import asyncio
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services.state_backend import shared_state
+from app.services.stream_service import guess_content_type
+
+# Index file kept next to the videos, hidden from the directory scan
+REGISTRY_FILE = ".registry.json"
+
+# Shared state namespace of video records
+SHARED_NAMESPACE = "videos"
+
+# Seconds changes are collected before the index file is rewritten
+SAVE_DELAY = 1.0
+
+
+@dataclass
+class VideoRecord:
+    """An uploaded video file"""
+    id: str
+    path: str
+    size: int
+    mtime: float
+    content_type: str
+    md5: Optional[str] = None
+
+
+class VideoRegistry:
+    """
+    In-memory index of uploaded videos keyed by video ID
+
+    The index is built once from the upload directory and persisted to a
+    JSON file in it, so request handlers never have to list the directory.
+    Persisted MD5 hashes are kept across restarts as long as the file's size
+    and modification time are unchanged. Changes made while the event loop
+    runs are written SAVE_DELAY seconds later in a worker thread, so a burst
+    of updates costs one rewrite and never blocks the loop.
+
+    When the shared state is distributed (several workers or nodes on a
+    shared upload volume), it is the source of truth: lookup() reads the
+    shared record and share()/unshare() publish changes to it.
+    """
+
+    def __init__(self, upload_dir: str):
+        self.upload_dir = upload_dir
+        self.index_path = os.path.join(upload_dir, REGISTRY_FILE)
+        self._records: Dict[str, VideoRecord] = {}
+        self._loaded = False
+        self._save_lock = threading.Lock()
+        self._saver: Optional[asyncio.Task] = None
+
+    def load(self):
+        """Build the index from the upload directory and the persisted file"""
+        persisted: Dict[str, dict] = {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                persisted = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Error loading video registry: {e}")
+
+        records = {}
+        os.makedirs(self.upload_dir, exist_ok=True)
+        with os.scandir(self.upload_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+
+                video_id = entry.name.partition('.')[0]
+                if video_id in records:
+                    continue
+
+                stat = entry.stat()
+                md5 = None
+                old = persisted.get(video_id)
+                if old and old.get("size") == stat.st_size and old.get("mtime") == stat.st_mtime:
+                    md5 = old.get("md5")
+
+                records[video_id] = VideoRecord(
+                    id=video_id,
+                    path=entry.path,
+                    size=stat.st_size,
+                    mtime=stat.st_mtime,
+                    content_type=guess_content_type(entry.name),
+                    md5=md5
+                )
+
+        self._records = records
+        self._loaded = True
+        self.save()
+
+    def save(self):
+        """Persist the index atomically"""
+        self._write({vid: asdict(record) for vid, record in self._records.items()})
+
+    def _write(self, snapshot: Dict[str, dict]):
+        with self._save_lock:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+    def _changed(self):
+        """Schedule a save of the changed index"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from the event loop, nothing to block
+            self.save()
+            return
+        if self._saver is None or self._saver.done():
+            self._saver = asyncio.ensure_future(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        # Snapshot on the loop, while no handler is changing the records
+        snapshot = {vid: asdict(record) for vid, record in self._records.items()}
+        try:
+            await run_in_threadpool(self._write, snapshot)
+        except OSError as e:
+            print(f"Error saving video registry: {e}")
+
+    async def flush(self):
+        """Write a pending save now"""
+        if self._saver is not None and not self._saver.done():
+            self._saver.cancel()
+            await asyncio.gather(self._saver, return_exceptions=True)
+            await run_in_threadpool(self.save)
+        self._saver = None
+
+    def get(self, video_id: str) -> Optional[VideoRecord]:
+        """Look up a video by ID"""
+        if not self._loaded:
+            self.load()
+        return self._records.get(video_id)
+
+    def add(self, video_id: str, path: str, md5: Optional[str] = None) -> VideoRecord:
+        """Register a newly stored video file"""
+        if not self._loaded:
+            self.load()
+        stat = os.stat(path)
+        record = VideoRecord(
+            id=video_id,
+            path=path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            content_type=guess_content_type(path),
+            md5=md5
+        )
+        self._records[video_id] = record
+        self._changed()
+        return record
+
+    def set_md5(self, video_id: str, md5: str) -> Optional[VideoRecord]:
+        """Store the MD5 hash of a registered video, returning its record"""
+        record = self.get(video_id)
+        if record:
+            record.md5 = md5
+            self._changed()
+        return record
+
+    def remove(self, video_id: str) -> Optional[VideoRecord]:
+        """Unregister a video, returning its record if it existed"""
+        if not self._loaded:
+            self.load()
+        record = self._records.pop(video_id, None)
+        if record:
+            self._changed()
+        return record
+
+    async def lookup(self, video_id: str) -> Optional[VideoRecord]:
+        """Look up a video, including those registered by other workers"""
+        if not shared_state.distributed:
+            return self.get(video_id)
+
+        data = await shared_state.get(SHARED_NAMESPACE, video_id)
+        if data is None:
+            # Deleted elsewhere (or never uploaded)
+            if self.get(video_id) is not None:
+                self.remove(video_id)
+            return None
+
+        record = VideoRecord(**data)
+        local = self.get(video_id)
+        if local == record:
+            # Hand out the indexed record, so updates to it are kept
+            return local
+        self._records[video_id] = record
+        self._changed()
+        return record
+
+    async def share(self, record: VideoRecord):
+        """Publish a video record to the shared state"""
+        await shared_state.set(SHARED_NAMESPACE, record.id, asdict(record))
+
+    async def unshare(self, video_id: str):
+        """Remove a video record from the shared state"""
+        await shared_state.delete(SHARED_NAMESPACE, video_id)
+
+    async def sync_shared(self):
+        """Publish locally indexed videos the shared state does not know yet"""
+        if not shared_state.distributed:
+            return
+        if not self._loaded:
+            self.load()
+        known = await shared_state.get_all(SHARED_NAMESPACE)
+        for video_id, record in self._records.items():
+            if video_id not in known:
+                await self.share(record)
+
+
+# Global registry for the configured upload directory
+video_registry = VideoRegistry(settings.upload_dir)
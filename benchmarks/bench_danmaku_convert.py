@@ -0,0 +1,71 @@
+"""
+Danmaku conversion time: per-comment converters vs. the columnar batch
+
+Converts synthetic DanDanPlay comment sets of 10k, 100k and 1M comments
+to each output format, once with the per-comment converters (what
+convert_batch did before) and once with convert_batch over DanmakuColumns,
+checks both outputs match and reports the best of --repeat runs.
+
+    python benchmarks/bench_danmaku_convert.py --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+
+from common import best
+
+from app.services.danmaku_service import DanmakuColumns, DanmakuConverter
+
+PER_COMMENT = {
+    "nplayer": DanmakuConverter.dandan_to_nplayer,
+    "artplayer": DanmakuConverter.dandan_to_artplayer,
+    "ccl": DanmakuConverter.dandan_to_ccl
+}
+
+
+def synthetic_comments(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    colors = [16777215] * 6 + [255, 65280, 16711680, 16776960]
+    return [
+        {
+            "cid": i,
+            "p": f"{rng.random() * 1440:.2f},{rng.choice('11111145')},{rng.choice(colors)},{rng.randrange(10**7)}",
+            "m": rng.choice(["草", "哈哈哈", "233", "前方高能", "awsl"]) + str(rng.randrange(100))
+        }
+        for i in range(count)
+    ]
+
+
+def convert_each(comments, convert):
+    converted = []
+    for comment in comments:
+        try:
+            converted.append(convert(comment))
+        except ValueError:
+            continue
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--formats", nargs="+", choices=sorted(PER_COMMENT), default=sorted(PER_COMMENT))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        comments = synthetic_comments(size)
+        parse = best(lambda: DanmakuColumns.from_comments(comments), args.repeat)
+        print(f"{size:>9} comments  column parse {parse * 1000:9.1f} ms")
+        for target_format in args.formats:
+            convert = PER_COMMENT[target_format]
+            assert DanmakuConverter.convert_batch(comments, target_format) == convert_each(comments, convert)
+            old = best(lambda: convert_each(comments, convert), args.repeat)
+            new = best(lambda: DanmakuConverter.convert_batch(comments, target_format), args.repeat)
+            print(
+                f"{'':>9} {target_format:<10} per-comment {old * 1000:9.1f} ms  "
+                f"columnar {new * 1000:9.1f} ms  x{old / new:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
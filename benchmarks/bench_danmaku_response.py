@@ -0,0 +1,150 @@
+"""
+Time to first byte and peak memory of GET /api/danmaku/{id} per response mode
+
+Serves a synthetic episode with N comments from a stubbed upstream and
+calls the endpoint in-process through ASGI, once as a regular
+DanmakuResponse, once with stream=true and once as NDJSON. Reports time to
+first byte and total time (best of --repeat runs), then the peak Python
+heap while building the response (tracemalloc, in a separate run since
+tracing slows everything down). Artifacts are disabled so every request
+converts and serializes.
+
+    python benchmarks/bench_danmaku_response.py --comments 10000 100000 500000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from common import mb
+
+MODES = {
+    "full": ("", {}),
+    "stream": ("&stream=true", {}),
+    "ndjson": ("", {"accept": "application/x-ndjson"})
+}
+
+
+def synthetic_body(count: int) -> bytes:
+    rng = random.Random(count)
+    comments = [
+        {
+            "cid": i,
+            "p": f"{i * 1440 / count:.2f},{rng.choice('11111145')},{rng.choice([16777215, 255, 65280])},{rng.randrange(10**7)}",
+            "m": rng.choice(["草", "哈哈哈", "233", "前方高能", "awsl"]) + str(rng.randrange(100))
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"count": count, "comments": comments, "success": True}).encode("utf-8")
+
+
+async def request(app, path: str, query: str, headers: dict):
+    """Call the ASGI app, returning (seconds to first body byte, total seconds, body size)"""
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    status = None
+
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses listen for a disconnect until they are done
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal first_byte, size, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(message["body"])
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(name.encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80)
+    }
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    assert status == 200, status
+    return first_byte, time.perf_counter() - started, size
+
+
+async def run(args):
+    import httpx
+    from fastapi import FastAPI
+    from app.api import danmaku
+    from app.services.proxy_service import dandan_proxy
+
+    bodies = {}
+
+    def upstream(request: httpx.Request) -> httpx.Response:
+        episode_id = int(request.url.path.rsplit("/", 1)[1])
+        return httpx.Response(200, content=bodies[episode_id], headers={"content-type": "application/json"})
+
+    dandan_proxy._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    app = FastAPI()
+    app.include_router(danmaku.router, prefix="/api/danmaku")
+
+    for episode_id, count in enumerate(args.comments, 1):
+        bodies[episode_id] = synthetic_body(count)
+        path = f"/api/danmaku/{episode_id}"
+        base_query = f"format={args.format}"
+        # Fill the comment cache, so runs measure conversion and serialization only
+        await request(app, path, base_query, {})
+
+        print(f"{count:>8} comments, format={args.format}")
+        for mode, (query, headers) in MODES.items():
+            runs = [await request(app, path, base_query + query, headers) for _ in range(args.repeat)]
+            ttfb = min(run[0] for run in runs)
+            total = min(run[1] for run in runs)
+
+            tracemalloc.start()
+            await request(app, path, base_query + query, headers)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(
+                f"{'':>8} {mode:<7} TTFB {ttfb * 1000:8.1f} ms  total {total * 1000:8.1f} ms  "
+                f"body {mb(runs[0][2])}  peak heap {mb(peak)}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--comments", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--format", default="nplayer", choices=["raw", "nplayer", "artplayer", "ccl"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Configure the app before it is imported
+    os.environ["DANMAKU_ARTIFACTS_ENABLED"] = "false"
+    os.environ["LIVE_DANMAKU_LOG_ENABLED"] = "false"
+    os.environ["UPSTREAM_RATE_LIMIT"] = "0"
+    os.environ["COMMENT_CACHE_MAX_BYTES"] = str(4 * 1024 ** 3)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Peak memory of concurrent video uploads (POST /api/video/upload)
+
+Streams synthetic multi-GB multipart uploads through the app in-process
+and reports how much the process RSS grows. With the streaming receiver
+the growth stays flat as the file size increases; --mode buffered runs
+the same uploads against the previous implementation (the whole file read
+into memory with UploadFile.read()) for comparison. Needs free disk space
+for size x concurrency in the temporary directory, and buffered mode as
+much free memory.
+
+    python benchmarks/bench_upload_memory.py --size-mb 2048 --concurrency 4
+    python benchmarks/bench_upload_memory.py --size-mb 512 --mode buffered
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+
+from common import RSSSampler, Timer, mb
+
+BOUNDARY = "benchmarkboundary"
+BLOCK_SIZE = 1024 * 1024
+
+
+def buffered_app(upload_dir: str):
+    """The upload endpoint before streaming: UploadFile.read() then one write"""
+    import aiofiles
+    from fastapi import FastAPI, File, UploadFile
+
+    app = FastAPI()
+
+    @app.post("/api/video/upload")
+    async def upload_video(file: UploadFile = File(...)):
+        path = os.path.join(upload_dir, file.filename)
+        async with aiofiles.open(path, "wb") as f:
+            content = await file.read()
+            await f.write(content)
+        return {"success": True, "size": len(content)}
+
+    return app
+
+
+def streaming_app():
+    from fastapi import FastAPI
+    from app.api import video
+
+    app = FastAPI()
+    app.include_router(video.router, prefix="/api/video")
+    return app
+
+
+async def upload_body(index: int, size: int, block: bytes):
+    """Multipart body with a synthetic file of size bytes, generated as it is sent"""
+    yield (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="bench{index}.mkv"\r\n'
+        "Content-Type: video/x-matroska\r\n\r\n"
+    ).encode()
+    remaining = size
+    while remaining > 0:
+        chunk = block[:min(len(block), remaining)]
+        remaining -= len(chunk)
+        yield chunk
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def run(args, upload_dir: str):
+    import httpx
+
+    app = buffered_app(upload_dir) if args.mode == "buffered" else streaming_app()
+    size = args.size_mb * 1024 * 1024
+    block = os.urandom(BLOCK_SIZE)
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://bench",
+        timeout=None
+    ) as client:
+        async def upload(index: int):
+            response = await client.post(
+                "/api/video/upload",
+                content=upload_body(index, size, block),
+                headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+            )
+            response.raise_for_status()
+
+        with RSSSampler() as rss, Timer() as timer:
+            await asyncio.gather(*(upload(i) for i in range(args.concurrency)))
+
+    total = size * args.concurrency
+    print(f"mode           {args.mode}")
+    print(f"uploads        {args.concurrency} x {mb(size)}")
+    print(f"elapsed        {timer.elapsed:.2f} s ({mb(total / timer.elapsed)}/s)")
+    print(f"baseline RSS   {mb(rss.baseline)}")
+    print(f"peak RSS       {mb(rss.peak)}")
+    print(f"RSS growth     {mb(rss.growth)} ({mb(rss.growth / args.concurrency)} per upload)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size-mb", type=int, default=2048, help="size of each uploaded file")
+    parser.add_argument("--concurrency", type=int, default=4, help="simultaneous uploads")
+    parser.add_argument("--mode", choices=["streaming", "buffered"], default="streaming")
+    args = parser.parse_args()
+
+    upload_dir = tempfile.mkdtemp(prefix="bench-upload-")
+    # Configure the app before it is imported
+    os.environ["UPLOAD_DIR"] = upload_dir
+    os.environ["MAX_UPLOAD_SIZE"] = str(args.size_mb * 1024 * 1024 * 2)
+    try:
+        asyncio.run(run(args, upload_dir))
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Upstream call latency: a new httpx client per call vs. the pooled client
+
+Starts a local stub of the DanDanPlay API and sends the same comment
+requests through a fresh httpx.AsyncClient per call (a new TCP connection
+each time, as DanDanAPIProxy did before) and through the shared client
+from create_http_client() (keep-alive connection pool). The stub is plain
+HTTP on loopback, so the gap shown is client setup (each new client loads
+its own SSL context) plus a TCP connect; against the real API every new
+connection also pays a TLS handshake and network round trips.
+
+    python benchmarks/bench_upstream_client.py --requests 2000 --concurrency 1 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from common import ROOT, Timer, summarize
+
+COMMENTS = [
+    {"cid": i, "p": f"{i * 0.5:.2f},1,16777215,{i}", "m": f"comment {i}"}
+    for i in range(50)
+]
+
+
+def serve(port: int):
+    """Stub DanDanPlay comment endpoint (called in the server subprocess)"""
+    import uvicorn
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/api/v2/comment/{episode_id}")
+    async def comments(episode_id: int):
+        return {"count": len(COMMENTS), "comments": COMMENTS}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url: str, timeout: float = 15.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def measure(call, requests: int, concurrency: int):
+    latencies = []
+    queue = iter(range(requests))
+
+    async def worker():
+        for index in queue:
+            started = time.perf_counter()
+            await call(index)
+            latencies.append(time.perf_counter() - started)
+
+    with Timer() as timer:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return timer.elapsed, latencies
+
+
+async def run(args, base_url: str):
+    import httpx
+    from app.services.proxy_service import create_http_client
+
+    await wait_ready(f"{base_url}/comment/1")
+
+    async def per_call(index: int):
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            response = await client.get(f"{base_url}/comment/{index}")
+            response.raise_for_status()
+
+    pooled_client = create_http_client()
+
+    async def pooled(index: int):
+        response = await pooled_client.get(f"{base_url}/comment/{index}")
+        response.raise_for_status()
+
+    try:
+        for concurrency in args.concurrency:
+            for name, call in (("per-call client", per_call), ("pooled client", pooled)):
+                elapsed, latencies = await measure(call, args.requests, concurrency)
+                print(
+                    f"{name:<16} concurrency {concurrency:>3}  "
+                    f"{args.requests / elapsed:8.1f} req/s  {summarize(latencies)}"
+                )
+    finally:
+        await pooled_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--requests", type=int, default=2000, help="calls per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 20])
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)], cwd=ROOT)
+    try:
+        asyncio.run(run(args, f"http://127.0.0.1:{port}/api/v2"))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Range streaming throughput of GET /api/video/stream/{id} per stream mode
+
+Starts one uvicorn server per VIDEO_STREAM_MODE on a synthetic video and
+runs 1, 10 and 100 concurrent readers that each fetch random byte ranges
+for a fixed time. Reports throughput, request latency and the server's
+CPU time per GB sent (Linux only).
+
+- stream: aiofiles, 1 MB reads
+- pread: RangeFileResponse, 4 MB os.pread reads. uvicorn has no
+  http.response.zerocopysend, so the bytes are still copied through Python
+- accel: uvicorn behind nginx, which serves the X-Accel-Redirect with
+  sendfile (zero-copy). Needs nginx on PATH or --nginx, skipped otherwise;
+  its CPU time is that of nginx and uvicorn together
+
+    python benchmarks/bench_video_stream.py --file-mb 512 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from common import ROOT, mb, summarize
+
+VIDEO_ID = "bench"
+
+MODES = ["stream", "pread", "accel"]
+
+# Single-process nginx in front of the server, as in nginx/nginx.conf
+NGINX_CONF = """
+daemon off;
+master_process off;
+error_log {root}/error.log warn;
+pid {root}/nginx.pid;
+events {{ worker_connections 1024; }}
+http {{
+    access_log off;
+    client_body_temp_path {root}/client_body;
+    proxy_temp_path {root}/proxy;
+    fastcgi_temp_path {root}/fastcgi;
+    uwsgi_temp_path {root}/uwsgi;
+    scgi_temp_path {root}/scgi;
+    upstream backend {{
+        server 127.0.0.1:{backend_port};
+        keepalive 128;
+    }}
+    server {{
+        listen 127.0.0.1:{port};
+        location /api/ {{
+            proxy_pass http://backend;
+            proxy_http_version 1.1;
+            proxy_set_header Connection "";
+            proxy_set_header Range $http_range;
+            proxy_buffering off;
+        }}
+        location /protected-uploads/ {{
+            internal;
+            alias {upload_dir}/;
+            sendfile on;
+            tcp_nopush on;
+        }}
+    }}
+}}
+"""
+
+
+def serve(port: int):
+    """Run the video router alone (called in the server subprocess)"""
+    import uvicorn
+    from fastapi import FastAPI
+    from app.api import video
+
+    app = FastAPI()
+    app.include_router(video.router, prefix="/api/video")
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def start_nginx(nginx: str, root: str, port: int, backend_port: int, upload_dir: str) -> subprocess.Popen:
+    conf = os.path.join(root, "nginx.conf")
+    with open(conf, "w") as f:
+        f.write(NGINX_CONF.format(root=root, port=port, backend_port=backend_port, upload_dir=upload_dir))
+    return subprocess.Popen([nginx, "-p", root, "-c", conf])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process, None without /proc"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def wait_ready(base_url: str, timeout: float = 15.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(f"{base_url}/api/video/stream/missing")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def readers(base_url: str, file_size: int, concurrency: int, range_size: int, duration: float):
+    import httpx
+
+    latencies = []
+    sent = 0
+    url = f"{base_url}/api/video/stream/{VIDEO_ID}"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+        deadline = time.perf_counter() + duration
+
+        async def reader(seed: int):
+            nonlocal sent
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                start = rng.randrange(0, file_size - range_size)
+                started = time.perf_counter()
+                response = await client.get(url, headers={"Range": f"bytes={start}-{start + range_size - 1}"})
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 206 and len(response.content) == range_size
+                sent += len(response.content)
+
+        await asyncio.gather(*(reader(i) for i in range(concurrency)))
+    return sent, latencies
+
+
+async def bench_mode(mode: str, args, upload_dir: str, file_size: int):
+    nginx = None
+    if mode == "accel":
+        nginx = args.nginx or shutil.which("nginx")
+        if nginx is None:
+            print("accel     skipped, nginx not found (pass --nginx)")
+            return
+
+    backend_port = free_port()
+    env = dict(os.environ, VIDEO_STREAM_MODE=mode, UPLOAD_DIR=upload_dir)
+    servers = [subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(backend_port)],
+        cwd=ROOT,
+        env=env
+    )]
+    nginx_root = None
+    port = backend_port
+    if nginx is not None:
+        nginx_root = tempfile.mkdtemp(prefix="bench-nginx-")
+        port = free_port()
+        servers.append(start_nginx(nginx, nginx_root, port, backend_port, upload_dir))
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await wait_ready(base_url)
+        for concurrency in args.concurrency:
+            cpu_before = [cpu_seconds(server.pid) for server in servers]
+            started = time.perf_counter()
+            sent, latencies = await readers(
+                base_url, file_size, concurrency, args.range_kb * 1024, args.duration
+            )
+            elapsed = time.perf_counter() - started
+            cpu_after = [cpu_seconds(server.pid) for server in servers]
+
+            line = (
+                f"{mode:<9} readers {concurrency:>3}  {mb(sent / elapsed)}/s  "
+                f"{len(latencies) / elapsed:8.1f} req/s  {summarize(latencies)}"
+            )
+            if None not in cpu_before + cpu_after and sent:
+                cpu = sum(cpu_after) - sum(cpu_before)
+                line += f"  server CPU {cpu / (sent / 1024 ** 3):.2f} s/GB"
+            print(line)
+    finally:
+        for server in reversed(servers):
+            server.terminate()
+            server.wait()
+        if nginx_root is not None:
+            shutil.rmtree(nginx_root, ignore_errors=True)
+
+
+async def run(args):
+    upload_dir = tempfile.mkdtemp(prefix="bench-stream-")
+    try:
+        file_size = args.file_mb * 1024 * 1024
+        block = os.urandom(1024 * 1024)
+        with open(os.path.join(upload_dir, f"{VIDEO_ID}.mkv"), "wb") as f:
+            for _ in range(args.file_mb):
+                f.write(block)
+
+        for mode in args.modes:
+            await bench_mode(mode, args, upload_dir, file_size)
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--file-mb", type=int, default=512, help="size of the synthetic video")
+    parser.add_argument("--range-kb", type=int, default=2048, help="bytes fetched per range request")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--nginx", help="nginx binary for the accel mode (default: from PATH)")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+WebSocket fan-out load test with simulated clients
+
+Connects --clients simulated sockets to a ConnectionManager, spread over
+--rooms rooms, with a few deliberately slow consumers, and broadcasts
+--messages sync messages to the first room. Reports the time broadcast()
+takes (serialize once and enqueue), the delivery latency to the room's
+regular clients, what the slow ones dropped and that other rooms got
+nothing. The same messages are then sent the way broadcast worked before
+(send_json to every client of the server, one after another) for
+comparison. Runs in-process, so it measures the server side of the
+fan-out without network costs.
+
+    python benchmarks/bench_websocket_fanout.py --clients 2000 --rooms 4 --slow 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from common import mb, percentile
+
+
+class SimulatedSocket:
+    """Records when each message arrives; slow sockets take delay seconds per send"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.arrivals = []
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.received += len(text)
+        self.arrivals.append(time.perf_counter())
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def send_json(self, message: dict):
+        await self.send_text(json.dumps(message))
+
+
+async def run(args):
+    from app.api.websocket import ConnectionManager
+
+    manager = ConnectionManager()
+    sockets = {}
+    slow = set(range(0, args.clients, max(args.clients // max(args.slow, 1), 1))[:args.slow])
+    for i in range(args.clients):
+        sockets[i] = SimulatedSocket(args.slow_delay if i in slow else 0.0)
+        await manager.connect(sockets[i], f"client-{i}", f"episode:{i % args.rooms}")
+
+    room = "episode:0"
+    members = [i for i in range(args.clients) if i % args.rooms == 0]
+    regular = [i for i in members if i not in slow]
+    others = [i for i in range(args.clients) if i % args.rooms != 0]
+
+    sent_at = []
+    broadcast_times = []
+    for seq in range(args.messages):
+        message = {"type": "sync", "version": seq, "time": seq * 0.1, "playing": True, "sender": "client-1"}
+        started = time.perf_counter()
+        sent_at.append(started)
+        await manager.broadcast(message, room)
+        broadcast_times.append(time.perf_counter() - started)
+        await asyncio.sleep(args.interval)
+    # Let the writer tasks drain
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline and any(len(sockets[i].arrivals) < args.messages for i in regular):
+        await asyncio.sleep(0.01)
+
+    latencies = [
+        sockets[i].arrivals[seq] - sent_at[seq]
+        for i in regular
+        for seq in range(min(args.messages, len(sockets[i].arrivals)))
+    ]
+    stats = manager.stats()
+    print(f"clients {args.clients} in {args.rooms} rooms, {len(members)} in {room} ({len(members) - len(regular)} slow)")
+    print(
+        f"room fan-out   broadcast() p50 {percentile(broadcast_times, 0.5) * 1000:.3f} ms  "
+        f"p95 {percentile(broadcast_times, 0.95) * 1000:.3f} ms  per message"
+    )
+    print(
+        f"               delivery to regular clients p50 {percentile(latencies, 0.5) * 1000:.2f} ms  "
+        f"p95 {percentile(latencies, 0.95) * 1000:.2f} ms  max {max(latencies) * 1000:.2f} ms"
+    )
+    print(
+        f"               regular clients complete: {all(len(sockets[i].arrivals) == args.messages for i in regular)}  "
+        f"slow clients dropped {stats['dropped']}  other rooms received {sum(len(sockets[i].arrivals) for i in others)}"
+    )
+    print(f"               bytes sent {mb(sum(s.received for s in sockets.values()))}")
+    await manager.close()
+
+    # Previous broadcast: serialize per client and await every send in turn, to everyone
+    for socket in sockets.values():
+        socket.arrivals.clear()
+    sequential = []
+    for seq in range(min(args.messages, args.sequential_messages)):
+        message = {"type": "sync", "version": seq, "time": seq * 0.1, "playing": True, "sender": "client-1"}
+        started = time.perf_counter()
+        for socket in sockets.values():
+            await socket.send_json(message)
+        sequential.append(time.perf_counter() - started)
+    print(
+        f"sequential     broadcast p50 {percentile(sequential, 0.5) * 1000:.2f} ms  "
+        f"max {max(sequential) * 1000:.2f} ms per message ({len(sequential)} messages, all {args.clients} clients)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=200, help="broadcasts to the first room")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between broadcasts")
+    parser.add_argument("--slow", type=int, default=10, help="slow consumers among the clients")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds a slow consumer takes per message")
+    parser.add_argument("--queue-size", type=int, default=64, help="per-client send queue (WS_SEND_QUEUE_SIZE)")
+    parser.add_argument("--sequential-messages", type=int, default=5, help="messages sent the previous way")
+    args = parser.parse_args()
+
+    # Configure the app before it is imported
+    os.environ["REDIS_URL"] = ""
+    os.environ["WS_SEND_QUEUE_SIZE"] = str(args.queue_size)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Helpers shared by the benchmark scripts"""
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+import timeit
+from typing import Callable, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where /proc is missing)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RSSSampler:
+    """Track the peak RSS of this process from a background thread"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "RSSSampler":
+        self.baseline = self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self) -> int:
+        """Peak RSS above the RSS when sampling started"""
+        return self.peak - self.baseline
+
+
+def mb(size: float) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(samples: List[float]) -> str:
+    """Latency summary in milliseconds"""
+    return (
+        f"p50 {percentile(samples, 0.5) * 1000:.2f} ms  "
+        f"p95 {percentile(samples, 0.95) * 1000:.2f} ms  "
+        f"mean {statistics.fmean(samples) * 1000:.2f} ms"
+    )
+
+
+def best(fn: Callable[[], object], repeat: int) -> float:
+    """Fastest of repeat calls, in seconds"""
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+class Timer:
+    """Wall-clock duration of a with block"""
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
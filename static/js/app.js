@@ -3,6 +3,10 @@ const API_BASE = '/api';
 let currentVideoId = null;
 let currentEpisodeId = null;
 
+// WebSocket client ID, the server pushes MD5 progress to it
+const clientId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+let eventSocket = null;
+
 // DOM Elements
 const dropZone = document.getElementById('drop-zone');
 const fileInput = document.getElementById('file-input');
@@ -18,6 +22,7 @@ const videoPlayer = document.getElementById('video-player');
 document.addEventListener('DOMContentLoaded', () => {
     setupUploadHandlers();
     setupDanmakuControls();
+    connectEventSocket();
     playlistManager.init('playlist-container');
     
     // Listen for video change events
@@ -31,6 +36,11 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!video.md5) {
                 checkMD5Status();
             }
+            
+            // Warm the next episodes while this one plays
+            if (video.episodeId) {
+                prefetchUpcomingDanmaku();
+            }
         }
     });
 });
@@ -92,10 +102,19 @@ async function uploadMultipleFiles(files) {
     }
     
     showNotification(`成功上传 ${videoFiles.length} 个文件`, 'success');
+    
+    // Match the rest of the playlist in one request
+    matchPlaylistBatch();
 }
 
-// Upload single file
-async function uploadFile(file, autoPlay = true) {
+// Upload single file, resolves once the upload has finished
+function uploadFile(file, autoPlay = true) {
+    return new Promise((resolve) => {
+        sendUpload(file, autoPlay, resolve);
+    });
+}
+
+function sendUpload(file, autoPlay, done) {
     const formData = new FormData();
     formData.append('file', file);
     
@@ -123,15 +142,23 @@ async function uploadFile(file, autoPlay = true) {
                 alert('上传失败: ' + xhr.statusText);
             }
             uploadProgress.style.display = 'none';
+            done();
+        });
+        
+        xhr.addEventListener('error', () => {
+            alert('上传失败');
+            uploadProgress.style.display = 'none';
+            done();
         });
         
         // Send request
-        xhr.open('POST', `${API_BASE}/video/upload`);
+        xhr.open('POST', `${API_BASE}/video/upload?client_id=${clientId}`);
         xhr.send(formData);
         
     } catch (error) {
         alert('上传错误: ' + error.message);
         uploadProgress.style.display = 'none';
+        done();
     }
 }
 
@@ -150,29 +177,73 @@ async function handleUploadSuccess(data, autoPlay = true) {
         playlistManager.playVideo(videoIndex);
         currentVideoId = data.id;
         
-        // Start MD5 calculation check
-        checkMD5StatusForVideo(videoIndex, data.id);
+        // MD5 is computed while uploading, only poll if it is missing
+        if (data.md5) {
+            handleMD5Ready(videoIndex, data.id, data.md5);
+        } else {
+            checkMD5StatusForVideo(videoIndex, data.id);
+        }
     }
 }
 
-// Check MD5 calculation status
-async function checkMD5Status() {
-    const checkInterval = setInterval(async () => {
+// Server events (MD5 progress) over /ws/{clientId}, reconnecting when dropped
+function connectEventSocket() {
+    const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+    eventSocket = new WebSocket(`${protocol}://${location.host}/ws/${clientId}`);
+    
+    eventSocket.addEventListener('message', (e) => {
+        let message;
         try {
-            const response = await fetch(`${API_BASE}/video/md5/${currentVideoId}`);
-            const data = await response.json();
-            
-            if (data.ready && data.md5) {
-                document.getElementById('video-md5').textContent = data.md5;
-                clearInterval(checkInterval);
-                
-                // Auto match video
-                matchVideo(data.md5);
-            }
+            message = JSON.parse(e.data);
         } catch (error) {
-            console.error('MD5 check error:', error);
+            return;
         }
-    }, 1000);
+        if (message.type === 'md5_progress') {
+            showMD5Progress(message);
+        }
+    });
+    
+    eventSocket.addEventListener('close', () => {
+        setTimeout(connectEventSocket, 3000);
+    });
+}
+
+// Show MD5 progress of the upload or of the current video
+function showMD5Progress(message) {
+    if (message.done) {
+        return;
+    }
+    // Upload progress (no video ID yet) only while nothing else is shown
+    if (message.video_id ? message.video_id !== currentVideoId : currentVideoId) {
+        return;
+    }
+    document.getElementById('video-md5').textContent = `计算中... ${Math.round(message.progress)}%`;
+}
+
+// Fetch the MD5, the server calculates it if needed and pushes progress
+async function fetchMD5(videoId) {
+    try {
+        const response = await fetch(`${API_BASE}/video/md5/${videoId}?client_id=${clientId}`);
+        const data = await response.json();
+        if (data.ready && data.md5) {
+            return data.md5;
+        }
+        console.error('MD5 check error:', data.error || 'MD5 not available');
+    } catch (error) {
+        console.error('MD5 check error:', error);
+    }
+    return null;
+}
+
+// Check MD5 calculation status
+async function checkMD5Status() {
+    const md5Hash = await fetchMD5(currentVideoId);
+    if (md5Hash) {
+        document.getElementById('video-md5').textContent = md5Hash;
+        
+        // Auto match video
+        matchVideo(md5Hash);
+    }
 }
 
 // Match video
@@ -214,10 +285,13 @@ async function matchVideo(md5Hash) {
 // Load danmaku
 async function loadDanmaku(episodeId) {
     try {
-        const response = await fetch(`${API_BASE}/danmaku/${episodeId}?format=raw`);
-        const data = await response.json();
+        const response = await fetch(`${API_BASE}/danmaku/${episodeId}?format=binary`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const data = decodeBinaryDanmaku(await response.arrayBuffer());
         
-        if (data.success && data.count > 0) {
+        if (data.count > 0) {
             console.log(`加载了 ${data.count} 条弹幕`);
             // Here you would integrate with a danmaku library
             // For now, just log the result
@@ -228,6 +302,66 @@ async function loadDanmaku(episodeId) {
     }
 }
 
+// Decode the binary danmaku format (format=binary)
+// Layout: 16-byte header ("DDMK", version, flags, reserved, count, text size),
+// then float32 times, uint8 modes, uint24 colors, uint32 text offsets, UTF-8 texts.
+// Times and text offsets start 4-byte aligned; modes and colors are read as bytes
+const BINARY_DANMAKU_VERSION = 1;
+const LITTLE_ENDIAN = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+function decodeBinaryDanmaku(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'DDMK') {
+        throw new Error('Invalid danmaku data');
+    }
+    const version = view.getUint8(4);
+    if (version !== BINARY_DANMAKU_VERSION) {
+        throw new Error(`Unsupported danmaku version: ${version}`);
+    }
+    
+    const count = view.getUint32(8, true);
+    const textSize = view.getUint32(12, true);
+    const timesOffset = 16;
+    const modesOffset = timesOffset + 4 * count;
+    const colorsOffset = modesOffset + count;
+    const textOffsetsOffset = colorsOffset + 3 * count;
+    const textOffset = textOffsetsOffset + 4 * (count + 1);
+    
+    let times;
+    let textOffsets;
+    if (LITTLE_ENDIAN) {
+        // The 4-byte columns are 4-byte aligned, map them without copying
+        times = new Float32Array(buffer, timesOffset, count);
+        textOffsets = new Uint32Array(buffer, textOffsetsOffset, count + 1);
+    } else {
+        times = new Float32Array(count);
+        textOffsets = new Uint32Array(count + 1);
+        for (let i = 0; i < count; i++) {
+            times[i] = view.getFloat32(timesOffset + 4 * i, true);
+        }
+        for (let i = 0; i <= count; i++) {
+            textOffsets[i] = view.getUint32(textOffsetsOffset + 4 * i, true);
+        }
+    }
+    
+    const modes = new Uint8Array(buffer, modesOffset, count);
+    const colorBytes = new Uint8Array(buffer, colorsOffset, 3 * count);
+    const colors = new Uint32Array(count);
+    for (let i = 0, j = 0; i < count; i++, j += 3) {
+        colors[i] = colorBytes[j] | (colorBytes[j + 1] << 8) | (colorBytes[j + 2] << 16);
+    }
+    
+    const textBytes = new Uint8Array(buffer, textOffset, textSize);
+    const decoder = new TextDecoder('utf-8');
+    const texts = new Array(count);
+    for (let i = 0; i < count; i++) {
+        texts[i] = decoder.decode(textBytes.subarray(textOffsets[i], textOffsets[i + 1]));
+    }
+    
+    return { version, count, times, modes, colors, texts };
+}
+
 // Display danmaku info
 function displayDanmakuInfo(count) {
     const info = document.createElement('div');
@@ -299,10 +433,11 @@ async function loadExternalDanmaku(url) {
 // Parse XML danmaku
 async function parseXMLDanmaku(xmlContent) {
     try {
-        const response = await fetch(`${API_BASE}/danmaku/parse/xml?format=raw`, {
+        // Send the XML as a raw body so the server can parse it incrementally
+        const response = await fetch(`${API_BASE}/danmaku/parse/xml/stream?format=raw`, {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({xml_content: xmlContent})
+            headers: {'Content-Type': 'application/xml'},
+            body: xmlContent
         });
         const data = await response.json();
         
@@ -316,33 +451,28 @@ async function parseXMLDanmaku(xmlContent) {
 
 // Check MD5 for specific video
 async function checkMD5StatusForVideo(videoIndex, videoId) {
-    const checkInterval = setInterval(async () => {
-        try {
-            const response = await fetch(`${API_BASE}/video/md5/${videoId}`);
-            const data = await response.json();
-            
-            if (data.ready && data.md5) {
-                clearInterval(checkInterval);
-                
-                // Update video in playlist
-                playlistManager.updateVideo(videoIndex, {
-                    md5: data.md5,
-                    status: 'processing'
-                });
-                
-                // If this is the current video, update display
-                const currentVideo = playlistManager.getCurrentVideo();
-                if (currentVideo && currentVideo.id === videoId) {
-                    document.getElementById('video-md5').textContent = data.md5;
-                }
-                
-                // Auto match video
-                matchVideoInPlaylist(videoIndex, data.md5);
-            }
-        } catch (error) {
-            console.error('MD5 check error:', error);
-        }
-    }, 1000);
+    const md5Hash = await fetchMD5(videoId);
+    if (md5Hash) {
+        handleMD5Ready(videoIndex, videoId, md5Hash);
+    }
+}
+
+// Handle a video whose MD5 is known
+function handleMD5Ready(videoIndex, videoId, md5Hash) {
+    // Update video in playlist
+    playlistManager.updateVideo(videoIndex, {
+        md5: md5Hash,
+        status: 'processing'
+    });
+    
+    // If this is the current video, update display
+    const currentVideo = playlistManager.getCurrentVideo();
+    if (currentVideo && currentVideo.id === videoId) {
+        document.getElementById('video-md5').textContent = md5Hash;
+    }
+    
+    // Auto match video
+    matchVideoInPlaylist(videoIndex, md5Hash);
 }
 
 // Match video in playlist
@@ -362,40 +492,126 @@ async function matchVideoInPlaylist(videoIndex, md5Hash) {
         });
         
         const data = await response.json();
-        
-        if (data.is_matched && data.matches.length > 0) {
-            const match = data.matches[0];
-            
-            // Update video in playlist
-            playlistManager.updateVideo(videoIndex, {
-                match: match,
-                episodeId: match.episode_id,
-                status: 'matched'
-            });
-            
-            // If this is the current video, update display and load danmaku
-            const currentVideo = playlistManager.getCurrentVideo();
-            if (currentVideo && currentVideo.id === video.id) {
-                document.getElementById('match-result').textContent = 
-                    `${match.anime_title} - ${match.episode_title}`;
-                currentEpisodeId = match.episode_id;
-                loadDanmaku(match.episode_id);
-            }
-        } else {
-            playlistManager.updateVideo(videoIndex, {
-                status: 'failed'
+        applyMatchResult(videoIndex, data);
+    } catch (error) {
+        playlistManager.updateVideo(videoIndex, {
+            status: 'failed'
+        });
+        console.error('Match error:', error);
+    }
+}
+
+// Match every uploaded video that has an MD5 but no match yet, in one request
+async function matchPlaylistBatch() {
+    const indices = [];
+    const requests = [];
+    playlistManager.videos.forEach((video, index) => {
+        if (video.md5 && video.status === 'uploaded') {
+            indices.push(index);
+            requests.push({
+                file_name: video.name,
+                file_hash: video.md5,
+                file_size: video.size
             });
-            
-            const currentVideo = playlistManager.getCurrentVideo();
-            if (currentVideo && currentVideo.id === video.id) {
-                document.getElementById('match-result').textContent = '未匹配到视频';
-            }
+            playlistManager.updateVideo(index, { status: 'processing' });
+        }
+    });
+    
+    if (requests.length === 0) return;
+    
+    const pending = new Set(indices);
+    try {
+        const response = await fetch(`${API_BASE}/match/batch`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ requests })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
         }
+        
+        // Results arrive as NDJSON lines, in completion order
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        const applyLine = (line) => {
+            if (!line.trim()) return;
+            const item = JSON.parse(line);
+            const videoIndex = indices[item.index];
+            pending.delete(videoIndex);
+            applyMatchResult(videoIndex, item);
+        };
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            lines.forEach(applyLine);
+        }
+        applyLine(buffered + decoder.decode());
     } catch (error) {
+        console.error('Batch match error:', error);
+    }
+    
+    // Anything the batch did not resolve has failed
+    pending.forEach((videoIndex) => {
+        playlistManager.updateVideo(videoIndex, { status: 'failed' });
+    });
+}
+
+// Apply a match response to a playlist video
+function applyMatchResult(videoIndex, data) {
+    const video = playlistManager.videos[videoIndex];
+    if (!video) return;
+    
+    if (data.is_matched && data.matches.length > 0) {
+        const match = data.matches[0];
+        
+        // Update video in playlist
+        playlistManager.updateVideo(videoIndex, {
+            match: match,
+            episodeId: match.episode_id,
+            status: 'matched'
+        });
+        
+        // If this is the current video, update display and load danmaku
+        const currentVideo = playlistManager.getCurrentVideo();
+        if (currentVideo && currentVideo.id === video.id) {
+            document.getElementById('match-result').textContent = 
+                `${match.anime_title} - ${match.episode_title}`;
+            currentEpisodeId = match.episode_id;
+            loadDanmaku(match.episode_id);
+            prefetchUpcomingDanmaku();
+        }
+    } else {
         playlistManager.updateVideo(videoIndex, {
             status: 'failed'
         });
-        console.error('Match error:', error);
+        
+        const currentVideo = playlistManager.getCurrentVideo();
+        if (currentVideo && currentVideo.id === video.id) {
+            document.getElementById('match-result').textContent = data.success
+                ? '未匹配到视频'
+                : '匹配失败: ' + (data.error_message || '未知错误');
+        }
+    }
+}
+
+// Ask the server to prefetch danmaku for the next playlist episodes
+async function prefetchUpcomingDanmaku() {
+    try {
+        await fetch(`${API_BASE}/danmaku/prefetch`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                ...playlistManager.getPrefetchPlaylist(),
+                format: 'binary'
+            })
+        });
+    } catch (error) {
+        console.error('Prefetch error:', error);
     }
 }
 
@@ -20,7 +20,7 @@ class PlaylistManager {
             name: videoInfo.name,
             size: videoInfo.size,
             url: videoInfo.url,
-            md5: null,
+            md5: videoInfo.md5 || null,
             match: null,
             episodeId: null,
             danmakuCount: 0,
@@ -100,6 +100,19 @@ class PlaylistManager {
         return this.videos[this.currentIndex] || null;
     }
 
+    // Playlist order for the server-side danmaku prefetcher
+    getPrefetchPlaylist() {
+        return {
+            current_index: this.currentIndex,
+            playlist: this.videos.map(v => ({
+                episode_id: v.episodeId,
+                file_name: v.name,
+                file_hash: v.md5,
+                file_size: v.size
+            }))
+        };
+    }
+
     // Update video info display
     updateVideoInfo(video) {
         // Update video name
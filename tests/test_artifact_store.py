@@ -0,0 +1,89 @@
+"""Tests for the on-disk danmaku artifact store"""
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.artifact_store import TMP_MAX_AGE, ArtifactStore, accepted_encodings
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch) -> ArtifactStore:
+    monkeypatch.setattr(settings, "comment_cache_ttl", 86400)
+    return ArtifactStore(str(tmp_path))
+
+
+def entries(store: ArtifactStore, key: str):
+    return sorted(os.listdir(store._dir(key)))
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, br;q=0.5, zstd;q=0") == ["gzip", "br"]
+    assert accepted_encodings("GZIP;q=bad, *") == ["*"]
+    assert accepted_encodings(None) == []
+
+
+async def test_put_then_read_every_encoding(store):
+    artifact = await store.put("k1", b'{"count":0}', revision=3)
+
+    assert (await store.get("k1", 3)).etag == artifact.etag
+    assert await store.get("k1", 4) is None
+    assert "gzip" in artifact.encodings
+    assert gzip.decompress(await store.read(artifact, "gzip")) == b'{"count":0}'
+    assert await store.read(artifact, None) == b'{"count":0}'
+    # Loaded from disk by another store
+    assert (await ArtifactStore(store.root).get("k1", 3)).version == artifact.version
+
+
+async def test_replacing_keeps_a_complete_artifact_in_place(store):
+    old = await store.put("k2", b"old", revision=1)
+    new = await store.put("k2", b"new", revision=2)
+
+    assert entries(store, "k2") == sorted(["meta.json", new.version])
+    assert await store.read(new, None) == b"new"
+    # A reader still holding the previous metadata misses
+    with pytest.raises(FileNotFoundError):
+        await store.read(old, "gzip")
+    assert (await ArtifactStore(store.root).get("k2", 2)).etag == new.etag
+
+
+async def test_expired_artifacts_are_removed(store, monkeypatch):
+    await store.put("k3", b"body")
+    monkeypatch.setattr(settings, "comment_cache_ttl", 0)
+
+    assert await store.get("k3") is None
+    assert not os.path.exists(store._dir("k3"))
+
+
+def age(path: str, seconds: float):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+async def test_collect_garbage(store):
+    current = await store.put("live", b"body")
+    await store.put("expired", b"body")
+    # An abandoned version next to a current artifact, and a write in progress
+    leftover = os.path.join(store._dir("live"), "1.1")
+    os.makedirs(leftover)
+    age(leftover, TMP_MAX_AGE + 1)
+    os.makedirs(os.path.join(store._dir("writing"), "2.2"))
+    os.makedirs(os.path.join(store._dir("interrupted"), "3.3"))
+    age(store._dir("interrupted"), TMP_MAX_AGE + 1)
+
+    meta = os.path.join(store._dir("expired"), "meta.json")
+    with open(meta, "r") as f:
+        data = json.load(f)
+    data["created"] -= 2 * 86400
+    with open(meta, "w") as f:
+        json.dump(data, f)
+
+    assert await store.collect_garbage() == 3
+    assert entries(store, "live") == sorted(["meta.json", current.version])
+    assert os.path.isdir(store._dir("writing"))
+    assert not os.path.exists(store._dir("interrupted"))
+    assert not os.path.exists(store._dir("expired"))
+    assert store.collected == 3
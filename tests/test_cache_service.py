@@ -0,0 +1,93 @@
+"""Tests for the TTL/LRU cache"""
+from app.services.cache_service import TTLCache
+
+
+def test_get_returns_stored_value(clock):
+    cache = TTLCache(max_bytes=100)
+    cache.set("a", {"count": 1}, size=10, ttl=60)
+
+    assert cache.get("a") == {"count": 1}
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(max_bytes=100)
+    cache.set("a", 1, size=10, ttl=60)
+
+    clock.advance(59)
+    assert cache.get("a") == 1
+    clock.advance(1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.total_bytes == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_stale_values_outlive_ttl_for_get_stale(clock):
+    cache = TTLCache(max_bytes=100, stale_ttl=30)
+    cache.set("a", 1, size=10, ttl=60)
+
+    clock.advance(70)
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == 1
+    assert cache.stats()["stale_hits"] == 1
+
+    clock.advance(30)
+    assert cache.get_stale("a") is None
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_used_beyond_max_bytes(clock):
+    cache = TTLCache(max_bytes=30)
+    cache.set("a", 1, size=10, ttl=60)
+    cache.set("b", 2, size=10, ttl=60)
+    cache.set("c", 3, size=10, ttl=60)
+    # Touch "a" so "b" is the least recently used
+    cache.get("a")
+
+    cache.set("d", 4, size=10, ttl=60)
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == [1, 3, 4]
+    assert cache.total_bytes == 30
+    assert cache.stats()["evictions"] == 1
+
+
+def test_replacing_a_key_updates_its_size(clock):
+    cache = TTLCache(max_bytes=100)
+    cache.set("a", 1, size=40, ttl=60)
+    cache.set("a", 2, size=10, ttl=60)
+
+    assert cache.get("a") == 2
+    assert cache.total_bytes == 10
+    assert len(cache) == 1
+
+
+def test_oversized_values_and_zero_ttl_are_not_stored(clock):
+    cache = TTLCache(max_bytes=100)
+    cache.set("a", 1, size=10, ttl=60)
+
+    cache.set("big", 2, size=101, ttl=60)
+    cache.set("a", 3, size=10, ttl=0)
+
+    assert cache.get("big") is None
+    assert cache.get("a") is None
+    assert cache.total_bytes == 0
+
+
+def test_delete_and_clear(clock):
+    cache = TTLCache(max_bytes=100)
+    cache.set("a", 1, size=10, ttl=60)
+    cache.set("b", 2, size=20, ttl=60)
+
+    cache.delete("a")
+    cache.delete("missing")
+    assert cache.get("a") is None
+    assert cache.total_bytes == 20
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.total_bytes == 0
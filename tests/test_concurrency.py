@@ -0,0 +1,179 @@
+"""Tests for the token bucket and the upstream call governor"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.concurrency import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    TokenBucket,
+    UpstreamGovernor
+)
+
+
+# TokenBucket (synchronous, against the frozen clock)
+
+def test_bucket_allows_burst_then_refills(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(0.5)
+
+    clock.advance(0.5)
+    assert bucket.take()
+    assert not bucket.take()
+
+    clock.advance(10)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_without_rate_never_limits(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+
+    assert all(bucket.take() for _ in range(100))
+    assert bucket.delay() == 0.0
+
+
+def test_bucket_pause_withholds_tokens(clock):
+    bucket = TokenBucket(rate=1, burst=5)
+
+    bucket.pause(3)
+
+    assert not bucket.take()
+    assert bucket.delay() == pytest.approx(4)
+    clock.advance(3.9)
+    assert not bucket.take()
+    clock.advance(0.1)
+    assert bucket.take()
+
+
+# UpstreamGovernor (asyncio uses time.monotonic, so these run in real time)
+
+async def hold(governor, priority, started, release, name):
+    async with governor.slot(priority):
+        started.append(name)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def finish(*tasks):
+    """Wait for the tasks, failing instead of hanging on a leaked slot"""
+    return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=1)
+
+
+async def test_caps_calls_in_flight():
+    governor = UpstreamGovernor(rate=0, burst=1, max_in_flight=2)
+    started, release = [], asyncio.Event()
+
+    tasks = [asyncio.ensure_future(hold(governor, PRIORITY_NORMAL, started, release, i)) for i in range(3)]
+    await settle()
+
+    assert started == [0, 1]
+    assert governor.in_flight == 2
+    assert governor.stats()["classes"]["normal"]["queued"] == 1
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert started == [0, 1, 2]
+    assert governor.in_flight == 0
+
+
+async def test_serves_waiters_by_priority_then_arrival():
+    governor = UpstreamGovernor(rate=0, burst=1, max_in_flight=1)
+    order = []
+    gate = asyncio.Event()
+
+    async def call(priority, name):
+        async with governor.slot(priority):
+            order.append(name)
+            if name == "first":
+                await gate.wait()
+
+    first = asyncio.ensure_future(call(PRIORITY_NORMAL, "first"))
+    await settle()
+    queued = [
+        asyncio.ensure_future(call(priority, name))
+        for priority, name in (
+            (PRIORITY_BACKGROUND, "prefetch"),
+            (PRIORITY_NORMAL, "search"),
+            (PRIORITY_INTERACTIVE, "match-1"),
+            (PRIORITY_INTERACTIVE, "match-2")
+        )
+    ]
+    await settle()
+
+    gate.set()
+    await asyncio.gather(first, *queued)
+    assert order == ["first", "match-1", "match-2", "search", "prefetch"]
+
+    stats = governor.stats()["classes"]
+    assert stats["interactive"]["granted"] == 2
+    assert stats["background"]["granted"] == 1
+    assert stats["background"]["wait_max"] >= stats["interactive"]["wait_max"]
+
+
+async def test_rate_limit_spaces_calls():
+    governor = UpstreamGovernor(rate=50, burst=1, max_in_flight=0)
+    granted = []
+
+    async def call():
+        async with governor.slot():
+            granted.append(time.monotonic())
+
+    await asyncio.gather(*(call() for _ in range(4)))
+
+    # One token up front, then one every 20 ms
+    assert granted[-1] - granted[0] >= 0.05
+    assert governor.in_flight == 0
+
+
+async def test_cancelled_waiter_does_not_take_a_slot():
+    governor = UpstreamGovernor(rate=0, burst=1, max_in_flight=1)
+    started, release = [], asyncio.Event()
+
+    holder = asyncio.ensure_future(hold(governor, PRIORITY_NORMAL, started, release, "holder"))
+    await settle()
+    waiter = asyncio.ensure_future(hold(governor, PRIORITY_NORMAL, started, release, "cancelled"))
+    last = asyncio.ensure_future(hold(governor, PRIORITY_NORMAL, started, release, "last"))
+    await settle()
+
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    release.set()
+    await finish(holder, last)
+
+    assert started == ["holder", "last"]
+    assert governor.in_flight == 0
+
+
+async def test_slot_granted_to_a_cancelled_caller_is_handed_on():
+    governor = UpstreamGovernor(rate=0, burst=1, max_in_flight=1)
+    started, release = [], asyncio.Event()
+    holder_release = asyncio.Event()
+
+    async def holder():
+        async with governor.slot():
+            started.append("holder")
+            await holder_release.wait()
+        # The release just granted the waiter's slot, cancel it before it runs
+        waiter.cancel()
+
+    holding = asyncio.ensure_future(holder())
+    await settle()
+    waiter = asyncio.ensure_future(hold(governor, PRIORITY_NORMAL, started, release, "cancelled"))
+    last = asyncio.ensure_future(hold(governor, PRIORITY_NORMAL, started, release, "last"))
+    await settle()
+
+    holder_release.set()
+    release.set()
+    await finish(holding, waiter, last)
+
+    assert waiter.cancelled()
+    assert started == ["holder", "last"]
+    assert governor.in_flight == 0
@@ -0,0 +1,108 @@
+"""Tests for GET /api/danmaku/{episode_id} served from stored artifacts"""
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api import danmaku
+from app.config import settings
+from app.services.artifact_store import ArtifactStore
+from app.services.danmaku_filter import DanmakuFilter
+from app.services.live_danmaku_log import LiveDanmakuLog
+from app.services.proxy_service import DanDanAPIProxy
+
+COMMENTS = [
+    {"cid": 1, "p": "1.00,1,16777215,a", "m": "first"},
+    {"cid": 2, "p": "3.00,1,16777215,b", "m": "third"}
+]
+
+
+@pytest.fixture
+async def client(tmp_path, monkeypatch):
+    def upstream(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"success": True, "count": len(COMMENTS), "comments": COMMENTS})
+
+    monkeypatch.setattr(settings, "dandan_proxy_url", None)
+    monkeypatch.setattr(settings, "comment_cache_enabled", True)
+    monkeypatch.setattr(settings, "danmaku_artifacts_enabled", True)
+    monkeypatch.setattr(settings, "live_danmaku_log_enabled", True)
+    monkeypatch.setattr(settings, "live_danmaku_compact_records", 1000)
+    monkeypatch.setattr(danmaku, "proxy", DanDanAPIProxy(httpx.AsyncClient(transport=httpx.MockTransport(upstream))))
+    monkeypatch.setattr(danmaku, "artifact_store", ArtifactStore(str(tmp_path / "artifacts")))
+    monkeypatch.setattr(danmaku, "live_danmaku_log", LiveDanmakuLog(str(tmp_path / "live")))
+
+    app = FastAPI()
+    app.include_router(danmaku.router, prefix="/api/danmaku")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def texts(response):
+    return [c["m"] for c in response.json()["comments"]]
+
+
+async def test_live_tail_is_served_without_an_artifact(client, monkeypatch):
+    await danmaku.live_danmaku_log.append(1, [{"time": 2.0, "content": "live", "sender": "c"}])
+
+    for _ in range(2):
+        response = await client.get("/api/danmaku/1")
+        assert texts(response) == ["first", "live", "third"]
+        assert "etag" not in response.headers
+
+    # Once compacted, the live comments are part of the stored artifact
+    monkeypatch.setattr(settings, "live_danmaku_compact_records", 1)
+    await danmaku.live_danmaku_log.append(1, [{"time": 4.0, "content": "later", "sender": "c"}])
+    first = await client.get("/api/danmaku/1")
+    again = await client.get("/api/danmaku/1")
+
+    assert texts(first) == ["first", "live", "third", "later"]
+    assert first.headers["etag"] == again.headers["etag"]
+    assert texts(again) == texts(first)
+
+
+async def test_etag_answers_304(client):
+    first = await client.get("/api/danmaku/2")
+    etag = first.headers["etag"]
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = await client.get("/api/danmaku/2", headers={"If-None-Match": header})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    response = await client.get("/api/danmaku/2", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip", "gzip"),
+    ("gzip;q=0.5, identity", "gzip"),
+    ("*", "gzip"),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("unknown", None)
+])
+async def test_negotiates_the_stored_encoding(client, accept_encoding, encoding):
+    # The first request stores the artifact, the second reads it back
+    for _ in range(2):
+        response = await client.get("/api/danmaku/3", headers={"Accept-Encoding": accept_encoding})
+
+        assert response.headers.get("content-encoding") == encoding
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert texts(response) == ["first", "third"]
+
+
+async def test_artifact_replaced_by_another_worker_is_served(client, tmp_path):
+    first = await client.get("/api/danmaku/4")
+    key = danmaku.artifact_store.episode_key(4, "raw", True, None, vars(DanmakuFilter()))
+    replaced = {"count": 1, "comments": [{"cid": 9, "p": "1.00,1,16777215,a", "m": "replaced"}]}
+
+    # This worker still has the previous version's metadata cached
+    other_worker = ArtifactStore(str(tmp_path / "artifacts"))
+    await other_worker.put(key, json.dumps(replaced).encode())
+    response = await client.get("/api/danmaku/4")
+
+    assert response.status_code == 200
+    assert texts(response) == ["replaced"]
+    assert response.headers["etag"] != first.headers["etag"]
@@ -0,0 +1,98 @@
+"""Tests for server-side danmaku filtering"""
+from app.services.danmaku_filter import DanmakuFilter, normalize_text
+
+
+def comment(time, text, mode=1):
+    return {"cid": int(time * 100), "p": f"{time:.2f},{mode},16777215,1", "m": text}
+
+
+def texts(comments):
+    return [c["m"] for c in comments]
+
+
+def test_normalize_text_collapses_near_duplicates():
+    assert normalize_text("哈哈哈哈") == normalize_text("哈哈")
+    assert normalize_text("2333333") == normalize_text("233")
+    assert normalize_text("AWSL!!!") == normalize_text("awsl")
+    assert normalize_text("前方 高能") == normalize_text("前方高能")
+    # Nothing left after normalizing, compare the original text
+    assert normalize_text("!!!") == "!!!"
+
+
+def test_inactive_filter_keeps_everything():
+    comments = [comment(1, "a"), comment(2, "a")]
+    danmaku_filter = DanmakuFilter()
+
+    assert not danmaku_filter.active
+    kept = danmaku_filter.apply(comments)
+    assert kept == comments
+    assert kept is not comments
+
+
+def test_blocks_modes():
+    comments = [comment(1, "scroll", 1), comment(2, "bottom", 4), comment(3, "top", 5), comment(4, "other", 6)]
+
+    assert texts(DanmakuFilter(block_top=True).apply(comments)) == ["scroll", "bottom", "other"]
+    assert texts(DanmakuFilter(block_bottom=True).apply(comments)) == ["scroll", "top", "other"]
+    # Unknown modes scroll
+    assert texts(DanmakuFilter(block_scroll=True).apply(comments)) == ["bottom", "top"]
+
+
+def test_dedup_window_drops_repeats_within_window():
+    comments = [
+        comment(0.0, "哈哈哈"),
+        comment(1.0, "哈哈"),
+        comment(2.0, "other"),
+        comment(4.9, "哈哈哈哈"),
+        comment(5.0, "哈哈哈"),
+        comment(6.0, "哈哈")
+    ]
+
+    kept = DanmakuFilter(dedup_window=5).apply(comments)
+
+    # The window runs from the last kept occurrence
+    assert [c["p"].split(",")[0] for c in kept] == ["0.00", "2.00", "5.00"]
+
+
+def test_max_per_second_caps_each_second():
+    comments = [comment(10 + i / 10, f"t{i}") for i in range(15)] + [comment(12.5, "late")]
+
+    kept = DanmakuFilter(max_per_second=3).apply(comments)
+
+    assert texts(kept) == ["t0", "t1", "t2", "t10", "t11", "t12", "late"]
+
+
+def test_dropped_duplicates_do_not_use_up_the_cap():
+    comments = [comment(1.0, "same"), comment(1.1, "same"), comment(1.2, "same"), comment(1.3, "new")]
+
+    kept = DanmakuFilter(dedup_window=5, max_per_second=2).apply(comments)
+
+    assert texts(kept) == ["same", "new"]
+
+
+def test_stages_combine():
+    comments = [
+        comment(1.0, "a", 5),
+        comment(1.1, "b"),
+        comment(1.2, "b"),
+        comment(1.3, "c"),
+        comment(1.4, "d")
+    ]
+
+    kept = DanmakuFilter(block_top=True, dedup_window=5, max_per_second=2).apply(comments)
+
+    assert texts(kept) == ["b", "c"]
+
+
+def test_uses_given_times():
+    comments = [comment(0, "a"), comment(0, "b"), comment(0, "c")]
+
+    kept = DanmakuFilter(max_per_second=1).apply(comments, times=[1.0, 1.5, 2.0])
+
+    assert texts(kept) == ["a", "c"]
+
+
+def test_skips_malformed_comments():
+    comments = [{"m": "no params"}, {"p": "abc,1", "m": "bad time"}, comment(1, "ok")]
+
+    assert texts(DanmakuFilter(max_per_second=5).apply(comments)) == ["ok"]
@@ -0,0 +1,163 @@
+"""Tests for the columnar danmaku conversion"""
+import random
+import struct
+
+import pytest
+
+from app.services.danmaku_service import BINARY_MAGIC, BINARY_VERSION, DanmakuColumns, DanmakuConverter
+
+PER_COMMENT = {
+    "nplayer": DanmakuConverter.dandan_to_nplayer,
+    "artplayer": DanmakuConverter.dandan_to_artplayer,
+    "ccl": DanmakuConverter.dandan_to_ccl
+}
+
+
+def convert_each(comments, target_format):
+    """Reference output: the per-comment converter, skipping invalid comments"""
+    converted = []
+    for comment in comments:
+        try:
+            converted.append(PER_COMMENT[target_format](comment))
+        except ValueError:
+            continue
+    return converted
+
+
+def well_formed(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "cid": i,
+            "p": f"{rng.random() * 1400:.2f},{rng.choice('1145')},{rng.choice([16777215, 255, 65280])},{rng.randrange(10**6)}",
+            "m": f"comment {rng.randrange(100)}"
+        }
+        for i in range(count)
+    ]
+
+
+MALFORMED = [
+    {"p": "1.0,1"},                      # no text
+    {"m": "no params"},
+    {"p": "abc,1,2", "m": "bad time"},
+    {"p": "1.5,x,2", "m": "unknown mode"},
+    {"p": "1.5,1, 2 ,5", "m": "padded color"},
+    {"p": "1.5,1,-2", "m": "negative color"},
+    {"p": "2.5,4,255", "m": "three fields"},
+    {"p": "3", "m": "one field"},
+    {"p": "4,1,1.5", "m": "float color"},
+]
+
+
+@pytest.mark.parametrize("target_format", sorted(PER_COMMENT))
+def test_convert_batch_matches_per_comment_converters(target_format):
+    comments = well_formed(500)
+
+    assert DanmakuConverter.convert_batch(comments, target_format) == convert_each(comments, target_format)
+
+
+@pytest.mark.parametrize("target_format", sorted(PER_COMMENT))
+def test_convert_batch_matches_per_comment_converters_on_malformed_input(target_format):
+    comments = well_formed(50) + MALFORMED + well_formed(50, seed=1)
+    random.Random(2).shuffle(comments)
+
+    assert DanmakuConverter.convert_batch(comments, target_format) == convert_each(comments, target_format)
+
+
+def test_convert_batch_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        DanmakuConverter.convert_batch(well_formed(1), "ass")
+
+
+def test_from_comments_parses_columns():
+    columns = DanmakuColumns.from_comments([
+        {"cid": 1, "p": "1.50,1,16777215,7", "m": "a"},
+        {"cid": 2, "p": "2.25,5,255,8", "m": "b"}
+    ])
+
+    assert len(columns) == 2
+    assert columns.times == [1.5, 2.25]
+    assert columns.modes == ["1", "5"]
+    assert columns.colors == [16777215, 255]
+    assert columns.texts == ["a", "b"]
+
+
+def test_fast_path_and_fallback_agree():
+    comments = well_formed(200)
+    # A comment with fewer fields makes the uniform split fail
+    irregular = comments + [{"p": "9.0,1,255", "m": "short"}]
+
+    fast = DanmakuColumns.from_comments(comments)
+    slow = DanmakuColumns.from_comments(irregular)
+
+    assert slow.times[:-1] == fast.times
+    assert slow.modes[:-1] == fast.modes
+    assert slow.colors[:-1] == fast.colors
+    assert slow.texts[:-1] == fast.texts
+    assert (slow.times[-1], slow.modes[-1], slow.colors[-1], slow.texts[-1]) == (9.0, "1", 255, "short")
+
+
+def test_from_comments_drops_invalid_comments():
+    columns = DanmakuColumns.from_comments(MALFORMED)
+
+    assert columns.texts == ["unknown mode", "padded color", "negative color", "three fields"]
+
+
+def test_empty_input():
+    assert len(DanmakuColumns.from_comments([])) == 0
+    assert DanmakuConverter.convert_batch([], "nplayer") == []
+
+
+def test_mapped_modes_and_hex_colors():
+    columns = DanmakuColumns.from_comments([
+        {"p": "1,1,16777215", "m": "a"},
+        {"p": "2,4,255", "m": "b"},
+        {"p": "3,7,255", "m": "c"}
+    ])
+
+    assert columns.mapped_modes({"1": "scroll", "4": "bottom"}, "scroll") == ["scroll", "bottom", "scroll"]
+    assert columns.hex_colors() == ["#ffffff", "#0000ff", "#0000ff"]
+
+
+def decode_binary(data):
+    """Reference decoder following the documented binary layout"""
+    magic, version, flags, _, count, text_size = struct.unpack_from("<4sBBHII", data, 0)
+    times_at = 16
+    modes_at = times_at + 4 * count
+    colors_at = modes_at + count
+    offsets_at = colors_at + 3 * count
+    texts_at = offsets_at + 4 * (count + 1)
+    assert (magic, version, flags) == (BINARY_MAGIC, BINARY_VERSION, 0)
+    assert len(data) == texts_at + text_size
+    # The 4-byte columns can be mapped as typed arrays
+    assert times_at % 4 == 0 and offsets_at % 4 == 0
+
+    times = struct.unpack_from(f"<{count}f", data, times_at)
+    modes = list(data[modes_at:colors_at])
+    colors = [int.from_bytes(data[colors_at + 3 * i:colors_at + 3 * i + 3], "little") for i in range(count)]
+    offsets = struct.unpack_from(f"<{count + 1}I", data, offsets_at)
+    texts = [data[texts_at + offsets[i]:texts_at + offsets[i + 1]].decode("utf-8") for i in range(count)]
+    return list(times), modes, colors, texts
+
+
+@pytest.mark.parametrize("count", [0, 1, 3, 257])
+def test_binary_round_trips_through_the_documented_layout(count):
+    comments = well_formed(count, seed=count)
+    comments[:1] = [{"p": "12.5,5,16711935,1", "m": "前方高能 ✨"}][:count]
+    columns = DanmakuColumns.from_comments(comments)
+
+    times, modes, colors, texts = decode_binary(DanmakuConverter.to_binary(comments))
+
+    assert times == pytest.approx(columns.times, abs=1e-3)
+    assert modes == [int(mode) for mode in columns.modes]
+    assert colors == columns.colors
+    assert texts == columns.texts
+
+
+def test_binary_maps_unusable_modes_and_colors():
+    comments = [{"p": "1,x,2", "m": "a"}, {"p": "2,300,33554431", "m": "b"}]
+
+    _, modes, colors, _ = decode_binary(DanmakuConverter.to_binary(comments))
+
+    assert modes == [1, 1]
+    assert colors == [2, 0xFFFFFF]
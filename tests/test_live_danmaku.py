@@ -0,0 +1,59 @@
+"""Tests for live danmaku ingestion"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import websocket
+from app.config import settings
+from app.services.live_danmaku import REJECT_INVALID, LiveDanmakuBatcher
+
+
+async def ignore(room, comments):
+    pass
+
+
+@pytest.fixture
+async def batcher(monkeypatch):
+    monkeypatch.setattr(settings, "live_danmaku_rate", 0)
+    batcher = LiveDanmakuBatcher(ignore)
+    yield batcher
+    await batcher.close()
+
+
+@pytest.mark.parametrize("field, value", [
+    ("mode", float("inf")),
+    ("mode", 1e400),
+    ("color", float("-inf")),
+    ("color", float("nan")),
+    ("time", float("inf")),
+    ("mode", "top"),
+    ("color", [1])
+])
+async def test_rejects_unusable_numbers(batcher, field, value):
+    reason = batcher.submit("episode:1", "client", {"content": "x", field: value})
+
+    assert reason == REJECT_INVALID
+    assert batcher.rejected[REJECT_INVALID] == 1
+    assert batcher.accepted == 0
+
+
+async def test_accepts_and_normalizes_a_comment(batcher):
+    assert batcher.submit("episode:1", "client", {"content": " hi ", "time": "1.5", "mode": 5.0, "color": -1}) is None
+
+    assert batcher._pending["episode:1"] == [
+        {"content": "hi", "sender": "client", "time": 1.5, "mode": 5, "color": 0xFFFFFF}
+    ]
+
+
+def test_overflowing_mode_is_rejected_over_the_websocket():
+    app = FastAPI()
+    app.include_router(websocket.router, prefix="/ws")
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/overflow-client?room=episode:1") as ws:
+            ws.send_text('{"type": "danmaku", "content": "x", "mode": Infinity}')
+            assert ws.receive_json() == {"type": "danmaku_rejected", "reason": REJECT_INVALID}
+
+            # The connection is still served
+            ws.send_text('{"type": "ping", "client_time": 1}')
+            assert ws.receive_json()["type"] == "pong"
@@ -0,0 +1,182 @@
+"""Tests for the live danmaku log and timeline merging"""
+import asyncio
+import os
+
+import pytest
+
+from app.config import settings
+from app.services.live_danmaku_log import LiveDanmakuLog, live_episode_id, merge_timelines
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch) -> LiveDanmakuLog:
+    monkeypatch.setattr(settings, "live_danmaku_log_enabled", True)
+    monkeypatch.setattr(settings, "live_danmaku_compact_records", 1000)
+    return LiveDanmakuLog(str(tmp_path))
+
+
+def live(time, content, **extra):
+    return {"time": time, "content": content, "sender": "user", **extra}
+
+
+def served(timeline):
+    times, comments = merge_timelines(*timeline.sources())
+    return times, [c["m"] for c in comments]
+
+
+def test_merge_timelines_interleaves_by_time():
+    upstream = ([1.0, 3.0, 5.0], ["u1", "u3", "u5"])
+    tail = ([2.0, 3.0, 6.0], ["l2", "l3", "l6"])
+
+    times, comments = merge_timelines(upstream, tail)
+
+    assert times == [1.0, 2.0, 3.0, 3.0, 5.0, 6.0]
+    # Equal times keep the order of the sources
+    assert comments == ["u1", "l2", "u3", "l3", "u5", "l6"]
+
+
+def test_merge_timelines_returns_a_lone_source_as_is():
+    upstream = ([1.0, 2.0], ["a", "b"])
+
+    assert merge_timelines(upstream, ([], [])) is upstream
+    assert merge_timelines(([], []), ([], [])) == ([], [])
+
+
+async def test_append_serves_sorted_comments_with_negative_cids(log):
+    stored = await log.append(1, [live(5.0, "late"), live(1.0, "early", mode=5, color=0xFF0000)])
+
+    timeline = await log.timeline(1)
+    assert stored == 2
+    assert served(timeline) == ([1.0, 5.0], ["early", "late"])
+    early = timeline.tail_comments[0]
+    assert early["cid"] == -2
+    assert early["p"] == "1.00,5,16711680,user"
+    assert timeline.tail_comments[1]["cid"] == -1
+
+
+async def test_skips_comments_without_a_usable_time(log):
+    comments = [live(float("nan"), "nan"), live("abc", "text"), {"content": "no time"}, live(-3, "clamped")]
+
+    assert await log.append(1, comments) == 1
+    assert served(await log.timeline(1)) == ([0.0], ["clamped"])
+
+
+async def test_reloads_from_disk(log, tmp_path):
+    await log.append(7, [live(2.0, "b"), live(1.0, "a")])
+    await log.append(7, [live(1.5, "ab", mode=9)])
+
+    reloaded = await LiveDanmakuLog(str(tmp_path)).timeline(7)
+
+    assert served(reloaded) == ([1.0, 1.5, 2.0], ["a", "ab", "b"])
+    # Invalid modes are stored as scrolling comments
+    assert reloaded.tail_comments[1]["p"].split(",")[1] == "1"
+
+
+async def test_compaction_writes_a_segment(log, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "live_danmaku_compact_records", 3)
+
+    await log.append(3, [live(3.0, "c"), live(1.0, "a")])
+    await log.append(3, [live(2.0, "b")])
+    await log.append(3, [live(0.5, "first")])
+
+    timeline = await log.timeline(3)
+    assert log.compactions == 1
+    assert timeline.generation == 1
+    assert timeline.times == [1.0, 2.0, 3.0]
+    assert served(timeline) == ([0.5, 1.0, 2.0, 3.0], ["first", "a", "b", "c"])
+    assert sorted(os.listdir(tmp_path / "3")) == ["lock", "segment", "tail.1"]
+
+    reloaded = await LiveDanmakuLog(str(tmp_path)).timeline(3)
+    assert reloaded.generation == 1
+    assert served(reloaded) == served(timeline)
+    # Sequence numbers survive compaction
+    assert sorted(c["cid"] for c in reloaded.comments + reloaded.tail_comments) == [-4, -3, -2, -1]
+
+
+async def test_append_truncates_a_partial_tail_record(log, tmp_path):
+    await log.append(2, [live(1.0, "kept")])
+    tail = tmp_path / "2" / "tail.0"
+    size = tail.stat().st_size
+    with open(tail, "ab") as f:
+        f.write(b"\x00" * 7)
+
+    other = LiveDanmakuLog(str(tmp_path))
+    assert served(await other.timeline(2)) == ([1.0], ["kept"])
+
+    await other.append(2, [live(2.0, "next")])
+    assert tail.stat().st_size == 2 * size
+    assert served(await LiveDanmakuLog(str(tmp_path)).timeline(2)) == ([1.0, 2.0], ["kept", "next"])
+
+
+async def test_workers_sharing_a_log_see_each_others_comments(log, tmp_path):
+    other = LiveDanmakuLog(str(tmp_path))
+    await log.timeline(4)
+    await other.timeline(4)
+
+    await log.append(4, [live(2.0, "first worker")])
+    await other.append(4, [live(1.0, "second worker")])
+    await log.append(4, [live(3.0, "first again")])
+
+    for worker in (log, other, LiveDanmakuLog(str(tmp_path))):
+        timeline = await worker.timeline(4)
+        assert served(timeline) == ([1.0, 2.0, 3.0], ["second worker", "first worker", "first again"])
+        # Sequence numbers are assigned once across workers
+        assert sorted(c["cid"] for c in timeline.tail_comments) == [-3, -2, -1]
+    # The tail was read incrementally, not reloaded
+    assert log.reloads == 0
+
+
+async def test_concurrent_appends_from_two_workers(log, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "live_danmaku_compact_records", 7)
+    other = LiveDanmakuLog(str(tmp_path))
+
+    await asyncio.gather(*(
+        worker.append(6, [live(i, f"{i}")])
+        for i in range(20)
+        for worker in (log, other)
+    ))
+
+    timeline = await LiveDanmakuLog(str(tmp_path)).timeline(6)
+    assert len(timeline) == 40
+    assert sorted(c["cid"] for c in timeline.comments + timeline.tail_comments) == list(range(-40, 0))
+
+
+async def test_compaction_by_one_worker_keeps_the_others_records(log, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "live_danmaku_compact_records", 3)
+    other = LiveDanmakuLog(str(tmp_path))
+
+    await log.append(5, [live(1.0, "a"), live(2.0, "b")])
+    await other.timeline(5)
+    await other.append(5, [live(3.0, "c")])
+    await log.append(5, [live(4.0, "d")])
+
+    assert other.compactions == 1
+    assert log.reloads == 1
+    for worker in (log, other, LiveDanmakuLog(str(tmp_path))):
+        timeline = await worker.timeline(5)
+        assert timeline.generation == 1
+        assert served(timeline) == ([1.0, 2.0, 3.0, 4.0], ["a", "b", "c", "d"])
+        assert sorted(c["cid"] for c in timeline.comments + timeline.tail_comments) == [-4, -3, -2, -1]
+
+
+async def test_window_limits_timeline_by_time(log):
+    await log.append(1, [live(t, str(t)) for t in (1.0, 2.0, 3.0, 4.0)])
+
+    window = (await log.timeline(1)).window(2.0, 4.0)
+
+    assert merge_timelines(*window)[0] == [2.0, 3.0]
+
+
+async def test_disabled_log_stores_nothing(log, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "live_danmaku_log_enabled", False)
+
+    assert await log.append(1, [live(1.0, "a")]) == 0
+    assert len(await log.timeline(1)) == 0
+    assert not os.listdir(tmp_path)
+
+
+def test_live_episode_id():
+    assert live_episode_id("episode:42") == 42
+    assert live_episode_id("episode:abc") is None
+    assert live_episode_id("lobby") is None
+    assert live_episode_id(None) is None
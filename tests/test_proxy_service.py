@@ -0,0 +1,133 @@
+"""Tests for upstream retries, failover and circuit breaking in the API proxy"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.core.exceptions import UpstreamUnavailableException
+from app.services.proxy_service import DanDanAPIProxy
+
+PROXY = "https://proxy.test/api/v2"
+OFFICIAL = "https://official.test/api/v2"
+
+
+class Upstream:
+    """Mock transport answering with queued responses per host, recording calls"""
+
+    def __init__(self):
+        self.calls = []
+        self.responses = {"proxy.test": [], "official.test": []}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request.url.host)
+        queued = self.responses[request.url.host]
+        response = queued.pop(0) if queued else 200
+        if isinstance(response, Exception):
+            raise response
+        return httpx.Response(response, json={"success": response == 200, "host": request.url.host})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(settings, "dandan_proxy_url", PROXY)
+    monkeypatch.setattr(settings, "dandan_api_base_url", OFFICIAL)
+    monkeypatch.setattr(settings, "upstream_retries", 2)
+    monkeypatch.setattr(settings, "upstream_backoff_base", 0)
+    monkeypatch.setattr(settings, "breaker_min_requests", 2)
+    monkeypatch.setattr(settings, "breaker_error_threshold", 0.5)
+    return Upstream()
+
+
+@pytest.fixture
+def proxy(upstream) -> DanDanAPIProxy:
+    return DanDanAPIProxy(httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+
+
+async def test_prefers_the_proxy(proxy, upstream):
+    response = await proxy._send("GET", "/comment/1")
+
+    assert response.json()["host"] == "proxy.test"
+    assert upstream.calls == ["proxy.test"]
+
+
+@pytest.mark.parametrize("failure", [503, 429, httpx.ConnectError("refused")])
+async def test_upstream_failure_fails_over_to_the_official_api(proxy, upstream, failure):
+    upstream.responses["proxy.test"] = [failure]
+
+    response = await proxy._send("GET", "/comment/1")
+
+    assert response.json()["host"] == "official.test"
+    assert upstream.calls == ["proxy.test", "official.test"]
+
+
+async def test_rejected_request_is_not_retried(proxy, upstream):
+    upstream.responses["proxy.test"] = [404]
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        await proxy._send("GET", "/comment/1")
+
+    assert error.value.response.status_code == 404
+    assert upstream.calls == ["proxy.test"]
+    assert proxy.breaker(PROXY).error_rate() == 0.0
+
+
+async def test_gives_up_after_the_retries(proxy, upstream, monkeypatch):
+    monkeypatch.setattr(settings, "breaker_min_requests", 100)
+    upstream.responses["proxy.test"] = [502, 502]
+    upstream.responses["official.test"] = [503]
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        await proxy._send("GET", "/comment/1")
+
+    # Every retry starts from the next upstream
+    assert upstream.calls == ["proxy.test", "official.test", "proxy.test"]
+    assert error.value.response.status_code == 502
+
+
+async def test_open_breaker_skips_its_upstream(proxy, upstream):
+    upstream.responses["proxy.test"] = [500, 500]
+    await proxy._send("GET", "/comment/1")
+    await proxy._send("GET", "/comment/2")
+    assert proxy.breaker(PROXY).state == "open"
+    upstream.calls.clear()
+
+    response = await proxy._send("GET", "/comment/3")
+
+    assert response.json()["host"] == "official.test"
+    assert upstream.calls == ["official.test"]
+
+
+async def test_every_breaker_open_raises_unavailable(proxy, upstream):
+    for url in (PROXY, OFFICIAL):
+        breaker = proxy.breaker(url)
+        breaker.record(False)
+        breaker.record(False)
+
+    with pytest.raises(UpstreamUnavailableException):
+        await proxy._send("GET", "/comment/1")
+    assert upstream.calls == []
+
+
+async def test_without_a_proxy_retries_the_official_api(proxy, upstream, monkeypatch):
+    monkeypatch.setattr(settings, "dandan_proxy_url", None)
+    upstream.responses["official.test"] = [httpx.ReadTimeout("slow")]
+
+    response = await proxy._send("GET", "/comment/1")
+
+    assert response.json()["host"] == "official.test"
+    assert upstream.calls == ["official.test", "official.test"]
+
+
+async def test_comments_fall_back_to_stale_cache(proxy, upstream, monkeypatch):
+    monkeypatch.setattr(settings, "comment_cache_enabled", True)
+    monkeypatch.setattr(settings, "comment_cache_ttl", 0.01)
+    monkeypatch.setattr(settings, "breaker_min_requests", 100)
+    proxy.comment_cache.stale_ttl = 3600
+    first = await proxy.get_comments(1)
+    await asyncio.sleep(0.02)
+    upstream.responses["proxy.test"] = [503, 503]
+    upstream.responses["official.test"] = [503]
+
+    assert await proxy.get_comments(1) is first
+    assert upstream.calls == ["proxy.test", "proxy.test", "official.test", "proxy.test"]
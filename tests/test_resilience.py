@@ -0,0 +1,130 @@
+"""Tests for the circuit breaker, backoff and failure classification"""
+import httpx
+import pytest
+
+from app.config import settings
+from app.core.exceptions import UpstreamUnavailableException
+from app.services.resilience import (
+    CircuitBreaker,
+    LatencyTracker,
+    backoff_delay,
+    endpoint_name,
+    is_upstream_failure
+)
+
+
+@pytest.fixture
+def breaker(clock, monkeypatch) -> CircuitBreaker:
+    monkeypatch.setattr(settings, "breaker_min_requests", 4)
+    monkeypatch.setattr(settings, "breaker_error_threshold", 0.5)
+    monkeypatch.setattr(settings, "breaker_window", 30)
+    monkeypatch.setattr(settings, "breaker_cooldown", 10)
+    return CircuitBreaker("upstream")
+
+
+def trip(breaker: CircuitBreaker):
+    for ok in (True, True, False, False):
+        breaker.record(ok)
+
+
+def test_opens_at_the_error_threshold(breaker):
+    for ok in (True, True, False):
+        breaker.record(ok)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record(False)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 1
+    assert not breaker.allow()
+
+
+def test_needs_enough_calls_to_open(breaker):
+    breaker.record(False)
+    breaker.record(False)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_old_outcomes_leave_the_window(breaker, clock):
+    breaker.record(False)
+    breaker.record(False)
+    clock.advance(31)
+    for ok in (True, True, True, False):
+        breaker.record(ok)
+
+    assert breaker.error_rate() == pytest.approx(0.25)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_closes_on_success(breaker, clock):
+    trip(breaker)
+    clock.advance(9.9)
+    assert not breaker.allow()
+
+    clock.advance(0.1)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one trial per cooldown
+    assert not breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.error_rate() == 0.0
+    assert breaker.allow()
+
+
+def test_half_open_trial_reopens_on_failure(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    assert breaker.allow()
+
+    breaker.record(False)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.advance(10)
+    assert breaker.allow()
+    assert breaker.trips == 1
+
+
+def test_backoff_delay_is_jittered_and_capped(monkeypatch):
+    monkeypatch.setattr(settings, "upstream_backoff_base", 0.2)
+    monkeypatch.setattr(settings, "upstream_backoff_max", 1.0)
+
+    for attempt, cap in ((0, 0.2), (1, 0.4), (2, 0.8), (5, 1.0)):
+        delays = [backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+
+def test_is_upstream_failure():
+    request = httpx.Request("GET", "https://upstream.test/comment/1")
+
+    def status_error(code):
+        return httpx.HTTPStatusError("error", request=request, response=httpx.Response(code, request=request))
+
+    assert is_upstream_failure(UpstreamUnavailableException())
+    assert is_upstream_failure(httpx.ConnectError("refused", request=request))
+    assert is_upstream_failure(status_error(503))
+    assert is_upstream_failure(status_error(429))
+    assert not is_upstream_failure(status_error(404))
+    assert not is_upstream_failure(ValueError())
+
+
+def test_latency_tracker_adapts_the_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "upstream_timeout_min", 1.0)
+    monkeypatch.setattr(settings, "upstream_timeout_max", 30.0)
+    monkeypatch.setattr(settings, "upstream_timeout_factor", 3.0)
+    tracker = LatencyTracker()
+    endpoint = endpoint_name("GET", "/comment/123")
+
+    assert endpoint == "GET /comment/{id}"
+    assert tracker.timeout(endpoint) == 30.0
+    for _ in range(tracker.min_samples):
+        tracker.record(endpoint, 0.5, ok=True)
+    tracker.record(endpoint, 60, ok=False)
+
+    assert tracker.timeout(endpoint) == pytest.approx(1.5)
+    assert tracker.stats()[endpoint]["errors"] == 1
@@ -0,0 +1,55 @@
+"""Tests for applying saved user settings"""
+import json
+
+import pytest
+
+from app.api import settings as settings_api
+from app.config import settings
+from app.services.state_backend import shared_state
+
+
+@pytest.fixture
+async def settings_file(tmp_path, monkeypatch):
+    path = tmp_path / "user_settings.json"
+    monkeypatch.setattr(settings_api, "SETTINGS_FILE", path)
+    # Restored after the test, whatever gets applied
+    monkeypatch.setattr(settings, "comment_cache_enabled", True)
+    monkeypatch.setattr(settings, "comment_cache_ttl", 86400)
+    monkeypatch.setattr(settings, "max_upload_size", 5 * 1024 ** 3)
+    monkeypatch.setattr(settings, "dandan_proxy_url", "https://proxy.example")
+    monkeypatch.setattr(settings, "debug", False)
+    yield path
+    await shared_state.delete(settings_api.SETTINGS_NAMESPACE, settings_api.SETTINGS_KEY)
+
+
+async def test_settings_file_is_applied_at_startup(settings_file):
+    settings_file.write_text(json.dumps({"network": {"enableCache": False, "cacheExpiry": 60}}))
+
+    await settings_api.load_shared_settings()
+
+    assert settings.comment_cache_enabled is False
+    assert settings.comment_cache_ttl == 60
+    assert (await settings_api.get_settings())["network"]["cacheExpiry"] == 60
+
+
+async def test_startup_keeps_the_server_configuration(settings_file):
+    settings_file.write_text(json.dumps({
+        "network": {"useProxy": False, "proxyUrl": "", "apiServer": "https://other.example", "cacheExpiry": 60},
+        "advanced": {"maxUploadSize": 500, "debugMode": True}
+    }))
+    api_base_url = settings.dandan_api_base_url
+
+    await settings_api.load_shared_settings()
+
+    assert settings.comment_cache_ttl == 60
+    assert settings.max_upload_size == 5 * 1024 ** 3
+    assert settings.dandan_proxy_url == "https://proxy.example"
+    assert settings.dandan_api_base_url == api_base_url
+    assert settings.debug is False
+
+
+async def test_startup_without_saved_settings_keeps_defaults(settings_file):
+    await settings_api.load_shared_settings()
+
+    assert settings.comment_cache_enabled is True
+    assert settings.comment_cache_ttl == 86400
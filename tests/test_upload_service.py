@@ -0,0 +1,123 @@
+"""Tests for the streaming upload receiver"""
+import hashlib
+import os
+
+import pytest
+
+from app.core.exceptions import InvalidUploadException, UploadTooLargeException
+from app.services.md5_service import DANDAN_HASH_SIZE
+from app.services.upload_service import StreamingUploadReceiver
+
+BOUNDARY = "testboundary"
+
+
+def multipart(data: bytes, filename: str = "episode.mkv", content_type: str = "video/x-matroska") -> bytes:
+    return b"".join((
+        f"--{BOUNDARY}\r\n".encode(),
+        b'Content-Disposition: form-data; name="note"\r\n\r\nhello\r\n',
+        f"--{BOUNDARY}\r\n".encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+        f"Content-Type: {content_type}\r\n\r\n".encode(),
+        data,
+        f"\r\n--{BOUNDARY}--\r\n".encode()
+    ))
+
+
+async def chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def headers(body: bytes) -> dict:
+    return {
+        "content-type": f"multipart/form-data; boundary={BOUNDARY}",
+        "content-length": str(len(body))
+    }
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 4096, 1 << 20])
+async def test_streams_file_part_to_disk(tmp_path, read_size):
+    data = os.urandom(100_000)
+    body = multipart(data)
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=1 << 30, chunk_size=8192)
+
+    upload = await receiver.receive(headers(body), chunked(body, read_size))
+
+    assert upload.name == "episode.mkv"
+    assert upload.size == len(data)
+    assert upload.path.endswith(".mkv")
+    with open(upload.path, "rb") as f:
+        assert f.read() == data
+    assert upload.md5 == hashlib.md5(data).hexdigest()
+
+
+async def test_md5_covers_only_the_first_16mb(tmp_path):
+    data = os.urandom(DANDAN_HASH_SIZE + 1000)
+    body = multipart(data)
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=1 << 30)
+
+    upload = await receiver.receive(headers(body), chunked(body, 1 << 20))
+
+    assert upload.md5 == hashlib.md5(data[:DANDAN_HASH_SIZE]).hexdigest()
+
+
+async def test_rejects_oversized_upload_while_streaming(tmp_path):
+    body = multipart(os.urandom(200_000))
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=100_000)
+    # No content-length, so the limit can only be enforced on the stream
+    stream_headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+    with pytest.raises(UploadTooLargeException):
+        await receiver.receive(stream_headers, chunked(body, 4096))
+
+    assert os.listdir(tmp_path) == []
+
+
+async def test_rejects_declared_oversized_body_before_reading(tmp_path):
+    body = multipart(os.urandom(10))
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=10)
+
+    async def never_read():
+        raise AssertionError("body should not be read")
+        yield b""
+
+    with pytest.raises(UploadTooLargeException):
+        await receiver.receive({**headers(body), "content-length": str(1 << 30)}, never_read())
+
+
+async def test_rejects_non_video_file(tmp_path):
+    body = multipart(b"text", filename="notes.txt", content_type="text/plain")
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=1 << 20)
+
+    with pytest.raises(InvalidUploadException):
+        await receiver.receive(headers(body), chunked(body, 1024))
+
+    assert os.listdir(tmp_path) == []
+
+
+async def test_accepts_video_extension_without_video_content_type(tmp_path):
+    body = multipart(b"frames", filename="clip.mp4", content_type="application/octet-stream")
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=1 << 20)
+
+    upload = await receiver.receive(headers(body), chunked(body, 1024))
+
+    assert upload.size == 6
+
+
+async def test_rejects_body_without_file_part(tmp_path):
+    body = (
+        f"--{BOUNDARY}\r\n".encode()
+        + b'Content-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+        + f"--{BOUNDARY}--\r\n".encode()
+    )
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=1 << 20)
+
+    with pytest.raises(InvalidUploadException):
+        await receiver.receive(headers(body), chunked(body, 1024))
+
+
+async def test_rejects_non_multipart_request(tmp_path):
+    receiver = StreamingUploadReceiver(str(tmp_path), max_size=1 << 20)
+
+    with pytest.raises(InvalidUploadException):
+        await receiver.receive({"content-type": "application/json"}, chunked(b"{}", 2))